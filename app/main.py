@@ -181,16 +181,29 @@
 import os
 import json
 import asyncio
+import functools
 import time
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import JSONResponse
+from uuid import uuid4
+import anyio
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
-
-from .models.model import SubscribeMsg, UnsubscribeMsg, PublishMsg
-from .pubsub_engine.pubsub import manager
-from .utils.logger_wrapper import log_async_exceptions
-from .utils.util import make_ack, make_error, make_event, make_pong
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+
+from .models.model import CreditMsg, SessionMsg, SubscribeMsg, UnsubscribeMsg
+from .models.ingress import parse_batch_item, parse_publish, parse_publish_batch
+from .pubsub_engine.pubsub import ROUND_ROBIN, Event, manager, matches
+from .pubsub_engine.dedup import DUPLICATE, Duplicate
+from .pubsub_engine.connection import Connection
+from .pubsub_engine.relay import Relay
+from .pubsub_engine.sessions import SessionStore
+from .pubsub_engine.cluster import ClusterNode, parse_nodes
+from .pubsub_engine.trie import is_pattern, validate_pattern
+from .pubsub_engine.filters import FilterError, compile_filter
+from .utils import config, metrics
+from .utils.logger_wrapper import log_async_exceptions, logger
+from .utils.util import BINARY_SUBPROTOCOL, decode_binary, make_ack, make_batch_ack, make_error, make_info, make_pong, make_session
 
 app = FastAPI(title="pubsub-backend")
 
@@ -201,84 +214,467 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+REPLAY_CHUNK = 500  # frames queued before waiting for the writer during a replay
+
+sessions = SessionStore(manager, config.SESSION_GRACE_MS)
+
+async def _log_tick_loop():
+    while True:
+        await asyncio.sleep(config.FSYNC_INTERVAL_MS / 1000.0)
+        manager.tick_logs()
+
 @app.on_event("startup")
 async def startup_event():
     app.state.started_at = time.time()
+    if config.WORKERS > 1:
+        if config.PERSIST_DIR:
+            # every worker would append to the same segment files
+            logger.warning("PERSIST_DIR is not supported with WORKERS > 1; persistence disabled")
+            config.PERSIST_DIR = ""
+        manager.relay = Relay(manager, config.RELAY_SOCKET, buffer_items=config.RELAY_BUFFER)
+        await manager.relay.start()
+    if config.CLUSTER_NODES:
+        if config.WORKERS > 1:
+            logger.warning("cluster mode expects WORKERS=1; each worker would join as the same node")
+        manager.cluster = ClusterNode(manager, config.NODE_ID, parse_nodes(config.CLUSTER_NODES),
+                                      token=config.CLUSTER_TOKEN)
+        manager.cluster.start()
+    if config.PERSIST_DIR:
+        await manager.load_persisted()
+        app.state.log_tick = asyncio.create_task(_log_tick_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if task := getattr(app.state, "log_tick", None):
+        task.cancel()
+    if manager.relay is not None:
+        await manager.relay.stop()
+    if manager.cluster is not None:
+        manager.cluster.stop()
+    manager.close_logs()
+
+async def _send_events(conn: Connection, sub, events) -> int:
+    """Queue history events that pass sub's filter; returns how many were read."""
+    read = 0
+    for read, ev in enumerate(events, 1):
+        if sub.predicate is not None and not matches(sub.predicate, ev.message):
+            continue
+        conn.send_event(ev)
+        if read % REPLAY_CHUNK == 0:
+            await conn.flush()
+    return read
+
+async def replay_history(conn: Connection, sub, topic_name: str, after_seq: Optional[int],
+                         upto: Optional[int] = None, last_n: int = 0) -> int:
+    """Send history after after_seq, holding the live subscription back until it is done.
+
+    With after_seq None the last last_n events are sent. upto is the last
+    seq published before the subscription started taking live events;
+    later ones are already queued for it. It defaults to now, which is
+    right when nothing was awaited since subscribing. Returns how many
+    events of the range are no longer retained.
+    """
+    sub.paused = True
+    try:
+        if manager.cluster is not None and not manager.cluster.owns(topic_name):
+            return await _replay_from_owner(conn, sub, topic_name, after_seq, upto, last_n)
+        if upto is None:
+            upto = manager.last_seq(topic_name)
+        if after_seq is None:
+            after_seq = max(0, upto - last_n)
+        read = await _send_events(conn, sub, manager.iter_history(topic_name, after_seq, upto, events=True))
+        return max(0, upto - after_seq - read)
+    finally:
+        sub.paused = False
+        sub.wake()
+
+async def _replay_from_owner(conn: Connection, sub, topic_name: str, after_seq: Optional[int],
+                             upto: Optional[int], last_n: int) -> int:
+    # the local ring only mirrors what the owner sent since this node subscribed there. The
+    # node subscription is requested on the same link before these pages, so everything after
+    # the owner's upto arrives live; live events at or before it are dropped as replayed
+    read = 0
+    start = None
+    try:
+        while True:
+            page = await manager.cluster.fetch_history(topic_name, after_seq, upto, last_n, REPLAY_CHUNK)
+            if start is None:
+                start = page["after"]
+            upto = page["upto"]
+            frames = page["frames"]
+            read += await _send_events(conn, sub, map(Event.from_frame, frames))
+            if len(frames) < REPLAY_CHUNK:
+                break
+            after_seq = json.loads(frames[-1])["seq"]
+    except (ConnectionError, asyncio.TimeoutError, KeyError):
+        conn.send(make_error("UNAVAILABLE", "history unavailable: topic owner unreachable", topic=topic_name))
+        return 0
+    sub.discard_through(upto)
+    return max(0, upto - start - read)
+
+async def resume_subscription(conn: Connection, sub, after_seq: Optional[int]) -> Optional[int]:
+    """Hand a parked subscription to conn, continuing after after_seq; return how many events of the gap are gone.
+
+    Queued events up to after_seq are dropped. Events between after_seq and
+    the oldest one still queued (in flight when the socket dropped, or pushed
+    out of the queue while parked) are replayed from history first. Patterns
+    and group members have no single seq line to replay, so they get their
+    queue as is and None is returned, as it is without after_seq.
+    """
+    sub.paused = True
+    sub.parked = False
+    try:
+        if after_seq is None or is_pattern(sub.topic):
+            return None
+        oldest = sub.discard_through(after_seq)
+        if sub.group is not None:
+            return None
+        return await replay_history(conn, sub, sub.topic, after_seq, None if oldest is None else oldest - 1)
+    finally:
+        sub.paused = False
+        sub.wake()
+
+def subscribe_problem(msg: SubscribeMsg) -> Optional[Tuple[str, str]]:
+    """(error code, message) if msg cannot be subscribed as given, else None."""
+    if is_pattern(msg.topic):
+        # patterns match topics that exist now or later; seqs are per topic, so no replay
+        problem = validate_pattern(msg.topic)
+        if problem is None and (msg.since_seq is not None or msg.last_n):
+            problem = "history replay is not supported for pattern subscriptions"
+        if problem is None and msg.group is not None:
+            problem = "consumer groups are not supported for pattern subscriptions"
+        return ("BAD_REQUEST", problem) if problem is not None else None
+    if not manager.has_topic(msg.topic):
+        return "TOPIC_NOT_FOUND", "topic does not exist"
+    if msg.group is not None:
+        # members share one stream; replaying history to each would duplicate it
+        group = manager.get_group(msg.topic, msg.group)
+        if msg.since_seq is not None or msg.last_n:
+            return "BAD_REQUEST", "history replay is not supported for consumer groups"
+        if group is not None and msg.balance and msg.balance != group.strategy:
+            return "BAD_REQUEST", f"group {msg.group} uses {group.strategy}"
+    return None
+
+async def open_subscription(msg: SubscribeMsg, ws, conn: Connection, predicate, **options):
+    existing = manager.get_subscriber(msg.topic, msg.client_id)
+    if existing is not None and existing.parked:
+        # the client came back without resuming its session: start over rather than inherit a detached queue
+        await manager.unsubscribe(msg.topic, msg.client_id)
+    return await manager.subscribe(msg.topic, msg.client_id, ws, conn=conn,
+                                   batch_max=msg.batch_max or 0, linger_ms=msg.linger_ms or 0,
+                                   predicate=predicate, compress=bool(msg.compress),
+                                   policy=msg.policy or config.BACKPRESSURE_POLICY, credits=msg.credits,
+                                   group=msg.group, balance=msg.balance or ROUND_ROBIN, **options)
+
+async def send_history(conn: Connection, sub, msg: SubscribeMsg, upto: Optional[int] = None):
+    """Whatever a new subscription gets before live events: since_seq/last_n replay or a snapshot.
+
+    Releases sub afterwards even if there was nothing to send, since a
+    caller may have paused it to pin upto.
+    """
+    try:
+        if msg.since_seq is not None:
+            await replay_history(conn, sub, msg.topic, msg.since_seq, upto)
+        elif not is_pattern(msg.topic) and getattr(manager.get_topic(msg.topic), "compact_key", None):
+            # compacted topic: the key table replaces last_n
+            if msg.snapshot is not False and msg.group is None:
+                await send_snapshot(conn, sub, msg.topic, upto)
+        elif getattr(msg, "last_n", 0):
+            await replay_history(conn, sub, msg.topic, None, upto, last_n=int(msg.last_n))
+    finally:
+        sub.paused = False
+        sub.wake()
+
+async def send_snapshot(conn: Connection, sub, topic_name: str, upto: Optional[int] = None):
+    """Send the newest event per key of a compacted topic, then a snapshot_end info frame."""
+    sub.paused = True
+    try:
+        for n, ev in enumerate(manager.snapshot(topic_name), 1):
+            if upto is not None and ev.seq > upto:
+                continue  # already queued live
+            if sub.predicate is not None and not matches(sub.predicate, ev.message):
+                continue
+            conn.send_event(ev)
+            if n % REPLAY_CHUNK == 0:
+                await conn.flush()
+        conn.send(make_info("snapshot_end", topic_name))
+    finally:
+        sub.paused = False
+        sub.wake()
 
 @app.post("/topics")
 async def create_topic(payload: dict):
     name = payload.get("name")
     if not name:
         raise HTTPException(status_code=400, detail="name required")
-    ok = await manager.create_topic(name)
+    if is_pattern(name):
+        raise HTTPException(status_code=400, detail="topic names cannot contain '*' or '#'")
+    compact_key = payload.get("compact_key")
+    if compact_key is not None and (not isinstance(compact_key, str) or not compact_key):
+        raise HTTPException(status_code=400, detail="compact_key must be a non-empty payload path")
+    try:
+        ok = await manager.create_topic(name, compact_key=compact_key)
+    except (ConnectionError, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="topic relay unavailable")
     if not ok:
         return JSONResponse(status_code=409, content={"detail": "topic exists"})
-    return {"status": "created", "topic": name}
+    out = {"status": "created", "topic": name}
+    if compact_key:
+        out["compact_key"] = compact_key
+    return out
 
 @app.get("/topics")
 @log_async_exceptions
 async def list_topics():
-    stats = await manager.get_stats()
-    topics = [{"name": name, "subscribers": v.get("subscribers", 0)} for name, v in stats.items()]
+    topics = [{"name": name, "subscribers": len(t.subscribers), **({"compact_key": t.compact_key} if t.compact_key else {})}
+              for name, t in list(manager.topics.items())]
     return {"topics": topics}
 
 @app.delete("/topics/{name}")
 @log_async_exceptions
 async def delete_topic(name: str):
-    ok = await manager.delete_topic(name)
+    try:
+        ok = await manager.delete_topic(name)
+    except (ConnectionError, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="topic relay unavailable")
     if not ok:
         raise HTTPException(status_code=404, detail="topic not found")
     return {"status": "deleted", "topic": name}
 
+MAX_REPORTED_ERRORS = 100  # per NDJSON publish response; the rest are only counted
+
+@app.post("/topics/{name}/messages")
+async def publish_messages(name: str, request: Request):
+    """Bulk publish an NDJSON body: one {"id", "payload"} message per line.
+
+    The body is read as it arrives and published every NDJSON_BATCH lines,
+    so memory stays bounded by the batch, not the request. Lines are
+    numbered from 1; blank lines are skipped.
+    """
+    if not manager.has_topic(name):
+        raise HTTPException(status_code=404, detail="topic not found")
+    summary: Dict[str, Any] = {"topic": name, "accepted": 0, "duplicates": 0, "failed": 0,
+                               "first_seq": None, "last_seq": None, "errors": []}
+    pending: List[Tuple[int, Dict[str, Any]]] = []
+
+    def fail(line: int, code: str, message: str):
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"line": line, "error": {"code": code, "message": message}})
+
+    def take(line: int, raw: bytes):
+        if not raw.strip():
+            return
+        try:
+            _, m = parse_batch_item({"message": json.loads(raw)})
+        except ValueError as e:  # bad JSON, or a ValidationError
+            fail(line, "BAD_REQUEST", str(e))
+            return
+        pending.append((line, m))
+
+    async def flush():
+        seqs = await manager.publish_many([(name, m) for _, m in pending])
+        for (line, _), seq in zip(pending, seqs):
+            if seq is None:
+                fail(line, "TOPIC_NOT_FOUND", "topic does not exist")
+            elif isinstance(seq, Duplicate):
+                summary["duplicates"] += 1
+            else:
+                summary["accepted"] += 1
+                if summary["first_seq"] is None:
+                    summary["first_seq"] = seq
+                summary["last_seq"] = seq
+        pending.clear()
+
+    buf = b""
+    line = 0
+    skipping = False  # inside a line that was already rejected as too long
+    async for chunk in request.stream():
+        lines = (buf + chunk).split(b"\n")
+        buf = lines.pop()
+        for raw in lines:
+            line += 1
+            if skipping:
+                skipping = False
+                continue
+            take(line, raw)
+        if len(buf) > config.NDJSON_MAX_LINE_BYTES:
+            if not skipping:
+                fail(line + 1, "PAYLOAD_TOO_LARGE", f"line exceeds {config.NDJSON_MAX_LINE_BYTES} bytes")
+            buf, skipping = b"", True
+        if len(pending) >= config.NDJSON_BATCH:
+            await flush()
+    if buf.strip() and not skipping:
+        take(line + 1, buf)
+    if pending:
+        await flush()
+    summary["status"] = "partial" if summary["failed"] else "ok"
+    return summary
+
+STREAM_FORMATS = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+@app.get("/topics/{name}/stream")
+async def stream_topic(name: str, request: Request, format: Optional[str] = None, client_id: Optional[str] = None,
+                       last_n: int = 0, since_seq: Optional[int] = None, batch_max: Optional[int] = None,
+                       linger_ms: Optional[int] = None, filter: Optional[str] = None, policy: Optional[str] = None,
+                       group: Optional[str] = None, balance: Optional[str] = None, snapshot: Optional[bool] = None):
+    """Subscribe over plain HTTP: the frames a WebSocket subscriber would get, as SSE or NDJSON.
+
+    Query parameters are the subscribe fields (filter as JSON). The stream
+    uses a Connection like /ws does, so events are the same pre-encoded
+    frames from the same bounded queue.
+    """
+    if format is None:
+        format = "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+    if format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be sse or ndjson")
+    try:
+        msg = SubscribeMsg(type="subscribe", topic=name, client_id=client_id or f"http-{uuid4().hex}",
+                           last_n=last_n, since_seq=since_seq, batch_max=batch_max, linger_ms=linger_ms,
+                           filter=json.loads(filter) if filter is not None else None, policy=policy,
+                           group=group, balance=balance, snapshot=snapshot)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    problem = subscribe_problem(msg)
+    if problem is not None:
+        raise HTTPException(status_code=404 if problem[0] == "TOPIC_NOT_FOUND" else 400, detail=problem[1])
+    if manager.get_subscriber(msg.topic, msg.client_id) is not None:
+        raise HTTPException(status_code=409, detail="client_id is already subscribed to this topic")
+    predicate = None
+    if msg.filter is not None:
+        try:
+            predicate = compile_filter(msg.filter)
+        except FilterError as e:
+            raise HTTPException(status_code=400, detail=f"invalid filter: {e}")
+
+    conn = Connection(None)
+    sub = await open_subscription(msg, None, conn, predicate)
+    # history is sent once the response starts; until then hold live events back and remember
+    # where they begin, so nothing published in between is both replayed and queued
+    sub.paused = True
+    # a topic owned by another cluster node replays from the owner, which ends the range itself
+    upto = manager.last_seq(msg.topic) if manager.cluster is None or manager.cluster.owns(msg.topic) else None
+    conn.send(make_ack(None, msg.topic))
+    if format == "sse":
+        encode, keepalive = (lambda frame: f"data: {frame}\n\n"), ": keepalive\n\n"
+    else:
+        encode, keepalive = (lambda frame: frame + "\n"), "\n"
+
+    async def body():
+        history = asyncio.create_task(send_history(conn, sub, msg, upto))
+        frames = conn.frames().__aiter__()
+        nxt = None
+        try:
+            # a subscription closed by the server (topic deleted, slow consumer) queues nothing more,
+            # so this is checked on keepalive wakeups too: the stream ends within STREAM_KEEPALIVE_S
+            while manager.get_subscriber(msg.topic, msg.client_id) is sub:
+                if nxt is None:
+                    nxt = asyncio.ensure_future(frames.__anext__())
+                done, _ = await asyncio.wait((nxt,), timeout=config.STREAM_KEEPALIVE_S)
+                if not done:
+                    yield keepalive
+                    continue
+                try:
+                    batch = nxt.result()
+                except StopAsyncIteration:
+                    break
+                nxt = None
+                yield "".join(map(encode, batch))
+        finally:
+            history.cancel()
+            if nxt is not None:
+                nxt.cancel()
+            # the client may be gone and this task cancelled; cleanup must still run to the end
+            with anyio.CancelScope(shield=True):
+                if manager.get_subscriber(msg.topic, msg.client_id) is sub:
+                    await manager.unsubscribe(msg.topic, msg.client_id)
+            conn.close()
+
+    return StreamingResponse(body(), media_type=STREAM_FORMATS[format],
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/health")
 @log_async_exceptions
 async def health():
     started = getattr(app.state, "started_at", time.time())
     uptime = int(time.time() - started)
-    stats = await manager.get_stats()
-    topic_count = len(stats)
-    total_subscribers = sum(v.get("subscribers", 0) for v in stats.values())
+    summary = manager.get_summary()
     return JSONResponse(status_code=200, content={
         "uptime_sec": uptime,
-        "topics": topic_count,
-        "subscribers": total_subscribers,
+        "topics": summary["topics"],
+        "subscribers": summary["subscribers"],
     })
 
+@app.get("/cluster")
+@log_async_exceptions
+async def cluster_status():
+    if manager.cluster is None:
+        raise HTTPException(status_code=404, detail="cluster mode disabled")
+    return manager.cluster.status()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(manager.metric_families()),
+                             media_type="text/plain; version=0.0.4")
+
 @app.get("/stats")
 @log_async_exceptions
 async def stats():
     s = await manager.get_stats()
     return {"topics": s}
 
+async def publish_batch(topic: Optional[str], messages: List[Any], replicate: bool = True) -> List[Dict[str, Any]]:
+    """Validate and publish every entry of a publish_batch frame; one status per entry."""
+    errors: Dict[int, Dict[str, Any]] = {}
+    items: List[Optional[Tuple[Optional[str], Dict[str, Any]]]] = []
+    for i, raw in enumerate(messages):
+        try:
+            items.append(parse_batch_item(raw))
+        except ValidationError as e:
+            items.append(None)
+            errors[i] = {"code": "BAD_REQUEST", "message": str(e)}
+
+    pending, positions = [], []
+    for i, item in enumerate(items):
+        if item is None:
+            continue
+        item_topic = item[0] or topic
+        if not item_topic or not manager.has_topic(item_topic):
+            errors[i] = {"code": "TOPIC_NOT_FOUND", "message": "topic does not exist"}
+            continue
+        pending.append((item_topic, item[1]))
+        positions.append(i)
+
+    seqs = await manager.publish_many(pending, replicate=replicate)
+    results: List[Dict[str, Any]] = [{"index": i, "status": "error", "error": err} for i, err in errors.items()]
+    for i, (item_topic, _), seq in zip(positions, pending, seqs):
+        if seq is None:  # topic deleted mid-batch
+            results.append({"index": i, "status": "error", "error": {"code": "TOPIC_NOT_FOUND", "message": "topic does not exist"}})
+        elif isinstance(seq, Duplicate):
+            results.append({"index": i, "status": DUPLICATE, "topic": item_topic, "seq": int(seq)})
+        else:
+            results.append({"index": i, "status": "ok", "topic": item_topic, "seq": seq})
+    results.sort(key=lambda r: r["index"])
+    return results
+
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
-    await ws.accept()
+    # clients that offer the binary subprotocol get msgpack frames; everyone else keeps JSON text
+    binary = BINARY_SUBPROTOCOL in ws.scope.get("subprotocols", ())
+    await ws.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
     my_subscriptions: Dict[str, str] = {}
-    sender_tasks: Dict[str, asyncio.Task] = {}
-    active = True
-
-    async def subscriber_sender_task(sub):
-        """Continuously sends messages from sub.queue to the websocket."""
-        try:
-            while active:
-                item = await sub.queue.get()
-                if item is None:  # graceful exit signal
-                    break
-                message = item.get("message", item)
-                topic_name = getattr(sub, "topic_name", "unknown")
-                await ws.send_json(make_event(topic_name, message))
-        except asyncio.CancelledError:
-            # Graceful stop, don't raise
-            pass
-        except WebSocketDisconnect:
-            pass
-        except Exception:
-            pass
+    peer_node = None  # set when a cluster peer authenticates on this socket
+    session = None  # set once the client opens or resumes one; its subscriptions then outlive the socket
+    # one writer per socket drains every subscription of this connection
+    conn = Connection(ws.send_text, binary=binary, send_bytes=ws.send_bytes)
+    conn.start()
 
     try:
         while True:
-            raw = await ws.receive_text()
-            data = json.loads(raw)
+            if binary:
+                data = decode_binary(await ws.receive_bytes())
+            else:
+                data = json.loads(await ws.receive_text())
             t = data.get("type")
             request_id = data.get("request_id")
 
@@ -286,82 +682,174 @@ async def websocket_endpoint(ws: WebSocket):
                 try:
                     msg = SubscribeMsg(**data)
                 except Exception as e:
-                    await ws.send_json(make_error("BAD_REQUEST", str(e), request_id))
+                    conn.send(make_error("BAD_REQUEST", str(e), request_id))
                     continue
 
-                stats = await manager.get_stats()
-                if msg.topic not in stats:
-                    await ws.send_json(make_error("TOPIC_NOT_FOUND", "topic does not exist", request_id, topic=msg.topic))
+                problem = subscribe_problem(msg)
+                if problem is not None:
+                    conn.send(make_error(*problem, request_id, topic=msg.topic))
                     continue
 
-                sub = await manager.subscribe(msg.topic, msg.client_id, ws)
-                setattr(sub, "topic_name", msg.topic)
+                predicate = None
+                if msg.filter is not None:
+                    try:
+                        predicate = compile_filter(msg.filter)
+                    except FilterError as e:
+                        conn.send(make_error("BAD_REQUEST", f"invalid filter: {e}", request_id, topic=msg.topic))
+                        continue
+
+                options = {}
+                if peer_node:
+                    # a node link feeds every subscriber of the topic on that node: give it room, and count what it loses
+                    options = {"queue_maxsize": config.CLUSTER_QUEUE_SIZE,
+                               "on_drop": functools.partial(manager.cluster.peer_lost, peer_node, msg.topic)}
+                sub = await open_subscription(msg, ws, conn, predicate, **options)
                 my_subscriptions[msg.client_id] = msg.topic
 
-                if msg.client_id not in sender_tasks:
-                    sender_tasks[msg.client_id] = asyncio.create_task(subscriber_sender_task(sub))
-
-                await ws.send_json(make_ack(request_id, msg.topic))
-
-                if getattr(msg, "last_n", 0):
-                    last_items = await manager.get_last_n(msg.topic, int(msg.last_n))
-                    for item in last_items:
-                        await ws.send_json(make_event(msg.topic, item.get("message", item)))
+                conn.send(make_ack(request_id, msg.topic))
+                await send_history(conn, sub, msg)
                 continue
 
             elif t == "unsubscribe":
                 try:
                     msg = UnsubscribeMsg(**data)
                 except Exception as e:
-                    await ws.send_json(make_error("BAD_REQUEST", str(e), request_id))
+                    conn.send(make_error("BAD_REQUEST", str(e), request_id))
                     continue
 
                 ok = await manager.unsubscribe(msg.topic, msg.client_id)
                 topic = my_subscriptions.pop(msg.client_id, None)
-
-                if task := sender_tasks.pop(msg.client_id, None):
-                    task.cancel()
-                await ws.send_json(make_ack(request_id, topic or msg.topic))
+                conn.send(make_ack(request_id, topic or msg.topic))
                 continue
 
             elif t == "publish":
                 try:
-                    msg = PublishMsg(**data)
+                    topic, m = parse_publish(data)
                 except Exception as e:
-                    await ws.send_json(make_error("BAD_REQUEST", str(e), request_id))
+                    conn.send(make_error("BAD_REQUEST", str(e), request_id))
                     continue
 
-                stats = await manager.get_stats()
-                if msg.topic not in stats:
-                    await ws.send_json(make_error("TOPIC_NOT_FOUND", "topic does not exist", request_id, topic=msg.topic))
+                if not manager.has_topic(topic):
+                    conn.send(make_error("TOPIC_NOT_FOUND", "topic does not exist", request_id, topic=topic))
                     continue
 
-                m = {"id": str(msg.message.id), "payload": msg.message.payload}
-                ok = await manager.publish(msg.topic, m)
+                # a publish forwarded by a peer is already at its owner; never route it again
+                ok = await manager.publish(topic, m, replicate=not (peer_node and data.get("forwarded")))
                 if not ok:
-                    await ws.send_json(make_error("INTERNAL", "publish failed", request_id, topic=msg.topic))
+                    conn.send(make_error("INTERNAL", "publish failed", request_id, topic=topic))
                     continue
 
-                await ws.send_json(make_ack(request_id, msg.topic))
+                conn.send(make_ack(request_id, topic, status=DUPLICATE if ok == DUPLICATE else "ok"))
+                continue
+
+            elif t == "publish_batch":
+                try:
+                    topic, messages = parse_publish_batch(data)
+                except Exception as e:
+                    conn.send(make_error("BAD_REQUEST", str(e), request_id))
+                    continue
+
+                replicate = not (peer_node and data.get("forwarded"))
+                conn.send(make_batch_ack(request_id, await publish_batch(topic, messages, replicate=replicate)))
+                continue
+
+            elif t == "credit":
+                try:
+                    msg = CreditMsg(**data)
+                except Exception as e:
+                    conn.send(make_error("BAD_REQUEST", str(e), request_id))
+                    continue
+
+                sub = manager.get_subscriber(msg.topic, msg.client_id)
+                if sub is None or sub.conn is not conn:
+                    conn.send(make_error("BAD_REQUEST", "not subscribed", request_id, topic=msg.topic))
+                    continue
+                sub.grant(msg.n)
+                if request_id:  # credits are frequent; only ack when asked to
+                    conn.send(make_ack(request_id, msg.topic))
+                continue
+
+            elif t == "cluster":
+                if manager.cluster is None:
+                    conn.send(make_error("BAD_REQUEST", "cluster mode disabled", request_id))
+                    continue
+                if data.get("op") == "hello":
+                    if data.get("token", "") != config.CLUSTER_TOKEN:
+                        conn.send(make_error("FORBIDDEN", "bad cluster token", request_id))
+                        continue
+                    peer_node = data.get("node")
+                    continue
+                if not peer_node:
+                    conn.send(make_error("FORBIDDEN", "cluster hello required", request_id))
+                    continue
+                if data.get("op") == "history":
+                    conn.send({**manager.cluster.history_page(data), "request_id": request_id})
+                    continue
+                status = await manager.cluster.handle(data)
+                if status is not None:
+                    conn.send(make_ack(request_id, data.get("name"), status=status))
+                continue
+
+            elif t == "session":
+                try:
+                    msg = SessionMsg(**data)
+                except Exception as e:
+                    conn.send(make_error("BAD_REQUEST", str(e), request_id))
+                    continue
+
+                if not sessions.enabled:
+                    conn.send(make_error("BAD_REQUEST", "sessions are disabled", request_id))
+                    continue
+                if session is not None:
+                    conn.send(make_error("BAD_REQUEST", "this connection already has a session", request_id))
+                    continue
+                if msg.token is None:
+                    session = sessions.open()
+                    conn.send(make_session(request_id, session.token))
+                    continue
+
+                session = sessions.resume(msg.token)
+                if session is None:
+                    conn.send(make_error("SESSION_NOT_FOUND", "unknown or expired session", request_id))
+                    continue
+                resumed, lost = {}, []
+                for client_id, sub in session.subscriptions.items():
+                    # gone if its topic was deleted, or the client subscribed again without resuming
+                    if manager.get_subscriber(sub.topic, client_id) is not sub:
+                        lost.append(client_id)
+                        continue
+                    sub.paused = True  # held until its gap is sent
+                    sub.conn, sub.ws = conn, ws
+                    resumed[client_id] = sub
+                    my_subscriptions[client_id] = sub.topic
+                session.subscriptions = {}
+                conn.send(make_session(request_id, session.token, resumed=list(resumed), lost=lost))
+                for client_id, sub in resumed.items():
+                    missed = await resume_subscription(conn, sub, msg.positions.get(client_id))
+                    conn.send(make_info("resumed", sub.topic, client_id=client_id, missed=missed))
                 continue
 
             elif t == "ping":
-                await ws.send_json(make_pong(request_id))
+                conn.send(make_pong(request_id))
                 continue
 
             else:
-                await ws.send_json(make_error("BAD_REQUEST", f"unknown type: {t}", request_id))
+                conn.send(make_error("BAD_REQUEST", f"unknown type: {t}", request_id))
 
     except WebSocketDisconnect:
         pass  # don't raise, let cleanup handle
     finally:
-        active = False
-        for client_id, topic in list(my_subscriptions.items()):
-            try:
-                await manager.unsubscribe(topic, client_id)
-            except Exception:
-                pass
-        # send sentinel to queues instead of cancelling to avoid disconnect storms
-        for task in sender_tasks.values():
-            if not task.done():
-                task.cancel()
\ No newline at end of file
+        if session is not None:
+            held = {}
+            for client_id, topic in my_subscriptions.items():
+                sub = manager.get_subscriber(topic, client_id)
+                if sub is not None and sub.conn is conn:
+                    held[client_id] = sub
+            sessions.park(session, held)
+        else:
+            for client_id, topic in list(my_subscriptions.items()):
+                try:
+                    await manager.unsubscribe(topic, client_id)
+                except Exception:
+                    pass
+        conn.close()
@@ -0,0 +1,59 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .model import BatchItem, PublishBatchMsg, PublishMsg
+
+# the form str(UUID) produces; anything else goes through the model so it is normalised the same way
+_CANONICAL_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\Z")
+
+
+def _message(raw: Any) -> Optional[Dict[str, Any]]:
+    """The stored {"id", "payload"} dict if raw is plainly valid, else None."""
+    if type(raw) is dict and "payload" in raw:
+        mid = raw.get("id")
+        if type(mid) is str and _CANONICAL_UUID.match(mid):
+            return {"id": mid, "payload": raw["payload"]}
+    return None
+
+
+def _envelope_ok(data: Dict[str, Any]) -> bool:
+    rid = data.get("request_id")
+    return rid is None or type(rid) is str
+
+
+def parse_publish(data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Validate a publish frame into the (topic, message) pair publish() takes.
+
+    Well-formed frames are checked directly, without building models. Anything
+    else is handed to PublishMsg, so the accepted inputs and the ValidationError
+    text are exactly the model's.
+    """
+    topic = data.get("topic")
+    if type(topic) is str and _envelope_ok(data):
+        message = _message(data.get("message"))
+        if message is not None:
+            return topic, message
+    msg = PublishMsg(**data)
+    return msg.topic, {"id": str(msg.message.id), "payload": msg.message.payload}
+
+
+def parse_publish_batch(data: Dict[str, Any]) -> Tuple[Optional[str], List[Any]]:
+    """Validate a publish_batch envelope; entries are checked by parse_batch_item."""
+    topic = data.get("topic")
+    messages = data.get("messages")
+    if (topic is None or type(topic) is str) and type(messages) is list and _envelope_ok(data):
+        return topic, messages
+    msg = PublishBatchMsg(**data)
+    return msg.topic, msg.messages
+
+
+def parse_batch_item(raw: Any) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Validate one publish_batch entry into (topic or None, message), same contract as parse_publish."""
+    if type(raw) is dict:
+        topic = raw.get("topic")
+        if topic is None or type(topic) is str:
+            message = _message(raw.get("message"))
+            if message is not None:
+                return topic, message
+    item = BatchItem.model_validate(raw)
+    return item.topic, {"id": str(item.message.id), "payload": item.message.payload}
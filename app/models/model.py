@@ -24,7 +24,7 @@ from typing import Any, Optional, Literal
 #     message: Any
 #     timestamp: str = Field(..., description="ISO timestamp")
 from pydantic import BaseModel, Field
-from typing import Any, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from uuid import UUID
 
 class MessagePayload(BaseModel):
@@ -32,7 +32,7 @@ class MessagePayload(BaseModel):
     payload: Any
 
 class BaseWSIn(BaseModel):
-    type: Literal["subscribe","unsubscribe","publish","ping"]
+    type: Literal["subscribe","unsubscribe","publish","publish_batch","credit","ping","cluster","session"]
     request_id: Optional[str] = None
 
 class SubscribeMsg(BaseWSIn):
@@ -40,6 +40,17 @@ class SubscribeMsg(BaseWSIn):
     topic: str
     client_id: str
     last_n: Optional[int] = 0
+    since_seq: Optional[int] = None  # replay everything after this seq instead of last_n
+    batch_max: Optional[int] = Field(None, ge=1, le=10000)  # deliver "events" frames of up to N events
+    linger_ms: Optional[int] = Field(None, ge=0, le=60000)  # max wait for a batch to fill
+    filter: Optional[Dict[str, Any]] = None  # only deliver messages whose payload matches
+    compress: Optional[bool] = False  # large events as compressed binary frames
+    # what to do when this subscription's queue is full (default: BACKPRESSURE_POLICY)
+    policy: Optional[Literal["drop_oldest", "drop_newest", "block", "disconnect", "spill"]] = None
+    credits: Optional[int] = Field(None, ge=0)  # set to enable credit flow control with this initial window
+    group: Optional[str] = Field(None, min_length=1)  # consumer group: each event goes to one member
+    balance: Optional[Literal["round_robin", "least_loaded"]] = None  # group strategy, set by its first member
+    snapshot: Optional[bool] = None  # compacted topics: send the newest event per key first (default true)
 
 class UnsubscribeMsg(BaseWSIn):
     type: Literal["unsubscribe"]
@@ -51,5 +62,25 @@ class PublishMsg(BaseWSIn):
     topic: str
     message: MessagePayload
 
+class BatchItem(BaseModel):
+    topic: Optional[str] = None  # defaults to the batch topic
+    message: MessagePayload
+
+class PublishBatchMsg(BaseWSIn):
+    type: Literal["publish_batch"]
+    topic: Optional[str] = None
+    messages: List[Any]  # validated as BatchItem in one pass by the handler
+
+class CreditMsg(BaseWSIn):
+    type: Literal["credit"]
+    topic: str
+    client_id: str
+    n: int = Field(..., ge=1, le=1000000)  # events the client is ready to receive
+
+class SessionMsg(BaseWSIn):
+    type: Literal["session"]
+    token: Optional[str] = None  # resume this parked session; without it a new session is opened
+    positions: Dict[str, int] = {}  # client_id -> seq of the last event received, to resume just after it
+
 class PingMsg(BaseWSIn):
     type: Literal["ping"]
\ No newline at end of file
@@ -0,0 +1,326 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
+
+from ..utils.logger_wrapper import logger
+from .connection import Connection
+from .dedup import DUPLICATE, Duplicate
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def parse_nodes(spec: str) -> Dict[str, str]:
+    """Parse CLUSTER_NODES ("n1=127.0.0.1:8001,n2=127.0.0.1:8002") into {node_id: host:port}."""
+    nodes = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        node_id, _, addr = part.partition("=")
+        nodes[node_id.strip()] = addr.strip()
+    return nodes
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes; only the keys of a leaving node move."""
+
+    def __init__(self, nodes, vnodes: int = 64):
+        points = sorted((_hash(f"{n}#{i}"), n) for n in nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._nodes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+class PeerLink:
+    """Outbound WebSocket link from this node to one peer's /ws endpoint.
+
+    Speaks the public protocol plus "cluster" frames. Writes go through a
+    Connection so they stay ordered; replies are matched on request_id.
+    """
+
+    def __init__(self, node: "ClusterNode", peer_id: str, addr: str):
+        self.node = node
+        self.peer_id = peer_id
+        self.url = f"ws://{addr}/ws"
+        self.conn: Optional[Connection] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def up(self) -> bool:
+        return self.conn is not None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                async with connect(self.url, ping_interval=2, ping_timeout=4, max_size=None) as ws:
+                    conn = Connection(ws.send)
+                    conn.start()
+                    conn.send({"type": "cluster", "op": "hello", "node": self.node.node_id, "token": self.node.token})
+                    self.conn = conn
+                    self.node.link_up(self)
+                    async for raw in ws:
+                        await self._on_frame(raw)
+            except (OSError, WebSocketException, asyncio.TimeoutError):
+                pass
+            finally:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                    for fut in self._pending.values():
+                        if not fut.done():
+                            fut.set_exception(ConnectionError(f"link to {self.peer_id} lost"))
+                    self._pending.clear()
+                    self.node.link_down(self)
+            await asyncio.sleep(self.node.reconnect_interval)
+
+    async def _on_frame(self, raw):
+        data = json.loads(raw)
+        t = data.get("type")
+        if t == "event":
+            await self.node.manager.publish_mirrored(data["topic"], [(data, raw)])
+        elif t == "events":
+            by_topic: Dict[str, list] = {}
+            for e in data["events"]:
+                by_topic.setdefault(e["topic"], []).append((e, None))
+            for topic_name, events in by_topic.items():
+                await self.node.manager.publish_mirrored(topic_name, events)
+        elif (rid := data.get("request_id")) in self._pending:
+            fut = self._pending.pop(rid)
+            if not fut.done():
+                fut.set_result(data)
+
+    def send(self, out: Dict[str, Any]) -> bool:
+        if self.conn is None:
+            return False
+        self.conn.send(out)
+        return True
+
+    async def request(self, out: Dict[str, Any], timeout: float = 5.0) -> Dict[str, Any]:
+        if self.conn is None:
+            raise ConnectionError(f"link to {self.peer_id} is down")
+        rid = f"{self.node.node_id}-{next(self.node.rids)}"
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        self.conn.send({**out, "request_id": rid})
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(rid, None)
+
+
+class ClusterNode:
+    """Shards topics across broker nodes.
+
+    Each topic is owned by one live node chosen on a consistent-hash ring.
+    Every node knows every topic name, but only the owner sequences and
+    stores its events: other nodes forward publishes to the owner and, while
+    they have local subscribers, hold one node-level subscription at the
+    owner ("node:<id>") whose events they fan out locally. Ownership is
+    recomputed whenever a peer link goes up or down.
+    """
+
+    def __init__(self, manager, node_id: str, nodes: Dict[str, str], token: str = "",
+                 vnodes: int = 64, reconnect_interval: float = 0.5):
+        if node_id not in nodes:
+            raise ValueError(f"NODE_ID {node_id!r} is not in CLUSTER_NODES")
+        self.manager = manager
+        self.node_id = node_id
+        self.token = token
+        self.vnodes = vnodes
+        self.reconnect_interval = reconnect_interval
+        self.rids = itertools.count(1)
+        self.peers = {p: PeerLink(self, p, addr) for p, addr in nodes.items() if p != node_id}
+        self.linked: Dict[str, str] = {}  # topic -> peer holding our node subscription
+        self.lost: Dict[str, int] = {}  # peer -> events its node subscriptions here dropped
+        self.ring = HashRing([node_id], vnodes)
+
+    # --- membership ---
+
+    def start(self):
+        for link in self.peers.values():
+            link.start()
+
+    def stop(self):
+        for link in self.peers.values():
+            link.stop()
+
+    @property
+    def live_nodes(self) -> List[str]:
+        return sorted([self.node_id] + [p for p, link in self.peers.items() if link.up])
+
+    def link_up(self, link: PeerLink):
+        logger.info("cluster link to %s up", link.peer_id)
+        # make sure the peer knows every topic before we subscribe there
+        link.send({"type": "cluster", "op": "topics", "names": list(self.manager.topics),
+                   "compact": self.manager.compact_keys()})
+        self.rebalance()
+
+    def link_down(self, link: PeerLink):
+        logger.warning("cluster link to %s down", link.peer_id)
+        for topic, peer in list(self.linked.items()):
+            if peer == link.peer_id:
+                del self.linked[topic]
+        self.rebalance()
+
+    def rebalance(self):
+        self.ring = HashRing(self.live_nodes, self.vnodes)
+        for name, topic in list(self.manager.topics.items()):
+            self.interest_changed(name, self.manager.interest(topic))
+
+    # --- routing ---
+
+    def owner(self, topic_name: str) -> str:
+        return self.ring.owner(topic_name)
+
+    def owns(self, topic_name: str) -> bool:
+        return self.owner(topic_name) == self.node_id
+
+    def _link_for(self, topic_name: str) -> PeerLink:
+        return self.peers[self.owner(topic_name)]
+
+    def interest_changed(self, topic_name: str, local_subscribers: int):
+        """Keep exactly one node subscription at the owner while we have local subscribers."""
+        owner = self.owner(topic_name)
+        want = owner if local_subscribers and owner != self.node_id else None
+        have = self.linked.get(topic_name)
+        if want == have:
+            return
+        client_id = f"node:{self.node_id}"
+        if have is not None:
+            self.peers[have].send({"type": "unsubscribe", "topic": topic_name, "client_id": client_id})
+            del self.linked[topic_name]
+        # block: a full queue at the owner holds its publishers back instead of dropping our events
+        if want is not None and self.peers[want].send(
+                {"type": "subscribe", "topic": topic_name, "client_id": client_id, "policy": "block"}):
+            self.linked[topic_name] = want
+
+    def peer_lost(self, peer_id: str, topic_name: str, n: int):
+        """Count events a peer's node subscription dropped (its queue stayed full past BLOCK_TIMEOUT_MS)."""
+        self.lost[peer_id] = self.lost.get(peer_id, 0) + n
+        logger.warning("cluster: dropped %d events of %s for node %s, its queue is full", n, topic_name, peer_id)
+
+    async def forward_publish(self, topic_name: str, message: Any):
+        try:
+            resp = await self._link_for(topic_name).request(
+                {"type": "publish", "topic": topic_name, "message": message, "forwarded": True})
+        except (ConnectionError, asyncio.TimeoutError):
+            return False
+        if resp.get("type") != "ack":
+            return False
+        return DUPLICATE if resp.get("status") == DUPLICATE else True
+
+    async def publish_many(self, items: List[Tuple[str, Any]]) -> List[Optional[int]]:
+        results: List[Optional[int]] = [None] * len(items)
+        by_owner: Dict[str, List[int]] = {}
+        for i, (topic_name, _) in enumerate(items):
+            by_owner.setdefault(self.owner(topic_name), []).append(i)
+        for owner, idx in by_owner.items():
+            batch = [items[i] for i in idx]
+            if owner == self.node_id:
+                seqs = await self.manager.publish_many(batch, replicate=False)
+            else:
+                try:
+                    resp = await self.peers[owner].request({
+                        "type": "publish_batch", "forwarded": True,
+                        "messages": [{"topic": t, "message": m} for t, m in batch]})
+                    seqs = [Duplicate(r["seq"]) if r.get("status") == DUPLICATE else r.get("seq")
+                            for r in resp.get("results", [])]
+                except (ConnectionError, asyncio.TimeoutError):
+                    seqs = []
+            for i, seq in zip(idx, seqs):
+                results[i] = seq
+        return results
+
+    # --- history (kept by the owner; a node's own ring only mirrors what it was sent) ---
+
+    async def fetch_history(self, topic_name: str, after_seq: Optional[int], upto: Optional[int],
+                            last_n: int, limit: int) -> Dict[str, Any]:
+        """One page of history from the owner; see history_page."""
+        return await self._link_for(topic_name).request(
+            {"type": "cluster", "op": "history", "name": topic_name, "after": after_seq, "upto": upto,
+             "last_n": last_n, "limit": limit})
+
+    def history_page(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Up to limit frames after "after" (default: the last last_n) and through "upto" (default: now).
+
+        The reply names the after/upto it used, so the caller can page
+        through one fixed range.
+        """
+        name = data["name"]
+        upto = data.get("upto")
+        if upto is None:
+            upto = self.manager.last_seq(name)
+        after = data.get("after")
+        if after is None:
+            after = max(0, upto - int(data.get("last_n") or 0))
+        frames = list(itertools.islice(self.manager.iter_history(name, after, upto), int(data.get("limit") or 500)))
+        return {"type": "history", "topic": name, "after": after, "upto": upto, "frames": frames}
+
+    # --- topic lifecycle (decided by the owner, mirrored everywhere) ---
+
+    def _broadcast(self, out: Dict[str, Any]):
+        for link in self.peers.values():
+            link.send(out)
+
+    async def create_topic(self, name: str, compact_key: Optional[str] = None) -> bool:
+        if self.owns(name):
+            return await self.create_as_owner(name, compact_key)
+        resp = await self._link_for(name).request(
+            {"type": "cluster", "op": "create", "name": name, "compact_key": compact_key})
+        if resp.get("status") != "ok":
+            return False
+        await self.manager.create_topic(name, replicate=False, compact_key=compact_key)
+        return True
+
+    async def create_as_owner(self, name: str, compact_key: Optional[str] = None) -> bool:
+        ok = await self.manager.create_topic(name, replicate=False, compact_key=compact_key)
+        if ok:
+            self._broadcast({"type": "cluster", "op": "created", "name": name, "compact_key": compact_key})
+        return ok
+
+    async def delete_topic(self, name: str) -> bool:
+        self._broadcast({"type": "cluster", "op": "deleted", "name": name})
+        return await self.manager.delete_topic(name, replicate=False)
+
+    async def handle(self, data: Dict[str, Any]) -> Optional[str]:
+        """Apply a "cluster" frame received from a peer; returns the ack status for create."""
+        op = data.get("op")
+        if op == "topics":
+            compact = data.get("compact") or {}
+            for name in data.get("names", []):
+                if not self.manager.has_topic(name):
+                    await self.manager.create_topic(name, replicate=False, compact_key=compact.get(name))
+        elif op == "create":
+            return "ok" if await self.create_as_owner(data["name"], data.get("compact_key")) else "exists"
+        elif op == "created":
+            await self.manager.create_topic(data["name"], replicate=False, compact_key=data.get("compact_key"))
+        elif op == "deleted":
+            await self.manager.delete_topic(data["name"], replicate=False)
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "node": self.node_id,
+            "live": self.live_nodes,
+            "peers": {p: link.up for p, link in self.peers.items()},
+            "owned_topics": sum(1 for name in self.manager.topics if self.owns(name)),
+            "lost": dict(self.lost),
+        }
@@ -0,0 +1,57 @@
+import itertools
+import struct
+import zlib
+from typing import List
+
+# compressed frame: marker byte, dictionary id (0 = none), then a zlib stream of the event frame.
+# "Z" never starts a JSON text frame or a msgpack map, so clients can tell the two apart.
+HEADER = struct.Struct(">cI")
+MARKER = b"Z"
+
+# zlib only looks back 32KiB, so a longer preset dictionary is wasted
+_MAX_DICT_BYTES = 32 * 1024
+
+# dictionary ids are unique per process, so a connection can cache them across topics
+_dict_ids = itertools.count(1)
+
+
+class TopicCodec:
+    """Compresses one topic's large events, optionally with a preset dictionary.
+
+    The dictionary is built once from the first dict_samples large frames of
+    the topic: their tail, newest last, which is where zlib finds matches
+    cheapest. Frames compressed before that use no dictionary.
+    """
+
+    def __init__(self, min_bytes: int, level: int = 6, dict_samples: int = 0):
+        self.min_bytes = min_bytes
+        self.level = level
+        self.dict_samples = dict_samples
+        self.dict_id = 0
+        self.zdict = b""
+        self._samples: List[bytes] = []
+
+    def wants(self, size: int) -> bool:
+        return size >= self.min_bytes
+
+    def observe(self, frame: str):
+        """Feed a large frame to dictionary training."""
+        if self.dict_id or not self.dict_samples:
+            return
+        self._samples.append(frame.encode())
+        if len(self._samples) >= self.dict_samples:
+            self.zdict = b"".join(self._samples)[-_MAX_DICT_BYTES:]
+            self.dict_id = next(_dict_ids)
+            self._samples = []
+
+    def compress(self, data: bytes) -> bytes:
+        if self.dict_id:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=self.zdict)
+        else:
+            c = zlib.compressobj(self.level)
+        return HEADER.pack(MARKER, self.dict_id) + c.compress(data) + c.flush()
+
+
+def dict_id_of(frame: bytes) -> int:
+    return HEADER.unpack_from(frame)[1]
+
@@ -0,0 +1,66 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class ConflatingQueue:
+    """Subscriber queue for compacted topics: one pending event per key.
+
+    An event whose key already has an event waiting replaces it in place, so
+    a slow consumer skips straight to the newest value and the queue holds
+    at most one event per key. maxsize bounds the number of waiting keys.
+    Events without a key (and the None sentinel) each take their own slot.
+
+    Implements the part of asyncio.Queue that subscribers and Connection use.
+    on_conflate is called for every event replaced before it was sent.
+    """
+
+    def __init__(self, maxsize: int = 0, on_conflate: Optional[Callable[[], None]] = None):
+        self.maxsize = maxsize
+        self.on_conflate = on_conflate
+        self._order: Deque[Any] = deque()
+        self._items: Dict[Any, Any] = {}
+        self._not_full: Optional[asyncio.Event] = None
+
+    def qsize(self) -> int:
+        return len(self._order)
+
+    def empty(self) -> bool:
+        return not self._order
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._order)
+
+    @staticmethod
+    def _key(item: Any) -> Any:
+        key = getattr(item, "key", None)
+        return object() if key is None else key  # a fresh object never matches another key
+
+    def put_nowait(self, item: Any):
+        key = self._key(item)
+        if key in self._items:
+            self._items[key] = item
+            if self.on_conflate is not None:
+                self.on_conflate()
+            return
+        if self.full():
+            raise asyncio.QueueFull
+        self._items[key] = item
+        self._order.append(key)
+
+    async def put(self, item: Any):
+        key = self._key(item)
+        while key not in self._items and self.full():
+            if self._not_full is None:
+                self._not_full = asyncio.Event()
+            self._not_full.clear()
+            await self._not_full.wait()
+        self.put_nowait(item)
+
+    def get_nowait(self) -> Any:
+        if not self._order:
+            raise asyncio.QueueEmpty
+        item = self._items.pop(self._order.popleft())
+        if self._not_full is not None:
+            self._not_full.set()
+        return item
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Union
+
+from ..utils import metrics
+from ..utils.config import BATCH_BACKLOG_THRESHOLD, BATCH_DEFAULT_MAX
+from ..utils.util import encode_binary, encode_frame, make_binary_events_frame, make_events_frame, make_zdict
+from .compression import dict_id_of
+
+
+class Connection:
+    """Single outbound writer shared by every subscription of one client.
+
+    Subscriptions keep their own bounded queues (backpressure stays per
+    subscriber); enqueueing into one of them only marks it ready and wakes
+    this writer, which drains all ready subscriptions and pending control
+    frames (acks, errors, replay) in one pass.
+
+    Subscriptions in credit mode get at most as many events as the client
+    has granted; the rest wait in their queue.
+
+    Subscriptions with batch_max set get "events" frames of up to batch_max
+    events, held for at most linger seconds while the batch fills. Others
+    are batched automatically once their backlog exceeds
+    BATCH_BACKLOG_THRESHOLD.
+
+    With binary=True every frame is written in the binary subprotocol.
+    Frames that are bytes (binary protocol, compressed events) go through
+    send_bytes, which defaults to send. send may be None when the caller
+    consumes frames() itself instead of calling start() (HTTP streaming).
+    """
+
+    def __init__(self, send: Optional[Callable[[Union[str, bytes]], Awaitable[None]]], max_batch: int = 256,
+                 binary: bool = False, send_bytes: Optional[Callable[[bytes], Awaitable[None]]] = None):
+        self._send = send
+        self._send_bytes = send_bytes or send
+        self.binary = binary
+        self.max_batch = max_batch  # per subscription per pass, keeps busy topics from starving others
+        self.control: deque = deque()
+        self.ready: Dict[Any, None] = {}  # ordered set of subscribers with pending items
+        self.lingering: Dict[Any, float] = {}  # batching subscriber -> flush deadline
+        self.wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self.zdicts: Set[int] = set()  # compression dictionaries this client already has
+        self._marks: List[float] = []  # append times of the events in the batch being written
+        self.closed = False
+        self.task: "asyncio.Task | None" = None
+
+    def notify(self, sub) -> None:
+        if self.closed:
+            return
+        self.ready[sub] = None
+        self.wakeup.set()
+
+    def send(self, out: Dict[str, Any]) -> None:
+        """Queue a control frame; it is written ahead of pending events."""
+        self._enqueue(encode_binary(out) if self.binary else encode_frame(out))
+
+    def send_text(self, frame: str) -> None:
+        """Queue an already-encoded JSON frame (e.g. from history replay)."""
+        self._enqueue(encode_binary(json.loads(frame)) if self.binary else frame)
+
+    def send_event(self, ev) -> None:
+        """Queue a replayed event as a control frame, in this connection's wire format.
+
+        Unlike send_text this reuses the event's own binary frame, so binary
+        payloads arrive as the bytes that were published.
+        """
+        self._enqueue(ev.binary if self.binary else ev.frame)
+
+    def _enqueue(self, frame: Union[str, bytes]) -> None:
+        if self.closed:
+            return
+        self.control.append(frame)
+        self.wakeup.set()
+
+    def _collect(self) -> List[Union[str, bytes]]:
+        frames = list(self.control)
+        self.control.clear()
+        now = time.monotonic()
+        for sub, deadline in self.lingering.items():
+            if deadline <= now:
+                self.ready[sub] = None
+        ready, self.ready = self.ready, {}
+        for sub in ready:
+            if sub.credits == 0:
+                self.lingering.pop(sub, None)  # hold events in the queue until the client grants more credit
+                continue
+            q = sub.queue
+            backlog = q.qsize()
+            if sub.batch_max:
+                size = sub.batch_max
+                deadline = self.lingering.get(sub)
+                if not sub.linger or (deadline is not None and deadline <= now):
+                    limit = max(self.max_batch, size)  # linger expired: flush the partial batch too
+                else:
+                    limit = min(backlog, max(self.max_batch, size)) // size * size  # full batches only
+                if limit == 0:
+                    if deadline is None:
+                        self.lingering[sub] = now + sub.linger
+                    continue  # let the batch fill
+                self.lingering.pop(sub, None)
+            else:
+                size = BATCH_DEFAULT_MAX if BATCH_BACKLOG_THRESHOLD and backlog > BATCH_BACKLOG_THRESHOLD else 0
+                limit = max(self.max_batch, size)
+
+            if sub.credits is not None:
+                limit = min(limit, sub.credits)
+
+            items = []
+            closed = False
+            taken = 0
+            while taken < limit and not q.empty():
+                item = q.get_nowait()
+                if item is None:  # subscriber closed
+                    closed = True
+                    break
+                taken += 1
+                if metrics.METRICS_ENABLED:
+                    self._marks.append(item.created)
+                if sub.compress and item.codec is not None:
+                    # compressed frames go out on their own, between the batches around them
+                    self._emit(frames, sub, items, size)
+                    items = []
+                    self._emit_compressed(frames, item)
+                else:
+                    items.append(item.binary if self.binary else item.frame)
+            if sub.credits is not None:
+                sub.credits -= taken
+            if not closed:
+                sub.refill()  # spilled events move up as the queue drains
+                if not q.empty():
+                    self.ready[sub] = None
+            self._emit(frames, sub, items, size)
+        if self.ready:
+            self.wakeup.set()
+        return frames
+
+    def _emit(self, frames: list, sub, items: list, size: int):
+        if not size:
+            frames.extend(items)
+            return
+        wrap = make_binary_events_frame if self.binary else make_events_frame
+        for i in range(0, len(items), size):
+            chunk = items[i:i + size]
+            if len(chunk) == 1 and not sub.batch_max:
+                frames.append(chunk[0])
+            else:
+                frames.append(wrap(sub.topic, chunk))
+
+    def _emit_compressed(self, frames: list, ev):
+        frame = ev.zbinary if self.binary else ev.zframe
+        dict_id = dict_id_of(frame)
+        if dict_id and dict_id not in self.zdicts:
+            # first frame that needs this dictionary on this connection: send it just before
+            self.zdicts.add(dict_id)
+            out = make_zdict(dict_id, ev.codec.zdict)
+            frames.append(encode_binary(out) if self.binary else encode_frame(out))
+        frames.append(frame)
+
+    def _next_timeout(self) -> Optional[float]:
+        if not self.lingering:
+            return None
+        return max(0.0, min(self.lingering.values()) - time.monotonic())
+
+    async def frames(self) -> AsyncIterator[List[Union[str, bytes]]]:
+        """Yield everything pending for this connection, one coalesced batch per wakeup."""
+        while not self.closed:
+            timeout = self._next_timeout()
+            if timeout is None:
+                await self.wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+            batch = self._collect()
+            if batch:
+                yield batch
+                self._record_sent(batch)
+            self._drained.set()
+
+    def _record_sent(self, batch: List[Union[str, bytes]]):
+        # runs once the consumer asks for the next batch, i.e. after this one was written
+        if not metrics.METRICS_ENABLED:
+            return
+        now = time.perf_counter()
+        for created in self._marks:
+            metrics.APPEND_TO_SEND.observe(now - created)
+        self._marks.clear()
+        metrics.FRAMES_SENT.inc(len(batch))
+        # JSON frames are ASCII-only, so characters are bytes
+        metrics.BYTES_SENT.inc(sum(map(len, batch)))
+
+    async def flush(self):
+        """Wait until queued control frames have been written (used to pace large replays)."""
+        while self.control and not self.closed:
+            self._drained.clear()
+            await self._drained.wait()
+
+    async def run(self):
+        try:
+            async for batch in self.frames():
+                for frame in batch:
+                    await (self._send_bytes if isinstance(frame, bytes) else self._send)(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # socket went away; the reader side handles unsubscribe
+            pass
+        finally:
+            self.closed = True
+            self._drained.set()
+
+    def start(self) -> "asyncio.Task":
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def close(self) -> None:
+        self.closed = True
+        self.ready.clear()
+        self.lingering.clear()
+        self.control.clear()
+        self._drained.set()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
@@ -0,0 +1,67 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Union
+
+# what PubSubManager.publish returns for a message id already published inside the window
+DUPLICATE = "duplicate"
+
+
+class Duplicate(int):
+    """Seq of the original event, where publish_many would return a new seq."""
+
+
+def id_key(message: Any) -> Optional[Union[bytes, str]]:
+    """Index key for a message: its UUID as 16 raw bytes; None if it has no id."""
+    mid = message.get("id") if isinstance(message, dict) else None
+    if not isinstance(mid, str):
+        return None
+    if len(mid) == 36:
+        try:
+            return bytes.fromhex(mid.replace("-", ""))
+        except ValueError:
+            pass
+    return mid
+
+
+class DedupIndex:
+    """Message ids recently published to one topic, mapped to the seq they got.
+
+    Bounded by max_ids and, when window_ms is set, by age. Both evict in
+    insertion order, so the oldest id always goes first and every operation
+    is O(1) amortized.
+    """
+
+    def __init__(self, max_ids: int, window_ms: int = 0):
+        self.max_ids = max_ids
+        self.window = window_ms / 1000.0
+        self._seqs: Dict[Union[bytes, str], int] = {}
+        self._order: Deque[Union[bytes, str]] = deque()
+        self._added: Deque[float] = deque()  # monotonic insert times, parallel to _order; empty without a window
+
+    def __len__(self) -> int:
+        return len(self._seqs)
+
+    def _expire(self, now: float):
+        if self.window:
+            cutoff = now - self.window
+            while self._added and self._added[0] <= cutoff:
+                self._added.popleft()
+                del self._seqs[self._order.popleft()]
+
+    def seen(self, key: Union[bytes, str]) -> Optional[int]:
+        """Seq of the earlier event with this key, if it is still inside the window."""
+        if self.window:
+            self._expire(time.monotonic())
+        return self._seqs.get(key)
+
+    def add(self, key: Union[bytes, str], seq: int):
+        if key in self._seqs:
+            return
+        self._seqs[key] = seq
+        self._order.append(key)
+        if self.window:
+            self._added.append(time.monotonic())
+        while len(self._order) > self.max_ids:
+            del self._seqs[self._order.popleft()]
+            if self.window:
+                self._added.popleft()
@@ -0,0 +1,159 @@
+import functools
+import json
+import operator
+from typing import Any, Callable, Dict, List
+
+Predicate = Callable[[Any], bool]
+
+_MISSING = object()
+
+_COMPARISONS = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+
+
+class FilterError(ValueError):
+    """Raised for a malformed filter expression."""
+
+
+def compile_filter(expr: Dict[str, Any]) -> Predicate:
+    """Compile a filter over message payloads into a predicate.
+
+    expr maps dotted payload paths to a value (equality) or to operators
+    ($eq $ne $gt $gte $lt $lte $in $nin $exists); $and, $or and $not combine
+    expressions:
+
+        {"status": "created", "amount": {"$gte": 10}, "$or": [{"region": "eu"}, {"vip": true}]}
+
+    Equal expressions return the same predicate object, so a publish can
+    evaluate each distinct filter once no matter how many subscribers use it.
+    """
+    if not isinstance(expr, dict):
+        raise FilterError("filter must be an object")
+    try:
+        key = json.dumps(expr, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError) as e:
+        raise FilterError(str(e))
+    return _compile_key(key)
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_key(key: str) -> Predicate:
+    return _compile(json.loads(key))
+
+
+def _compile(expr: Dict[str, Any]) -> Predicate:
+    if not isinstance(expr, dict):
+        raise FilterError("filter must be an object")
+    preds: List[Predicate] = []
+    for field, cond in expr.items():
+        if field == "$and":
+            preds.append(_all([_compile(e) for e in _list(field, cond)]))
+        elif field == "$or":
+            preds.append(_any([_compile(e) for e in _list(field, cond)]))
+        elif field == "$not":
+            preds.append(_negate(_compile(cond)))
+        elif field.startswith("$"):
+            raise FilterError(f"unknown operator: {field}")
+        else:
+            preds.append(_field(field, cond))
+    return _all(preds)
+
+
+def _list(op: str, value: Any) -> list:
+    if not isinstance(value, list) or not value:
+        raise FilterError(f"{op} expects a non-empty list")
+    return value
+
+
+def _all(preds: List[Predicate]) -> Predicate:
+    if len(preds) == 1:
+        return preds[0]
+    return lambda payload: all(p(payload) for p in preds)
+
+
+def _any(preds: List[Predicate]) -> Predicate:
+    return lambda payload: any(p(payload) for p in preds)
+
+
+def _negate(pred: Predicate) -> Predicate:
+    return lambda payload: not pred(payload)
+
+
+def path_getter(path: str) -> Callable[[Any], Any]:
+    """Getter for a dotted payload path; None where the path is missing."""
+    get = _getter(path)
+
+    def value(payload):
+        v = get(payload)
+        return None if v is _MISSING else v
+    return value
+
+
+def _getter(path: str) -> Callable[[Any], Any]:
+    parts = path.split(".")
+
+    def get(payload):
+        for part in parts:
+            if not isinstance(payload, dict):
+                return _MISSING
+            payload = payload.get(part, _MISSING)
+            if payload is _MISSING:
+                return _MISSING
+        return payload
+    return get
+
+
+def _field(path: str, cond: Any) -> Predicate:
+    get = _getter(path)
+    if not (isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond)):
+        return lambda payload: get(payload) == cond  # plain value: equality
+    tests: List[Callable[[Any], bool]] = []
+    for op, arg in cond.items():
+        if op in _COMPARISONS:
+            tests.append(_compare(_COMPARISONS[op], arg))
+        elif op in ("$in", "$nin"):
+            if not isinstance(arg, list):
+                raise FilterError(f"{op} expects a list")
+            tests.append(_member(arg, op == "$in"))
+        elif op == "$exists":
+            want = bool(arg)
+            tests.append(lambda v, want=want: (v is not _MISSING) == want)
+        else:
+            raise FilterError(f"unknown operator: {op}")
+
+    def pred(payload):
+        v = get(payload)
+        return all(t(v) for t in tests)
+    return pred
+
+
+def _compare(op: Callable[[Any, Any], bool], arg: Any) -> Callable[[Any], bool]:
+    def test(v):
+        if v is _MISSING:
+            return False
+        try:
+            return op(v, arg)
+        except TypeError:  # e.g. "abc" > 3
+            return False
+    return test
+
+
+def _member(values: list, inside: bool) -> Callable[[Any], bool]:
+    try:
+        lookup = frozenset(values)  # O(1) when all values are hashable
+    except TypeError:
+        lookup = values
+
+    def test(v):
+        try:
+            found = v in lookup
+        except TypeError:  # unhashable payload value
+            found = v in values
+        return found == inside
+    return test
@@ -1,151 +1,912 @@
 import asyncio
+import json
+import os
 import time
-from typing import Dict, Set, Any, Optional
-from dataclasses import dataclass, field
+from collections import deque
+from urllib.parse import quote, unquote
+from typing import Callable, Deque, Dict, List, Set, Any, Optional, Sequence, Tuple
+from dataclasses import dataclass, field, replace
+from functools import cached_property
 from uuid import uuid4
 from ..utils.logger_wrapper import log_async_exceptions,log_exceptions
+from ..utils.util import make_event, make_error, encode_frame, encode_binary
+from ..utils import config, metrics
+from ..utils.metrics import timed_lock
+from ..utils.config import RING_SIZE, RING_MAX_BYTES
+from .ring import RingBuffer
+from .segment_log import TRASH_MARK, SegmentLog, remove_trash
+from .trie import TopicTrie, is_pattern
+from .compression import TopicCodec
+from .spill import SpillQueue
+from .dedup import DUPLICATE, DedupIndex, Duplicate, id_key
+from .conflate import ConflatingQueue
+from .filters import path_getter
+
+# backpressure policies, applied when a subscriber's queue is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"  # the publisher waits up to BLOCK_TIMEOUT_MS, then the rest is dropped
+DISCONNECT = "disconnect"  # the subscription is closed
+SPILL = "spill"  # overflow goes to a local file and is drained as the queue empties
+
+# consumer group strategies: which member of a group gets each event
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"  # shortest queue at publish time
+
+def matches(predicate: Callable[[Any], bool], message: Any) -> bool:
+    """Apply a subscription filter to a published message's payload."""
+    return predicate(message.get("payload") if isinstance(message, dict) else None)
 
 def now_iso():
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
-@dataclass
+@dataclass(frozen=True)
+class Event:
+    topic: str
+    message: Any
+    timestamp: str
+    seq: int
+    frame: str  # "event" frame encoded once at publish, shared by every subscriber
+    codec: Optional[TopicCodec] = None  # set when the event is large enough to compress
+    created: float = 0.0  # perf_counter() when the event was appended, for append-to-send latency
+    key: Any = None  # compaction key on compacted topics; later events with the same key supersede it
+
+    @cached_property
+    def binary(self) -> bytes:
+        """Binary-subprotocol frame, encoded for the first binary subscriber and shared after that."""
+        return encode_binary(make_event(self.topic, self.message, ts=self.timestamp, seq=self.seq))
+
+    @cached_property
+    def zframe(self) -> bytes:
+        """Compressed JSON frame, built for the first compressing subscriber and shared after that."""
+        return self.codec.compress(self.frame.encode())
+
+    @cached_property
+    def zbinary(self) -> bytes:
+        return self.codec.compress(self.binary)
+
+    @classmethod
+    def from_frame(cls, frame: str, key: Any = None, created: Optional[float] = None) -> "Event":
+        data = json.loads(frame)
+        return cls(data["topic"], data["message"], data.get("ts", ""), data.get("seq", 0), frame,
+                   created=time.perf_counter() if created is None else created, key=key)
+
+@dataclass(eq=False)
 class Subscriber:
     id: str
     queue: asyncio.Queue
     ws: object  # store websocket reference for cleanup (not used for sending here)
+    conn: Optional[object] = None  # Connection whose writer drains this queue
+    paused: bool = False  # held back while history is being replayed
+    topic: str = ""
+    batch_max: int = 0  # >0: deliver "events" frames of up to this many events
+    linger: float = 0.0  # seconds a partial batch may wait to fill
+    compress: bool = False  # receive large events as compressed binary frames
+    predicate: Optional[Callable[[Any], bool]] = None  # compiled payload filter; None delivers everything
+    policy: str = DROP_OLDEST  # what to do when queue is full
+    dropped: int = 0
+    spilled: int = 0
+    spill: Optional[SpillQueue] = None  # created on first overflow with the spill policy
+    credits: Optional[int] = None  # events the client may still receive; None = no flow control
+    group: Optional[str] = None  # consumer group; each event goes to one member of the group
+    parked: bool = False  # its socket dropped; kept for a session resume, with no connection draining it
+    on_drop: Optional[Callable[[int], None]] = None  # called with the number of events each time some are dropped
+    # block policy: events a full queue could not take, oldest first; later events line up behind them
+    waiting: Deque[Event] = field(default_factory=deque)
+    waited: int = 0  # events that have left waiting, into the queue or dropped
+    moved: Optional[asyncio.Event] = None  # set whenever waiting shrinks, for blocked publishers
+
+    def wake(self):
+        if self.conn is not None and not self.paused:
+            self.conn.notify(self)
+
+    def grant(self, n: int):
+        self.credits = (self.credits or 0) + n
+        self.wake()
+
+    def refill(self):
+        """Move spilled or blocked events into the queue, oldest first, while it has room."""
+        while self.spill is not None and self.spill.pending and not self.queue.full():
+            ev = Event.from_frame(*self.spill.pop())
+            codec = self.spill.codecs.get(ev.topic)
+            if codec is not None and codec.wants(len(ev.frame)):
+                ev = replace(ev, codec=codec)  # compressed again, like it would have been before spilling
+            self.queue.put_nowait(ev)
+        if self.waiting and not self.queue.full():
+            while self.waiting and not self.queue.full():
+                self.queue.put_nowait(self.waiting.popleft())
+                self.waited += 1
+            if self.moved is not None:
+                self.moved.set()
+
+    def release_waiting(self, events: Optional[Sequence[Event]] = None) -> int:
+        """Drop blocked events (only those of events, if given) and wake their publishers; return how many."""
+        if events is None:
+            gone, self.waiting = len(self.waiting), deque()
+        else:
+            mine = set(map(id, events))
+            kept = deque(ev for ev in self.waiting if id(ev) not in mine)
+            gone, self.waiting = len(self.waiting) - len(kept), kept
+        self.waited += gone
+        if gone and self.moved is not None:
+            self.moved.set()
+        return gone
+
+    def backlog(self) -> int:
+        """Events waiting for this subscriber, in memory and on disk."""
+        return self.queue.qsize() + len(self.waiting) + (self.spill.pending if self.spill is not None else 0)
+
+    def discard_through(self, seq: int) -> Optional[int]:
+        """Drop queued events up to seq (the client already has them); return the oldest seq still queued."""
+        kept = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is None or item.seq > seq:
+                kept.append(item)
+        for item in kept:
+            self.queue.put_nowait(item)
+        self.refill()
+        return min((item.seq for item in kept if item is not None), default=None)
+
+@dataclass(eq=False)
+class ConsumerGroup:
+    """Subscribers of one topic sharing a single logical subscription."""
+    name: str
+    strategy: str = ROUND_ROBIN
+    members: Dict[str, Subscriber] = field(default_factory=dict)
+    snapshot: tuple = ()  # copy-on-write, like Topic.snapshot
+    cursor: int = 0  # where the next pick starts, so equal choices rotate
+    filtered: bool = False  # some member has a filter; otherwise every member is a candidate
+
+    def refresh(self):
+        """Rebuild the copy-on-write state after a membership change."""
+        self.snapshot = tuple(self.members.values())
+        self.filtered = any(m.predicate is not None for m in self.snapshot)
+
+    def route(self, events: Sequence[Event]) -> Dict[Subscriber, List[Event]]:
+        """Assign each event to exactly one member.
+
+        Members that are full (queue plus what this call already assigned
+        them) or out of credits are passed over while any other member can
+        take the event; if none can, the event goes to the member the
+        strategy picks and that member's policy applies. Round-robin stops
+        at the first member with room, so it usually looks at one.
+        """
+        out: Dict[Subscriber, List[Event]] = {}
+        members = self.snapshot
+        pick_from = self._least_loaded if self.strategy == LEAST_LOADED else self._next_with_room
+        for ev in events:
+            candidates = members
+            if self.filtered:
+                candidates = [m for m in members if m.predicate is None or matches(m.predicate, ev.message)]
+            n = len(candidates)
+            if not n:
+                continue
+            start = self.cursor % n
+            self.cursor += 1
+            pick = pick_from(candidates, start, out)
+            out.setdefault(pick, []).append(ev)
+        return out
+
+    @staticmethod
+    def _load(m: Subscriber, out: Dict[Subscriber, List[Event]]) -> int:
+        return m.backlog() + len(out.get(m, ()))
+
+    @staticmethod
+    def _has_room(m: Subscriber, load: int) -> bool:
+        return load < m.queue.maxsize and (m.credits is None or m.credits > load)
+
+    def _next_with_room(self, candidates: Sequence[Subscriber], start: int,
+                        out: Dict[Subscriber, List[Event]]) -> Subscriber:
+        n = len(candidates)
+        for i in range(n):
+            m = candidates[(start + i) % n]
+            if self._has_room(m, self._load(m, out)):
+                return m
+        return candidates[start]
+
+    def _least_loaded(self, candidates: Sequence[Subscriber], start: int,
+                      out: Dict[Subscriber, List[Event]]) -> Subscriber:
+        n = len(candidates)
+        best = best_ready = None
+        best_load = best_ready_load = 0
+        for i in range(n):  # from the cursor, so ties rotate
+            m = candidates[(start + i) % n]
+            load = self._load(m, out)
+            if best is None or load < best_load:
+                best, best_load = m, load
+            if self._has_room(m, load) and (best_ready is None or load < best_ready_load):
+                best_ready, best_ready_load = m, load
+        return best_ready if best_ready is not None else best
 
 @dataclass
 class Topic:
     name: str
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
     subscribers: Dict[str, Subscriber] = field(default_factory=dict)
-    # optional ring buffer:
-    ring: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(100))  # simple bounded buffer for last_n
+    # immutable copy of subscribers, rebuilt only on membership change; publish iterates it lock-free
+    snapshot: tuple = ()
+    # the part of snapshot not in a consumer group: each gets its own copy of every event
+    direct: tuple = ()
+    # consumer groups by name, and a copy-on-write tuple of them for publish
+    groups: Dict[str, ConsumerGroup] = field(default_factory=dict)
+    group_snapshot: tuple = ()
+    # replay history, bounded by RING_SIZE messages and RING_MAX_BYTES encoded bytes
+    ring: RingBuffer = field(default_factory=lambda: RingBuffer(RING_SIZE, RING_MAX_BYTES))
+    # durable history beyond the ring, when PERSIST_DIR is set
+    log: Optional[SegmentLog] = None
+    # compressor shared by this topic's large events, when COMPRESS_MIN_BYTES is set
+    codec: Optional[TopicCodec] = None
+    # events lost or sent to disk because a subscriber's queue was full
+    dropped: int = 0
+    spilled: int = 0
+    # subscribers of this topic that have dropped or spilled events, for /stats
+    lagging: Dict[str, Subscriber] = field(default_factory=dict)
+    # recent message ids, when DEDUP_MAX_IDS is set; repeats are not appended or delivered
+    dedup: Optional[DedupIndex] = None
+    duplicates: int = 0
+    # compacted topic: payload path of the key, its getter, and the newest event per key (oldest first)
+    compact_key: Optional[str] = None
+    key_of: Optional[Callable[[Any], Any]] = None
+    latest: Dict[Any, Event] = field(default_factory=dict)
+    conflated: int = 0  # queued events replaced by a newer one for the same key before they were sent
+    # pattern subscribers matching this topic, cached until the trie's generation changes
+    pattern_subs: tuple = ()
+    pattern_gen: int = -1
+
+    def count_conflated(self):
+        self.conflated += 1
 
 class PubSubManager:
     def __init__(self):
         self.topics: Dict[str, Topic] = {}
         self.global_lock = asyncio.Lock()
-    
+        # maintained incrementally so health/stats never walk every topic
+        self.subscriber_count = 0
+        # wildcard subscriptions ("orders.*.created", "orders.#"), not tied to one topic
+        self.patterns = TopicTrie()
+        # multi-worker mode: Relay that mirrors topic changes and publishes to sibling workers
+        self.relay = None
+        # cluster mode: ClusterNode that routes topics to their owner node
+        self.cluster = None
+
+    def get_topic(self, name: str) -> Optional[Topic]:
+        """O(1) lookup; lock-free since a dict read never yields to the loop."""
+        return self.topics.get(name)
+
+    def has_topic(self, name: str) -> bool:
+        return name in self.topics
+
+    def interest(self, topic: Topic) -> int:
+        """Local subscribers that want topic's events, exact and pattern."""
+        return len(topic.subscribers) + len(self._pattern_subs(topic))
+
+    def _pattern_subs(self, topic: Topic) -> tuple:
+        if topic.pattern_gen != self.patterns.generation:
+            topic.pattern_subs = tuple(self.patterns.match(topic.name)) if self.patterns.count else ()
+            topic.pattern_gen = self.patterns.generation
+        return topic.pattern_subs
+
+    def last_seq(self, name: str) -> int:
+        topic = self.topics.get(name)
+        return topic.ring.next_seq - 1 if topic is not None else 0
+
+    def compact_keys(self) -> Dict[str, str]:
+        """compact_key of every compacted topic, for syncing topic lists to peers."""
+        return {name: t.compact_key for name, t in list(self.topics.items()) if t.compact_key}
+
     @log_async_exceptions
-    async def create_topic(self, name: str):
-        async with self.global_lock:
+    async def create_topic(self, name: str, replicate: bool = True, compact_key: Optional[str] = None):
+        """Create a topic; with compact_key (a dotted payload path) it keeps the newest event per key."""
+        if replicate and self.cluster is not None:
+            return await self.cluster.create_topic(name, compact_key)
+        if replicate and self.relay is not None and not await self.relay.claim_topic(name, compact_key):
+            return False
+        async with timed_lock(self.global_lock, metrics.LOCK_WAIT_GLOBAL):
             if name in self.topics:
                 return False
-            self.topics[name] = Topic(name=name)
+            self.topics[name] = topic = self._new_topic(name, compact_key)
+            if self.cluster is not None and self.patterns.count:
+                self.cluster.interest_changed(name, self.interest(topic))
             return True
 
+    def _new_topic(self, name: str, compact_key: Optional[str] = None) -> Topic:
+        topic = Topic(name=name)
+        if compact_key:
+            topic.compact_key = compact_key
+            topic.key_of = path_getter(compact_key)
+        if config.DEDUP_MAX_IDS:
+            topic.dedup = DedupIndex(config.DEDUP_MAX_IDS, config.DEDUP_WINDOW_MS)
+        if config.COMPRESS_MIN_BYTES:
+            topic.codec = TopicCodec(config.COMPRESS_MIN_BYTES, config.COMPRESS_LEVEL, config.COMPRESS_DICT_SAMPLES)
+        if config.PERSIST_DIR:
+            topic.log = SegmentLog(
+                os.path.join(config.PERSIST_DIR, quote(name, safe="")),
+                segment_bytes=config.SEGMENT_BYTES,
+                index_interval_bytes=config.INDEX_INTERVAL_BYTES,
+                fsync_policy=config.FSYNC_POLICY,
+                fsync_batch=config.FSYNC_BATCH,
+                fsync_interval_ms=config.FSYNC_INTERVAL_MS,
+                retention_ms=config.RETENTION_MS,
+                retention_bytes=config.RETENTION_BYTES,
+            )
+            # continue the persisted sequence so replay positions survive restarts
+            topic.ring.next_seq = topic.log.next_seq
+            if compact_key:
+                with open(self._options_path(name), "w") as f:
+                    json.dump({"compact_key": compact_key}, f)
+        return topic
+
+    @staticmethod
+    def _options_path(name: str) -> str:
+        # next to the topic's segment directory, so load_persisted's directory scan skips it
+        return os.path.join(config.PERSIST_DIR, quote(name, safe="") + ".topic.json")
+
+    @log_async_exceptions
+    async def load_persisted(self):
+        """Recreate topics found under PERSIST_DIR (called once at startup)."""
+        if not config.PERSIST_DIR or not os.path.isdir(config.PERSIST_DIR):
+            return 0
+        async with timed_lock(self.global_lock, metrics.LOCK_WAIT_GLOBAL):
+            for entry in sorted(os.listdir(config.PERSIST_DIR)):
+                if TRASH_MARK in entry:
+                    # a deleted topic whose removal was cut short by a restart
+                    await asyncio.to_thread(remove_trash, os.path.join(config.PERSIST_DIR, entry))
+                    continue
+                name = unquote(entry)
+                if name not in self.topics and os.path.isdir(os.path.join(config.PERSIST_DIR, entry)):
+                    compact_key = None
+                    try:
+                        with open(self._options_path(name)) as f:
+                            compact_key = json.load(f).get("compact_key")
+                    except (OSError, ValueError):
+                        pass
+                    self.topics[name] = topic = self._new_topic(name, compact_key)
+                    if topic.key_of is not None:
+                        self._restore_latest(topic)
+        return len(self.topics)
+
+    def _restore_latest(self, topic: Topic):
+        """Rebuild a compacted topic's last value per key from its segment log."""
+        for _, frame in topic.log.read(0):
+            ev = Event.from_frame(frame)
+            self._remember(topic, replace(ev, key=self._key_for(topic, ev.message)))
+
     @log_async_exceptions
-    async def delete_topic(self, name: str):
-        async with self.global_lock:
+    async def delete_topic(self, name: str, replicate: bool = True):
+        if replicate and self.cluster is not None:
+            return await self.cluster.delete_topic(name)
+        if replicate and self.relay is not None:
+            await self.relay.drop_topic(name)
+        trash = None
+        async with timed_lock(self.global_lock, metrics.LOCK_WAIT_GLOBAL):
             if name not in self.topics:
                 return False
             # cleanup subscribers
             topic = self.topics.pop(name)
-            for sid, sub in list(topic.subscribers.items()):
-                await self._close_subscriber_queue(sub)
-            return True
-        
+            self.subscriber_count -= len(topic.subscribers)
+            for sub in topic.snapshot:
+                self._close_subscriber_queue(sub)
+            if topic.log is not None:
+                trash = topic.log.destroy()
+                if topic.compact_key:
+                    try:
+                        os.remove(self._options_path(name))
+                    except FileNotFoundError:
+                        pass
+        if trash is not None:
+            # outside the lock and off the loop: removing a large log can take a while
+            await asyncio.to_thread(remove_trash, trash)
+        return True
+
     @log_async_exceptions
     async def list_topics(self):
-        async with self.global_lock:
-            return list(self.topics.keys())
+        return list(self.topics.keys())
 
     @log_async_exceptions
-    async def subscribe(self, topic_name: str, client_id: str, ws, queue_maxsize: int = 100):
-        # ensure topic exists
-        if topic_name not in self.topics:
-            return None  # or raise/return False depending on your calling convention
+    async def subscribe(self, topic_name: str, client_id: str, ws, queue_maxsize: int = 0, conn=None,
+                        linger_ms: int = 0, balance: str = ROUND_ROBIN, **options):
+        """Add a subscriber; options are Subscriber fields (batch_max, predicate, compress, policy, group).
 
-        topic = self.topics[topic_name]   # <-- bind the topic here
+        balance is the strategy for a consumer group created by this call;
+        joining an existing group keeps the group's strategy.
+        """
+        options.setdefault("policy", config.BACKPRESSURE_POLICY)
+        if is_pattern(topic_name):
+            return self._subscribe_pattern(topic_name, client_id, ws, queue_maxsize, conn, linger_ms, options)
+        topic = self.topics.get(topic_name)
+        if topic is None:
+            return None  # or raise/return False depending on your calling convention
 
         # use client_id as subscriber id
-        async with topic.lock:
+        async with timed_lock(topic.lock, metrics.LOCK_WAIT_TOPIC):
             if client_id in topic.subscribers:
                 return topic.subscribers[client_id]   # idempotent
-            q = asyncio.Queue(maxsize=queue_maxsize)
-            sub = Subscriber(id=client_id, queue=q, ws=ws)
+            maxsize = queue_maxsize or config.QUEUE_SIZE
+            # compacted topics conflate: a waiting event is replaced by a newer one for the same key
+            q = ConflatingQueue(maxsize, topic.count_conflated) if topic.key_of is not None else asyncio.Queue(maxsize=maxsize)
+            sub = Subscriber(id=client_id, queue=q, ws=ws, conn=conn, topic=topic_name,
+                             linger=linger_ms / 1000.0, **options)
             topic.subscribers[client_id] = sub
+            if sub.group is not None:
+                group = topic.groups.get(sub.group)
+                if group is None:
+                    group = topic.groups[sub.group] = ConsumerGroup(sub.group, balance)
+                group.members[client_id] = sub
+                group.refresh()
+            self._snapshot(topic)
+            self.subscriber_count += 1
+            if self.cluster is not None:
+                self.cluster.interest_changed(topic_name, self.interest(topic))
             return sub
-        
+
+    def _snapshot(self, topic: Topic):
+        topic.snapshot = tuple(topic.subscribers.values())
+        topic.direct = tuple(sub for sub in topic.snapshot if sub.group is None)
+        topic.group_snapshot = tuple(topic.groups.values())
+
+    def get_group(self, topic_name: str, group: str) -> Optional[ConsumerGroup]:
+        topic = self.topics.get(topic_name)
+        return topic.groups.get(group) if topic is not None else None
+
+    def get_subscriber(self, topic_name: str, client_id: str) -> Optional[Subscriber]:
+        if is_pattern(topic_name):
+            return self.patterns.get(topic_name, client_id)
+        topic = self.topics.get(topic_name)
+        return topic.subscribers.get(client_id) if topic is not None else None
+
+    def _subscribe_pattern(self, pattern: str, client_id: str, ws, queue_maxsize: int, conn,
+                           linger_ms: int, options: Dict[str, Any]) -> Subscriber:
+        # synchronous: the trie is never seen half-updated by a publisher
+        sub = self.patterns.get(pattern, client_id)
+        if sub is not None:
+            return sub  # idempotent
+        sub = Subscriber(id=client_id, queue=asyncio.Queue(maxsize=queue_maxsize or config.QUEUE_SIZE), ws=ws,
+                         conn=conn, topic=pattern, linger=linger_ms / 1000.0, **options)
+        self.patterns.add(pattern, client_id, sub)
+        self.subscriber_count += 1
+        self._patterns_changed()
+        return sub
+
+    def _detach_pattern(self, pattern: str, subscriber_id: str) -> bool:
+        sub = self.patterns.remove(pattern, subscriber_id)
+        if sub is None:
+            return False
+        self.subscriber_count -= 1
+        self._close_subscriber_queue(sub)
+        self._patterns_changed()
+        return True
+
+    def _patterns_changed(self):
+        if self.cluster is not None:
+            for name, topic in list(self.topics.items()):
+                self.cluster.interest_changed(name, self.interest(topic))
+
     @log_async_exceptions
     async def unsubscribe(self, topic_name: str, subscriber_id: str):
-        if topic_name not in self.topics:
+        if is_pattern(topic_name):
+            return self._detach_pattern(topic_name, subscriber_id)
+        topic = self.topics.get(topic_name)
+        if topic is None:
             return False
-        topic = self.topics[topic_name]
-        async with topic.lock:
-            if subscriber_id in topic.subscribers:
-                sub = topic.subscribers.pop(subscriber_id)
-                await self._close_subscriber_queue(sub)
-                return True
+        async with timed_lock(topic.lock, metrics.LOCK_WAIT_TOPIC):
+            return self._detach(topic, subscriber_id)
+
+    def _detach(self, topic: Topic, subscriber_id: str) -> bool:
+        # synchronous, so it is atomic with respect to publishers iterating the old snapshot
+        sub = topic.subscribers.pop(subscriber_id, None)
+        if sub is None:
             return False
+        topic.lagging.pop(subscriber_id, None)
+        group = topic.groups.get(sub.group) if sub.group is not None else None
+        if group is not None:
+            # events already queued for this member leave with it, as for any subscriber
+            group.members.pop(subscriber_id, None)
+            group.refresh()
+            if not group.members:
+                del topic.groups[group.name]
+        self._snapshot(topic)
+        self.subscriber_count -= 1
+        self._close_subscriber_queue(sub)
+        if self.cluster is not None:
+            self.cluster.interest_changed(topic.name, self.interest(topic))
+        return True
         
     @log_async_exceptions
-    async def publish(self, topic_name: str, message: Any):
-        if topic_name not in self.topics:
+    async def publish(self, topic_name: str, message: Any, replicate: bool = True):
+        start = time.perf_counter()
+        topic = self.topics.get(topic_name)
+        if topic is None:
             return False
-        topic = self.topics[topic_name]
-        timestamped = {"message": message, "timestamp": now_iso()}
-        # store in ring (best-effort, non-blocking)
+        if replicate and self.cluster is not None and not self.cluster.owns(topic_name):
+            return await self.cluster.forward_publish(topic_name, message)
+        if self._duplicate_of(topic, message) is not None:
+            return DUPLICATE
+        blocked = self._fanout(topic, (self._append(topic, message),))
+        if replicate and self.relay is not None:
+            self.relay.forward([(topic_name, message)])
+        if blocked:
+            await self._wait_blocked(topic, blocked)
+        if metrics.METRICS_ENABLED:
+            metrics.PUBLISH_TO_ENQUEUE.observe_since(start)
+        return True
+
+    @log_async_exceptions
+    async def publish_many(self, items: List[Tuple[str, Any]], replicate: bool = True) -> List[Optional[int]]:
+        """Publish (topic_name, message) pairs in bulk.
+
+        Messages are grouped per topic, appended in order and fanned out with
+        one pass over each topic's subscribers. Returns the assigned seq for
+        each item, or None where the topic does not exist. A message id that
+        is already in the topic's dedup index gets Duplicate(original seq)
+        and is not delivered again.
+        """
+        if replicate and self.cluster is not None:
+            return await self.cluster.publish_many(items)
+        start = time.perf_counter()
+        results: List[Optional[int]] = [None] * len(items)
+        by_topic: Dict[str, List[Event]] = {}
+        for i, (topic_name, message) in enumerate(items):
+            topic = self.topics.get(topic_name)
+            if topic is None:
+                continue
+            original = self._duplicate_of(topic, message)
+            if original is not None:
+                results[i] = Duplicate(original)
+                continue
+            ev = self._append(topic, message)
+            by_topic.setdefault(topic_name, []).append(ev)
+            results[i] = ev.seq
+        waits = []
+        for topic_name, events in by_topic.items():
+            topic = self.topics.get(topic_name)
+            if topic is not None:
+                blocked = self._fanout(topic, events)
+                if blocked:
+                    waits.append((topic, blocked))
+        if replicate and self.relay is not None:
+            self.relay.forward([(ev.topic, ev.message) for events in by_topic.values() for ev in events])
+        for topic, blocked in waits:
+            await self._wait_blocked(topic, blocked)
+        if metrics.METRICS_ENABLED and by_topic:
+            metrics.PUBLISH_TO_ENQUEUE.observe_since(start)
+        return results
+
+    async def publish_mirrored(self, topic_name: str, events: List[Tuple[Dict[str, Any], Optional[str]]]):
+        """Fan out events sequenced by another node, keeping the owner's seq and frame.
+
+        events are (decoded event frame, raw frame text or None). The local ring
+        mirrors the owner's numbering and is reset if a gap shows up.
+        """
+        topic = self.topics.get(topic_name)
+        if topic is None:
+            return
+        out = []
+        for data, frame in events:
+            seq = data.get("seq", topic.ring.next_seq)
+            if seq != topic.ring.next_seq:
+                topic.ring.reset(seq)
+            frame = frame or encode_frame(data)
+            ev = Event(topic_name, data["message"], data.get("ts", now_iso()), seq, frame, self._codec_for(topic, frame),
+                       time.perf_counter(), self._key_for(topic, data["message"]))
+            topic.ring.append(ev, len(ev.frame))
+            self._remember(topic, ev)
+            out.append(ev)
+        blocked = self._fanout(topic, out)
+        if blocked:
+            await self._wait_blocked(topic, blocked)
+
+    def _duplicate_of(self, topic: Topic, message: Any) -> Optional[int]:
+        """Seq of an earlier event with message's id, if the topic deduplicates and has one."""
+        if topic.dedup is None:
+            return None
+        key = id_key(message)
+        if key is None:
+            return None
+        seq = topic.dedup.seen(key)
+        if seq is not None:
+            topic.duplicates += 1
+        return seq
+
+    def _append(self, topic: Topic, message: Any) -> Event:
+        """Encode message once, assign its seq and store it in the ring (and log)."""
+        ts = now_iso()
+        seq = topic.ring.next_seq
+        frame = encode_frame(make_event(topic.name, message, ts=ts, seq=seq))
+        timestamped = Event(topic.name, message, ts, seq, frame, self._codec_for(topic, frame), time.perf_counter(),
+                            self._key_for(topic, message))
+        # frames are ASCII-only JSON, so len() is the byte size
+        topic.ring.append(timestamped, len(frame))
+        self._remember(topic, timestamped)
+        if topic.log is not None:
+            topic.log.append(seq, frame)
+        if topic.dedup is not None:
+            key = id_key(message)
+            if key is not None:
+                topic.dedup.add(key, seq)
+        return timestamped
+
+    def _key_for(self, topic: Topic, message: Any) -> Any:
+        if topic.key_of is None:
+            return None
+        key = topic.key_of(message.get("payload") if isinstance(message, dict) else None)
         try:
-            topic.ring.put_nowait(timestamped)
-        except asyncio.QueueFull:
-            # drop oldest: remove one and put
+            hash(key)
+        except TypeError:  # object or list key: use its canonical JSON
+            key = json.dumps(key, sort_keys=True, separators=(",", ":"), default=str)
+        return key
+
+    def _remember(self, topic: Topic, ev: Event):
+        """Make ev the last value for its key; re-inserted so the table stays in update order."""
+        if ev.key is not None:
+            topic.latest.pop(ev.key, None)
+            topic.latest[ev.key] = ev
+
+    def snapshot(self, topic_name: str) -> List[Event]:
+        """Newest event per key of a compacted topic, least recently updated first."""
+        topic = self.topics.get(topic_name)
+        return list(topic.latest.values()) if topic is not None else []
+
+    def _codec_for(self, topic: Topic, frame: str) -> Optional[TopicCodec]:
+        codec = topic.codec
+        if codec is None or not codec.wants(len(frame)):
+            return None
+        codec.observe(frame)
+        return codec
+
+    def _fanout(self, topic: Topic, events: Sequence[Event]) -> List[Tuple[Subscriber, Sequence[Event], int]]:
+        """Queue events for every matching subscriber without waiting.
+
+        Full queues are handled by each subscriber's policy. Returns the
+        block-policy subscribers that still have events to take, for the
+        publisher to wait on.
+        """
+        start = time.perf_counter()
+        blocked = []
+        # each distinct filter runs once per event, however many subscribers share it
+        passed: Dict[Any, List[Event]] = {}
+        # iterate the copy-on-write snapshots; no lock, no per-message list copy
+        for sub in topic.direct + self._pattern_subs(topic):
+            deliver = events
+            if sub.predicate is not None:
+                deliver = passed.get(sub.predicate)
+                if deliver is None:
+                    deliver = passed[sub.predicate] = [ev for ev in events if matches(sub.predicate, ev.message)]
+                if not deliver:
+                    continue
+            self._offer(topic, sub, deliver, blocked)
+        # one copy per group, not per member
+        for group in topic.group_snapshot:
+            for sub, deliver in group.route(events).items():
+                self._offer(topic, sub, deliver, blocked)
+        if metrics.METRICS_ENABLED:
+            metrics.FANOUT.observe_since(start)
+        return blocked
+
+    def _offer(self, topic: Topic, sub: Subscriber, deliver: Sequence[Event],
+               blocked: List[Tuple[Subscriber, Sequence[Event], int]]):
+        """Queue deliver for sub, applying its policy once the queue is full."""
+        q = sub.queue
+        policy = sub.policy
+        if sub.parked and policy != SPILL:
+            # nothing drains a parked queue: keep the newest, a resume refills older events from history
+            policy = DROP_OLDEST
+        for i, timestamped in enumerate(deliver):
+            if sub.spill is not None and sub.spill.pending:
+                self._spill(topic, sub, timestamped)  # stay behind what is already on disk
+                continue
+            if sub.waiting and policy == BLOCK:
+                sub.refill()  # the consumer may have made room since
+                if sub.waiting:
+                    self._block(sub, deliver[i:], blocked)  # stay behind events already waiting for room
+                    break
             try:
-                _ = topic.ring.get_nowait()
-                topic.ring.put_nowait(timestamped)
-            except Exception:
+                # non-blocking put to subscriber's queue to avoid blocking publisher
+                q.put_nowait(timestamped)
+                continue
+            except asyncio.QueueFull:
                 pass
-        # fan-out
-        async with topic.lock:
-            for sid, sub in list(topic.subscribers.items()):
+            if policy == DROP_OLDEST:
+                q.get_nowait()
+                q.put_nowait(timestamped)
+                self._count_drop(topic, sub, 1)
+            elif policy == DROP_NEWEST:
+                self._count_drop(topic, sub, 1)
+            elif policy == SPILL:
+                self._spill(topic, sub, timestamped)
+            elif policy == BLOCK:
+                self._block(sub, deliver[i:], blocked)
+                break
+            else:  # DISCONNECT; closing also evicts one queued event to fit the sentinel
+                self._count_drop(topic, sub, len(deliver) - i + 1)
+                self._remove_slow(topic, sub)
+                break
+        sub.wake()
+
+    def _block(self, sub: Subscriber, events: Sequence[Event], blocked: List[Tuple[Subscriber, Sequence[Event], int]]):
+        sub.waiting.extend(events)
+        # done once everything waiting up to and including these events has moved on
+        blocked.append((sub, events, sub.waited + len(sub.waiting)))
+
+    async def _wait_blocked(self, topic: Topic, blocked: List[Tuple[Subscriber, Sequence[Event], int]]):
+        """Wait for block-policy subscribers to take their events; drop what is left on timeout.
+
+        The events wait in sub.waiting, which the writer moves into the queue
+        as it drains, so they keep their order and later publishers queue up
+        behind them instead of taking the freed slots.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.BLOCK_TIMEOUT_MS / 1000.0
+        for sub, events, target in blocked:
+            if sub.moved is None:
+                sub.moved = asyncio.Event()
+            while True:
+                sub.moved.clear()  # before the check, so a move after it is not missed
+                if sub.waited >= target:
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self._count_drop(topic, sub, sub.release_waiting(events))
+                    break
                 try:
-                    # non-blocking put to subscriber's queue to avoid blocking publisher
-                    sub.queue.put_nowait(timestamped)
-                except asyncio.QueueFull:
-                    # backpressure policy: drop oldest from subscriber queue
-                    try:
-                        _ = sub.queue.get_nowait()
-                        sub.queue.put_nowait(timestamped)
-                    except Exception:
-                        # as last resort, remove slow subscriber
-                        await self._close_subscriber_queue(sub)
-                        topic.subscribers.pop(sid, None)
-        return True
-    
+                    await asyncio.wait_for(sub.moved.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _count_drop(self, topic: Topic, sub: Subscriber, n: int):
+        sub.dropped += n
+        topic.dropped += n
+        self._lagging(topic, sub)
+        if sub.on_drop is not None and n:
+            sub.on_drop(n)
+
+    @staticmethod
+    def _lagging(topic: Topic, sub: Subscriber):
+        if sub.topic == topic.name:  # pattern subscribers are not listed per topic
+            topic.lagging[sub.id] = sub
+
+    def _spill(self, topic: Topic, sub: Subscriber, timestamped: Event):
+        if sub.spill is None:
+            sub.spill = SpillQueue(config.SPILL_DIR)
+        sub.spill.push(timestamped.frame, timestamped.key, timestamped.created)
+        if timestamped.codec is not None:
+            sub.spill.codecs[topic.name] = timestamped.codec
+        sub.spilled += 1
+        topic.spilled += 1
+        self._lagging(topic, sub)
+
+    def _remove_slow(self, topic: Topic, sub: Subscriber):
+        if sub.topic == topic.name:
+            self._detach(topic, sub.id)
+        else:
+            self._detach_pattern(sub.topic, sub.id)
+        if sub.conn is not None:
+            sub.conn.send(make_error("SLOW_CONSUMER", f"queue full, subscription {sub.id} closed", topic=sub.topic))
+
     @log_async_exceptions
     async def get_last_n(self, topic_name: str, n: int):
-        if topic_name not in self.topics:
+        topic = self.topics.get(topic_name)
+        if topic is None:
             return []
-        topic = self.topics[topic_name]
-        items = []
-        # queue doesn't support direct slicing; copy to list (non-blocking)
-        q = topic.ring
-        try:
-            items = list(q._queue)[-n:]
-        except Exception:
-            items = []
-        return items
+        return topic.ring.last(n)
 
     @log_async_exceptions
-    async def _close_subscriber_queue(self, sub: Subscriber):
+    async def get_since(self, topic_name: str, seq: int):
+        """Events published after sequence number seq that are still retained."""
+        topic = self.topics.get(topic_name)
+        if topic is None:
+            return []
+        return topic.ring.since(seq)
+
+    def iter_history(self, topic_name: str, after_seq: int, upto_seq: int, events: bool = False):
+        """Lazily yield encoded frames for after_seq < seq <= upto_seq.
+
+        Served from the ring when it still holds after_seq + 1, otherwise from
+        the segment log until the ring takes over. Safe to consume across awaits.
+        With events=True it yields Events instead: the ring's own, and ones
+        decoded from the log's JSON frames (so binary payloads read from disk
+        come back base64-encoded).
+        """
+        pos = after_seq
+        while pos < upto_seq:
+            topic = self.topics.get(topic_name)
+            if topic is None:
+                return
+            ring = topic.ring
+            if topic.log is None or pos + 1 >= ring.first_seq:
+                for ev in ring.since(pos):
+                    if ev.seq > upto_seq:
+                        return
+                    yield ev if events else ev.frame
+                return
+            stop = min(upto_seq, ring.first_seq - 1)
+            for seq, frame in topic.log.read(pos, stop):
+                pos = seq
+                yield Event.from_frame(frame) if events else frame
+            pos = max(pos, stop)  # anything missing there was removed by retention
+
+    def tick_logs(self):
+        """Interval fsync and age retention for idle topic logs."""
+        for topic in list(self.topics.values()):
+            if topic.log is not None:
+                topic.log.tick()
+                topic.log.enforce_retention()
+
+    def close_logs(self):
+        for topic in list(self.topics.values()):
+            if topic.log is not None:
+                topic.log.close()
+
+    @log_exceptions
+    def _close_subscriber_queue(self, sub: Subscriber):
+        sub.release_waiting()  # publishers blocked on it stop waiting
+        if sub.spill is not None:
+            sub.spill.close()
+            sub.spill = None
         # put sentinel for reader to exit
         try:
             sub.queue.put_nowait(None)
-        except Exception:
-            pass
+        except asyncio.QueueFull:
+            # make room so the writer always sees the sentinel
+            sub.queue.get_nowait()
+            sub.queue.put_nowait(None)
+        sub.wake()
 
     @log_async_exceptions
     async def get_stats(self):
-        out = {}
-        async with self.global_lock:
-            for name, topic in self.topics.items():
-                async with topic.lock:
-                    out[name] = {
-                        "subscribers": len(topic.subscribers),
-                        "buffer_size": topic.ring.qsize()
-                    }
-        return out
+        # per-topic values are O(1) reads; no locks, so scrapes never stall publishers
+        return {
+            name: {
+                "subscribers": len(topic.subscribers),
+                "buffer_size": len(topic.ring),
+                "buffer_bytes": topic.ring.bytes,
+                "last_seq": topic.ring.next_seq - 1,
+                "log_bytes": topic.log.size_bytes if topic.log is not None else 0,
+                "dropped": topic.dropped,
+                "spilled": topic.spilled,
+                "duplicates": topic.duplicates,
+                **({"compact_key": topic.compact_key, "keys": len(topic.latest),
+                    "conflated": topic.conflated}
+                   if topic.compact_key else {}),
+                "groups": {
+                    group.name: {"strategy": group.strategy, "members": len(group.members)}
+                    for group in topic.group_snapshot
+                },
+                # only subscribers that have lost or spilled events, so the output stays small
+                "lagging": {
+                    sub.id: {"policy": sub.policy, "dropped": sub.dropped, "spilled": sub.spilled,
+                             "spill_pending": sub.spill.pending if sub.spill is not None else 0}
+                    for sub in list(topic.lagging.values())
+                },
+            }
+            for name, topic in list(self.topics.items())
+        }
+
+    def metric_families(self):
+        """Scrape-time gauges for /metrics, read lock-free off live objects."""
+        topics = list(self.topics.items())
+        subs = [(name, sub) for name, topic in topics for sub in topic.snapshot]
+        return [
+            ("mr_enclave_topics", "gauge", "Topics", [({}, len(topics))]),
+            ("mr_enclave_subscribers", "gauge", "Subscriptions, exact and pattern", [({}, self.subscriber_count)]),
+            ("mr_enclave_topic_last_seq", "gauge", "Last sequence number per topic",
+             [({"topic": name}, t.ring.next_seq - 1) for name, t in topics]),
+            ("mr_enclave_topic_buffer_bytes", "gauge", "Encoded bytes held in each topic's replay ring",
+             [({"topic": name}, t.ring.bytes) for name, t in topics]),
+            ("mr_enclave_topic_dropped_total", "counter", "Events dropped because a subscriber queue was full",
+             [({"topic": name}, t.dropped) for name, t in topics]),
+            ("mr_enclave_topic_spilled_total", "counter", "Events spilled to disk because a subscriber queue was full",
+             [({"topic": name}, t.spilled) for name, t in topics]),
+            ("mr_enclave_topic_duplicates_total", "counter", "Publishes ignored because their message id was seen",
+             [({"topic": name}, t.duplicates) for name, t in topics]),
+            ("mr_enclave_subscriber_queue_depth", "gauge", "Events waiting in each subscription's queue",
+             [({"topic": name, "client_id": sub.id}, sub.queue.qsize()) for name, sub in subs]),
+            ("mr_enclave_subscriber_dropped_total", "counter", "Events dropped per subscription",
+             [({"topic": name, "client_id": sub.id}, sub.dropped) for name, sub in subs]),
+        ]
+
+    def get_summary(self):
+        return {"topics": len(self.topics), "subscribers": self.subscriber_count}
 
 # singleton
 manager = PubSubManager()
\ No newline at end of file
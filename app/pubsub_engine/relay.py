@@ -0,0 +1,230 @@
+import asyncio
+import fcntl
+import itertools
+import json
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from ..utils import metrics
+from ..utils.logger_wrapper import logger
+from ..utils.util import json_default
+
+# one relay line carries a whole publish batch
+_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def _line(msg: Dict[str, Any]) -> bytes:
+    return (json.dumps(msg, separators=(",", ":"), default=json_default) + "\n").encode()
+
+
+class RelayHub:
+    """Relay between the worker processes of one host, over a Unix socket.
+
+    Exactly one worker runs the hub (whoever holds the lock file). It owns
+    the authoritative topic set, so create/delete are decided in one place,
+    and it re-broadcasts publishes to every other worker.
+    """
+
+    def __init__(self, path: str, topics: Set[str], compact: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.topics = set(topics)
+        self.compact: Dict[str, str] = dict(compact or {})  # compact_key of compacted topics
+        self.clients: Set[asyncio.StreamWriter] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket from a dead hub; we hold the lock now
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path, limit=_LINE_LIMIT)
+
+    def _broadcast(self, data: bytes, exclude: Optional[asyncio.StreamWriter] = None):
+        for w in list(self.clients):
+            if w is not exclude and not w.is_closing():
+                w.write(data)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients.add(writer)
+        try:
+            async for raw in reader:
+                msg = json.loads(raw)
+                op = msg.get("op")
+                if op == "publish":
+                    self._broadcast(raw, exclude=writer)
+                elif op == "hello":
+                    # a worker that survived a hub failover may know topics we do not
+                    self.topics.update(msg.get("topics", []))
+                    self.compact.update(msg.get("compact") or {})
+                    writer.write(_line({"op": "topics", "names": sorted(self.topics), "compact": self.compact}))
+                elif op == "create":
+                    ok = msg["name"] not in self.topics
+                    if ok:
+                        self.topics.add(msg["name"])
+                        if msg.get("compact_key"):
+                            self.compact[msg["name"]] = msg["compact_key"]
+                        self._broadcast(_line({"op": "create", "name": msg["name"],
+                                               "compact_key": msg.get("compact_key")}), exclude=writer)
+                    writer.write(_line({"op": "result", "rid": msg["rid"], "ok": ok}))
+                elif op == "delete":
+                    ok = msg["name"] in self.topics
+                    self.topics.discard(msg["name"])
+                    self.compact.pop(msg["name"], None)
+                    self._broadcast(_line({"op": "delete", "name": msg["name"]}), exclude=writer)
+                    writer.write(_line({"op": "result", "rid": msg["rid"], "ok": ok}))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+
+class Relay:
+    """Per-worker side of multi-worker mode.
+
+    Forwards this worker's publishes and topic changes to the hub and applies
+    what other workers did to the local PubSubManager, which then fans out to
+    this worker's own connections only.
+
+    Publishes made while the hub is unreachable are held, up to buffer_items
+    messages, and sent once the connection is back; beyond that the oldest
+    are dropped, logged and counted in dropped.
+    """
+
+    def __init__(self, manager, path: str, connect_timeout: float = 5.0, buffer_items: int = 10000):
+        self.manager = manager
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.buffer_items = buffer_items
+        self._buffer: Deque[List[Tuple[str, Any]]] = deque()  # publish batches waiting for the hub
+        self._buffered = 0  # messages in _buffer
+        self.dropped = 0
+        self._dropped_offline = 0  # dropped since the connection was lost, reported on reconnect
+        self.hub: Optional[RelayHub] = None
+        self._lock_fd: Optional[int] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._ready = asyncio.Event()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._rids = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("relay not connected after %ss, continuing", self.connect_timeout)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self.hub is not None and self.hub.server is not None:
+            self.hub.server.close()
+
+    async def _maybe_become_hub(self):
+        if self.hub is not None:
+            return
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+        self._lock_fd = fd  # held for the life of the process; released by the kernel if we die
+        self.hub = RelayHub(self.path, set(self.manager.topics), self.manager.compact_keys())
+        await self.hub.start()
+        logger.info("relay hub started on %s (pid %s)", self.path, os.getpid())
+
+    async def _run(self):
+        while True:
+            try:
+                await self._maybe_become_hub()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=_LINE_LIMIT)
+            except OSError:
+                await asyncio.sleep(0.2)
+                continue
+            self._writer = writer
+            writer.write(_line({"op": "hello", "topics": list(self.manager.topics),
+                                "compact": self.manager.compact_keys()}))
+            self._flush_buffer()
+            try:
+                async for raw in reader:
+                    await self._dispatch(json.loads(raw))
+            except (ConnectionError, ValueError):
+                pass
+            finally:
+                self._writer = None
+                self._ready.clear()
+                for fut in self._pending.values():
+                    if not fut.done():
+                        fut.set_exception(ConnectionError("relay disconnected"))
+                self._pending.clear()
+            logger.warning("relay connection lost, reconnecting")
+            await asyncio.sleep(0.1)
+
+    async def _dispatch(self, msg: Dict[str, Any]):
+        op = msg.get("op")
+        if op == "publish":
+            await self.manager.publish_many([tuple(i) for i in msg["items"]], replicate=False)
+        elif op == "create":
+            await self.manager.create_topic(msg["name"], replicate=False, compact_key=msg.get("compact_key"))
+        elif op == "delete":
+            await self.manager.delete_topic(msg["name"], replicate=False)
+        elif op == "topics":
+            compact = msg.get("compact") or {}
+            for name in msg["names"]:
+                if not self.manager.has_topic(name):
+                    await self.manager.create_topic(name, replicate=False, compact_key=compact.get(name))
+            self._ready.set()
+        elif op == "result":
+            fut = self._pending.pop(msg["rid"], None)
+            if fut is not None and not fut.done():
+                fut.set_result(msg["ok"])
+
+    async def _request(self, op: str, name: str, **fields) -> bool:
+        if self._writer is None:
+            await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+        rid = next(self._rids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        self._writer.write(_line({"op": op, "name": name, "rid": rid, **fields}))
+        return await asyncio.wait_for(fut, self.connect_timeout)
+
+    async def claim_topic(self, name: str, compact_key: Optional[str] = None) -> bool:
+        """Ask the hub to create name; False if some worker already has it."""
+        return await self._request("create", name, compact_key=compact_key)
+
+    async def drop_topic(self, name: str) -> bool:
+        return await self._request("delete", name)
+
+    def forward(self, items: List[Tuple[str, Any]]):
+        """Send locally published (topic, message) pairs to the other workers."""
+        if not items:
+            return
+        if self._writer is not None:
+            self._writer.write(_line({"op": "publish", "items": items}))
+            return
+        # hub restarting or being re-elected: hold them until _run reconnects
+        self._buffer.append(items)
+        self._buffered += len(items)
+        lost = 0
+        while self._buffered > self.buffer_items:
+            lost += len(self._buffer[0])
+            self._buffered -= len(self._buffer.popleft())
+        if lost:
+            if not self._dropped_offline:
+                logger.warning("relay buffer full (%d messages), dropping the oldest publishes", self.buffer_items)
+            self._dropped_offline += lost
+            self.dropped += lost
+            if metrics.METRICS_ENABLED:
+                metrics.RELAY_DROPPED.inc(lost)
+
+    def _flush_buffer(self):
+        if self._buffer or self._dropped_offline:
+            logger.warning("relay reconnected: relaying %d buffered messages, %d were dropped",
+                           self._buffered, self._dropped_offline)
+        while self._buffer:
+            self._writer.write(_line({"op": "publish", "items": self._buffer.popleft()}))
+        self._buffered = 0
+        self._dropped_offline = 0
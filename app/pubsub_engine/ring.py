@@ -0,0 +1,82 @@
+from typing import Any, List
+
+
+class RingBuffer:
+    """Array-backed ring of published items tagged with monotonic sequence numbers.
+
+    Bounded by item count and, optionally, by total size in bytes; the oldest
+    items are evicted first. Sequence numbers are contiguous within the ring,
+    so the position of any retained seq is computed, never searched for, and
+    reads copy only the k items they return.
+    """
+
+    def __init__(self, capacity: int, max_bytes: int = 0):
+        self.capacity = max(0, capacity)
+        self.max_bytes = max(0, max_bytes)
+        self._items: List[Any] = [None] * self.capacity
+        self._sizes: List[int] = [0] * self.capacity
+        self._start = 0  # slot of the oldest item
+        self._len = 0
+        self.bytes = 0
+        self.next_seq = 1  # seq the next append will get
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def first_seq(self) -> int:
+        """Seq of the oldest retained item (== next_seq when empty)."""
+        return self.next_seq - self._len
+
+    def _evict(self):
+        i = self._start
+        self.bytes -= self._sizes[i]
+        self._items[i] = None
+        self._sizes[i] = 0
+        self._start = (i + 1) % self.capacity
+        self._len -= 1
+
+    def append(self, item: Any, size: int = 0) -> int:
+        seq = self.next_seq
+        self.next_seq += 1
+        if self.capacity == 0 or (self.max_bytes and size > self.max_bytes):
+            # not retained, but seq still advances so gaps stay detectable; what is retained must
+            # stay contiguous up to next_seq, so everything older goes too
+            while self._len:
+                self._evict()
+            return seq
+        if self._len == self.capacity:
+            self._evict()
+        while self.max_bytes and self._len and self.bytes + size > self.max_bytes:
+            self._evict()
+        i = (self._start + self._len) % self.capacity
+        self._items[i] = item
+        self._sizes[i] = size
+        self._len += 1
+        self.bytes += size
+        return seq
+
+    def reset(self, next_seq: int):
+        """Drop everything and continue numbering at next_seq (used when mirroring a remote owner)."""
+        self._items = [None] * self.capacity
+        self._sizes = [0] * self.capacity
+        self._start = 0
+        self._len = 0
+        self.bytes = 0
+        self.next_seq = next_seq
+
+    def last(self, k: int) -> List[Any]:
+        """Return the newest k items, oldest first."""
+        k = min(max(k, 0), self._len)
+        if k == 0:
+            return []
+        cap = self.capacity
+        begin = (self._start + self._len - k) % cap
+        end = begin + k
+        if end <= cap:
+            return self._items[begin:end]
+        return self._items[begin:] + self._items[:end - cap]
+
+    def since(self, seq: int) -> List[Any]:
+        """Return every retained item with a sequence number greater than seq."""
+        return self.last(self.next_seq - 1 - seq)
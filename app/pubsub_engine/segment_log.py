@@ -0,0 +1,286 @@
+import bisect
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+# record: seq, payload length, crc32(payload), then the encoded event frame
+_RECORD = struct.Struct("<QII")
+# sparse index entry: seq, byte offset of that record in the segment
+_INDEX = struct.Struct("<QQ")
+
+FSYNC_ALWAYS = "always"
+FSYNC_BATCH = "batch"
+FSYNC_INTERVAL = "interval"
+
+# a log directory renamed aside for removal; "#" never appears in a quoted topic name
+TRASH_MARK = "#deleted-"
+
+# background fsyncs for batch/interval policies, so the event loop only pays for write()
+_fsync_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-fsync")
+
+
+def _fsync_and_close(fd: int):
+    # fd is a dup owned by the pool job, so it stays valid even if the segment is closed meanwhile
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Segment:
+    """One log file plus its sparse offset index, named by the first seq it holds."""
+
+    def __init__(self, directory: str, base_seq: int):
+        self.base_seq = base_seq
+        self.path = os.path.join(directory, f"{base_seq:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_seq:020d}.idx")
+        self.index_seqs: List[int] = []
+        self.index_offsets: List[int] = []
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.last_seq = base_seq - 1
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % _INDEX.size
+        for seq, offset in _INDEX.iter_unpack(data[:usable]):
+            if offset >= self.size:
+                break
+            self.index_seqs.append(seq)
+            self.index_offsets.append(offset)
+
+    def start_offset(self, after_seq: int) -> int:
+        """Offset of the last indexed record at or before after_seq + 1."""
+        i = bisect.bisect_right(self.index_seqs, after_seq + 1) - 1
+        return self.index_offsets[i] if i >= 0 else 0
+
+
+def _scan(buf, offset: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """Yield (seq, payload offset, payload length) for each intact record in buf[offset:end]."""
+    while offset + _RECORD.size <= end:
+        seq, length, crc = _RECORD.unpack_from(buf, offset)
+        start = offset + _RECORD.size
+        stop = start + length
+        if stop > end or zlib.crc32(buf[start:stop]) != crc:
+            return  # torn tail
+        yield seq, start, length
+        offset = stop
+
+
+class SegmentLog:
+    """Append-only, per-topic event log split into rolling segment files.
+
+    Records hold the already-encoded event frame, so replay hands frames
+    straight to the writer. Reads go through mmap and are lazy, so deep
+    history is never loaded into the heap as a whole. Segments are dropped
+    oldest-first by age (retention_ms) and total size (retention_bytes).
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 index_interval_bytes: int = 4096, fsync_policy: str = FSYNC_INTERVAL,
+                 fsync_batch: int = 100, fsync_interval_ms: int = 1000,
+                 retention_ms: int = 0, retention_bytes: int = 0):
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_INTERVAL):
+            raise ValueError(f"unknown fsync policy: {fsync_policy}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval_bytes = index_interval_bytes
+        self.fsync_policy = fsync_policy
+        self.fsync_batch = max(1, fsync_batch)
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.retention_ms = retention_ms
+        self.retention_bytes = retention_bytes
+
+        self.segments: List[Segment] = []
+        self.next_seq = 1
+        self._file = None
+        self._index_file = None
+        self._since_index = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    # --- open / recover ---
+
+    def _recover(self):
+        bases = sorted(int(n[:-4]) for n in os.listdir(self.directory) if n.endswith(".log"))
+        for base in bases:
+            seg = Segment(self.directory, base)
+            seg.load_index()
+            self.segments.append(seg)
+        if not self.segments:
+            self._roll(1)
+            return
+        # only the active segment can have a torn tail; trust sealed ones
+        for seg, nxt in zip(self.segments, self.segments[1:]):
+            seg.last_seq = nxt.base_seq - 1
+        active = self.segments[-1]
+        # rescan from the last index entry to find the end of intact data
+        valid_end = active.index_offsets[-1] if active.index_offsets else 0
+        last_seq = active.index_seqs[-1] - 1 if active.index_seqs else active.base_seq - 1
+        if active.size:
+            with open(active.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for seq, start, length in _scan(buf, valid_end, active.size):
+                    last_seq = seq
+                    valid_end = start + length
+        if valid_end < active.size:
+            os.truncate(active.path, valid_end)
+            active.size = valid_end
+        active.last_seq = last_seq
+        self.next_seq = last_seq + 1
+        self._open_active(active)
+        self.enforce_retention()
+
+    def _open_active(self, seg: Segment):
+        self._file = open(seg.path, "ab")
+        self._index_file = open(seg.index_path, "ab")
+        self._since_index = self.index_interval_bytes  # index the next record
+
+    def _roll(self, base_seq: int):
+        if self._file is not None:
+            self._sync(background=False)
+            self._file.close()
+            self._index_file.close()
+        seg = Segment(self.directory, base_seq)
+        self.segments.append(seg)
+        self._open_active(seg)
+
+    # --- write path ---
+
+    def append(self, seq: int, frame: str):
+        active = self.segments[-1]
+        if active.size >= self.segment_bytes and active.last_seq >= active.base_seq:
+            self._roll(seq)
+            self.enforce_retention()
+            active = self.segments[-1]
+        data = frame.encode()
+        offset = active.size
+        if self._since_index >= self.index_interval_bytes:
+            self._index_file.write(_INDEX.pack(seq, offset))
+            active.index_seqs.append(seq)
+            active.index_offsets.append(offset)
+            self._since_index = 0
+        self._file.write(_RECORD.pack(seq, len(data), zlib.crc32(data)))
+        self._file.write(data)
+        written = _RECORD.size + len(data)
+        active.size += written
+        active.last_seq = seq
+        self._since_index += written
+        self.next_seq = seq + 1
+        self._unsynced += 1
+        self._maybe_sync()
+
+    def _maybe_sync(self):
+        if self.fsync_policy == FSYNC_ALWAYS:
+            self._sync(background=False)
+        elif self.fsync_policy == FSYNC_BATCH:
+            if self._unsynced >= self.fsync_batch:
+                self._sync()
+        elif time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def tick(self):
+        """Called periodically so the interval policy also covers idle topics."""
+        if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self, background: bool = True):
+        self._file.flush()
+        self._index_file.flush()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        if background:
+            _fsync_pool.submit(_fsync_and_close, os.dup(self._file.fileno()))
+        else:
+            os.fsync(self._file.fileno())
+
+    # --- read path ---
+
+    def read(self, after_seq: int, upto_seq: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Lazily yield (seq, frame) for after_seq < seq <= upto_seq."""
+        if self._file is not None:
+            self._file.flush()  # make buffered appends visible to mmap
+        if upto_seq is None:
+            upto_seq = self.next_seq - 1
+        bases = [s.base_seq for s in self.segments]
+        i = max(0, bisect.bisect_right(bases, after_seq + 1) - 1)
+        for seg in list(self.segments[i:]):
+            if seg.base_seq > upto_seq:
+                return
+            if seg.last_seq <= after_seq or seg.size == 0:
+                continue
+            end = seg.size
+            try:
+                f = open(seg.path, "rb")
+            except FileNotFoundError:
+                continue  # removed by retention
+            with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for seq, start, length in _scan(buf, seg.start_offset(after_seq), min(end, len(buf))):
+                    if seq <= after_seq:
+                        continue
+                    if seq > upto_seq:
+                        return
+                    yield seq, buf[start:start + length].decode()
+
+    @property
+    def first_seq(self) -> int:
+        return self.segments[0].base_seq if self.segments else self.next_seq
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(s.size for s in self.segments)
+
+    # --- retention / lifecycle ---
+
+    def enforce_retention(self):
+        now = time.time()
+        total = self.size_bytes
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            too_big = self.retention_bytes and total > self.retention_bytes
+            too_old = self.retention_ms and (now - os.path.getmtime(oldest.path)) * 1000 > self.retention_ms
+            if not (too_big or too_old):
+                break
+            self.segments.pop(0)
+            total -= oldest.size
+            for path in (oldest.path, oldest.index_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self, sync: bool = True):
+        if self._file is not None:
+            if sync:
+                self._sync(background=False)
+            self._file.close()
+            self._index_file.close()
+            self._file = None
+            self._index_file = None
+
+    def destroy(self) -> str:
+        """Close the log and rename its directory aside; returns the new path for remove_trash.
+
+        The rename is cheap and frees the directory name at once, so only the
+        removal (slow for a large log) needs to run off the event loop.
+        """
+        self.close(sync=False)
+        trash = self.directory + TRASH_MARK + uuid4().hex
+        try:
+            os.rename(self.directory, trash)
+        except FileNotFoundError:
+            pass
+        return trash
+
+
+def remove_trash(path: str):
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,77 @@
+import asyncio
+import secrets
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from .pubsub import Subscriber
+
+
+@dataclass(eq=False)
+class Session:
+    """Subscriptions a client keeps across reconnects, by client_id."""
+    token: str
+    subscriptions: Dict[str, Subscriber] = field(default_factory=dict)
+    expiry: Optional[asyncio.TimerHandle] = None  # set while parked
+
+
+class SessionStore:
+    """Sessions of this process.
+
+    A session whose socket drops is parked: its subscribers stay registered
+    without a connection, so events keep queueing for them, and it can be
+    resumed by token for grace_ms. After that its subscriptions are closed
+    as if the socket had never had a session.
+    """
+
+    def __init__(self, manager, grace_ms: int):
+        self.manager = manager
+        self.grace = grace_ms / 1000.0
+        self.sessions: Dict[str, Session] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.grace > 0
+
+    def open(self) -> Session:
+        session = Session(secrets.token_urlsafe(16))
+        self.sessions[session.token] = session
+        return session
+
+    def park(self, session: Session, subscriptions: Dict[str, Subscriber]):
+        session.subscriptions = subscriptions
+        for sub in subscriptions.values():
+            sub.parked = True
+            sub.conn = None
+            sub.ws = None
+        session.expiry = asyncio.get_running_loop().call_later(self.grace, self._expire, session)
+
+    def _expire(self, session: Session):
+        # drop the token now, so a resume racing the unsubscribes below cannot take the session back
+        self.sessions.pop(session.token, None)
+        session.expiry = None
+        asyncio.ensure_future(self.close(session))
+
+    def resume(self, token: str) -> Optional[Session]:
+        """Take back a parked session; None if the token is unknown, expired or still connected."""
+        session = self.sessions.get(token)
+        if session is None or session.expiry is None:
+            return None
+        session.expiry.cancel()
+        session.expiry = None
+        return session
+
+    async def close(self, session: Session):
+        """Forget the session and unsubscribe whatever it still holds."""
+        if self.sessions.get(session.token) is session:
+            del self.sessions[session.token]
+        if session.expiry is not None:
+            session.expiry.cancel()
+            session.expiry = None
+        subscriptions, session.subscriptions = session.subscriptions, {}
+        for client_id, sub in subscriptions.items():
+            # the client may have subscribed again under the same id without resuming
+            if self.manager.get_subscriber(sub.topic, client_id) is sub:
+                await self.manager.unsubscribe(sub.topic, client_id)
+
+    def parked(self) -> int:
+        return sum(1 for s in self.sessions.values() if s.expiry is not None)
@@ -0,0 +1,63 @@
+import json
+import os
+import struct
+from typing import Any, Dict, Optional, Tuple
+from uuid import uuid4
+
+# record: frame length, key length (0 = no key), append time, then the frame and the key as JSON
+_HEAD = struct.Struct("<IId")
+
+
+class SpillQueue:
+    """FIFO of encoded frames in a local file, for a subscriber whose queue is full.
+
+    Frames are appended at the end and read back from a moving offset; the
+    file is truncated whenever the reader catches up, so it only grows while
+    the consumer is behind. It is scratch space, not durable storage: no
+    fsync, and the file is removed when the subscription closes.
+
+    Each frame keeps its compaction key and the perf_counter() time its
+    event was appended (only meaningful in this process). codecs holds the
+    compressor of each topic that had a compressed event spilled, so those
+    events can be compressed again once they come back.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}-{uuid4().hex}.spill")
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._write_off = 0
+        self._read_off = 0
+        self.pending = 0
+        self.codecs: Dict[str, Any] = {}
+
+    @property
+    def size_bytes(self) -> int:
+        return self._write_off - self._read_off
+
+    def push(self, frame: str, key: Any = None, created: float = 0.0):
+        data = frame.encode()
+        raw_key = b"" if key is None else json.dumps(key).encode()
+        os.pwrite(self._fd, _HEAD.pack(len(data), len(raw_key), created) + data + raw_key, self._write_off)
+        self._write_off += _HEAD.size + len(data) + len(raw_key)
+        self.pending += 1
+
+    def pop(self) -> Optional[Tuple[str, Any, float]]:
+        """Oldest (frame, key, created), or None when empty."""
+        if not self.pending:
+            return None
+        length, key_length, created = _HEAD.unpack(os.pread(self._fd, _HEAD.size, self._read_off))
+        data = os.pread(self._fd, length + key_length, self._read_off + _HEAD.size)
+        self._read_off += _HEAD.size + length + key_length
+        self.pending -= 1
+        if not self.pending:
+            os.ftruncate(self._fd, 0)
+            self._write_off = self._read_off = 0
+        return data[:length].decode(), json.loads(data[length:]) if key_length else None, created
+
+    def close(self):
+        os.close(self._fd)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
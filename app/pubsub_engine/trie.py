@@ -0,0 +1,108 @@
+from typing import Any, Dict, List, Optional
+
+SEPARATOR = "."
+ONE = "*"   # exactly one segment
+REST = "#"  # zero or more trailing segments
+
+
+def is_pattern(name: str) -> bool:
+    return ONE in name or REST in name
+
+
+def validate_pattern(pattern: str) -> Optional[str]:
+    """Return an error message if pattern is malformed, else None."""
+    segments = pattern.split(SEPARATOR)
+    for i, seg in enumerate(segments):
+        if not seg:
+            return "empty topic segment"
+        if (ONE in seg or REST in seg) and len(seg) > 1:
+            return f"wildcard must be a whole segment: {seg!r}"
+        if seg == REST and i != len(segments) - 1:
+            return "'#' is only allowed as the last segment"
+    return None
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.values: Dict[str, Any] = {}
+
+
+class TopicTrie:
+    """Pattern subscriptions indexed by topic segment.
+
+    Matching a topic walks one level per segment, following the literal,
+    "*" and "#" branches, so its cost depends on the topic's depth and not
+    on how many patterns are registered. generation changes on every add or
+    remove, so callers can cache match results per topic.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.generation = 0
+        self.count = 0
+
+    def _find(self, pattern: str) -> Optional[_Node]:
+        node = self.root
+        for seg in pattern.split(SEPARATOR):
+            node = node.children.get(seg)
+            if node is None:
+                return None
+        return node
+
+    def get(self, pattern: str, key: str) -> Any:
+        node = self._find(pattern)
+        return node.values.get(key) if node is not None else None
+
+    def add(self, pattern: str, key: str, value: Any):
+        node = self.root
+        for seg in pattern.split(SEPARATOR):
+            node = node.children.setdefault(seg, _Node())
+        if key not in node.values:
+            self.count += 1
+        node.values[key] = value
+        self.generation += 1
+
+    def remove(self, pattern: str, key: str) -> Any:
+        path = [self.root]
+        for seg in pattern.split(SEPARATOR):
+            nxt = path[-1].children.get(seg)
+            if nxt is None:
+                return None
+            path.append(nxt)
+        value = path[-1].values.pop(key, None)
+        if value is None:
+            return None
+        self.count -= 1
+        self.generation += 1
+        # prune branches left empty
+        for seg, parent, node in zip(reversed(pattern.split(SEPARATOR)), reversed(path[:-1]), reversed(path[1:])):
+            if node.values or node.children:
+                break
+            del parent.children[seg]
+        return value
+
+    def match(self, topic: str) -> List[Any]:
+        """Values of every pattern matching the concrete topic name."""
+        out: List[Any] = []
+        segments = topic.split(SEPARATOR)
+        frontier = [self.root]
+        for depth in range(len(segments) + 1):
+            nxt = []
+            for node in frontier:
+                rest = node.children.get(REST)
+                if rest is not None:
+                    out.extend(rest.values.values())
+                if depth == len(segments):
+                    out.extend(node.values.values())
+                    continue
+                for seg in (segments[depth], ONE):
+                    child = node.children.get(seg)
+                    if child is not None:
+                        nxt.append(child)
+            if not nxt and depth < len(segments):
+                break
+            frontier = nxt
+        return out
@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+# Multi-worker mode: set WORKERS to the uvicorn --workers count; siblings relay over RELAY_SOCKET
+WORKERS = int(os.getenv("WORKERS", "1"))
+RELAY_SOCKET = os.getenv("RELAY_SOCKET", "/tmp/mr-enclave-relay.sock")
+# Publishes held for the other workers while the hub is unreachable (hub restart or re-election)
+RELAY_BUFFER = int(os.getenv("RELAY_BUFFER", "10000"))
+
+# Cluster mode: CLUSTER_NODES="n1=127.0.0.1:8001,n2=127.0.0.1:8002", NODE_ID names this node
+CLUSTER_NODES = os.getenv("CLUSTER_NODES", "")
+NODE_ID = os.getenv("NODE_ID", "")
+CLUSTER_TOKEN = os.getenv("CLUSTER_TOKEN", "")  # shared secret peers present in their hello
+# Queue of a peer node's subscription at a topic's owner; it uses the block policy, so a lagging
+# peer slows publishers down before any of its events are dropped
+CLUSTER_QUEUE_SIZE = int(os.getenv("CLUSTER_QUEUE_SIZE", "10000"))
+
+# Per-subscriber queue; QUEUE_MAXSIZE is accepted as an older name for QUEUE_SIZE
+QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", os.getenv("QUEUE_MAXSIZE", "100")))
+# What happens when a subscriber's queue is full: drop_oldest | drop_newest | block | disconnect | spill.
+# Subscriptions can pick their own; block waits up to BLOCK_TIMEOUT_MS before dropping.
+BACKPRESSURE_POLICY = os.getenv("BACKPRESSURE_POLICY", "drop_oldest")
+BLOCK_TIMEOUT_MS = int(os.getenv("BLOCK_TIMEOUT_MS", "1000"))
+SPILL_DIR = os.getenv("SPILL_DIR", os.path.join(tempfile.gettempdir(), "mr-enclave-spill"))
+
+# Sessions: a socket that opened one keeps its subscriptions (still queueing) for SESSION_GRACE_MS
+# after it drops, for a client that reconnects with the token (0 = sessions off)
+SESSION_GRACE_MS = int(os.getenv("SESSION_GRACE_MS", "30000"))
+
+# Idempotent publish: a message id seen among a topic's last DEDUP_MAX_IDS publishes, and no older
+# than DEDUP_WINDOW_MS (0 = no age limit), is acked as "duplicate" and not delivered again (0 ids = off)
+DEDUP_MAX_IDS = int(os.getenv("DEDUP_MAX_IDS", "0"))
+DEDUP_WINDOW_MS = int(os.getenv("DEDUP_WINDOW_MS", "300000"))
+
+# HTTP: POST /topics/{name}/messages publishes NDJSON in batches of NDJSON_BATCH lines, rejecting
+# lines over NDJSON_MAX_LINE_BYTES; GET /topics/{name}/stream sends a keepalive when idle this long
+NDJSON_BATCH = int(os.getenv("NDJSON_BATCH", "500"))
+NDJSON_MAX_LINE_BYTES = int(os.getenv("NDJSON_MAX_LINE_BYTES", str(1024 * 1024)))
+STREAM_KEEPALIVE_S = float(os.getenv("STREAM_KEEPALIVE_S", "15"))
+
+# Per-topic replay history: bounded by message count and by total encoded bytes (0 = no byte cap)
+RING_SIZE = int(os.getenv("RING_SIZE", "100"))
+RING_MAX_BYTES = int(os.getenv("RING_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Subscribers without an explicit batch_max get "events" frames of up to BATCH_DEFAULT_MAX
+# once more than BATCH_BACKLOG_THRESHOLD events are pending (0 disables automatic batching)
+BATCH_BACKLOG_THRESHOLD = int(os.getenv("BATCH_BACKLOG_THRESHOLD", "64"))
+BATCH_DEFAULT_MAX = int(os.getenv("BATCH_DEFAULT_MAX", "100"))
+
+# Durable per-topic segment log; leave PERSIST_DIR empty to keep history in memory only
+PERSIST_DIR = os.getenv("PERSIST_DIR", "")
+SEGMENT_BYTES = int(os.getenv("SEGMENT_BYTES", str(64 * 1024 * 1024)))
+INDEX_INTERVAL_BYTES = int(os.getenv("INDEX_INTERVAL_BYTES", "4096"))
+FSYNC_POLICY = os.getenv("FSYNC_POLICY", "interval")  # always | batch | interval
+FSYNC_BATCH = int(os.getenv("FSYNC_BATCH", "100"))
+FSYNC_INTERVAL_MS = int(os.getenv("FSYNC_INTERVAL_MS", "1000"))
+RETENTION_MS = int(os.getenv("RETENTION_MS", "0"))  # 0 = no age limit
+RETENTION_BYTES = int(os.getenv("RETENTION_BYTES", "0"))  # 0 = no size limit
+
+# Compress-once for subscribers that ask for it: events of at least COMPRESS_MIN_BYTES are deflated
+# once and the same buffer goes to every such subscriber (0 disables compression)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+# build a per-topic preset dictionary from this many large events (0 = no dictionary)
+COMPRESS_DICT_SAMPLES = int(os.getenv("COMPRESS_DICT_SAMPLES", "0"))
@@ -1,59 +1,113 @@
+import atexit
 import functools
 import logging
-import traceback
-from datetime import datetime
+import logging.handlers
+import os
+import queue
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "mr-enclave.log")
+# success-path timings are aggregated and emitted once every N calls per function
+LOG_SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "1000")))
+
+# Configure logging: the event loop only enqueues records, a background thread does the I/O
+_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_file_handler = logging.FileHandler(LOG_FILE)
+_stream_handler = logging.StreamHandler()
+for _h in (_file_handler, _stream_handler):
+    _h.setFormatter(_formatter)
+
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(_log_queue, _file_handler, _stream_handler, respect_handler_level=True)
+
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # listener handlers apply the real format
 
-# Configure logging
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("mr-enclave.log"),
-        logging.StreamHandler()
-    ]
+    level=LOG_LEVEL,
+    handlers=[_queue_handler]
 )
+_listener.start()
+atexit.register(_listener.stop)
+
 logger = logging.getLogger("mr-enclave")
 
+
+class _CallStats:
+    """Running success-path timings for one wrapped function."""
+    __slots__ = ("calls", "total", "max")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+def _timer_factory(func_name: str):
+    """Return a callback recording one successful call of func_name.
+
+    DEBUG logs every call, INFO logs one aggregate line per LOG_SAMPLE_EVERY
+    calls; callers skip it entirely above INFO.
+    """
+    stats = _CallStats()
+
+    def record(elapsed: float):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Completed %s in %.6fs", func_name, elapsed)
+            return
+        stats.calls += 1
+        stats.total += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        if stats.calls >= LOG_SAMPLE_EVERY:
+            logger.info("%s: %d calls, avg %.6fs, max %.6fs",
+                        func_name, stats.calls, stats.total / stats.calls, stats.max)
+            stats.calls, stats.total, stats.max = 0, 0.0, 0.0
+
+    return record
+
+
+def _log_failure(func_name: str, elapsed: float, args, kwargs, exc: Exception):
+    logger.error(f"Error in {func_name} after {elapsed:.6f}s with args={args}, kwargs={kwargs}: {exc}",
+                 exc_info=True)
+
+
 def log_exceptions(func):
     """Decorator to log exceptions for synchronous functions"""
     func.__globals__["logger"] = logger
+    func_name = func.__name__
+    record = _timer_factory(func_name)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = datetime.now()
-        func_name = func.__name__
+        start_time = time.perf_counter()
         try:
-            logger.info(f"Starting {func_name}")
             result = func(*args, **kwargs)
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.info(f"Completed {func_name} in {execution_time}s")
-            return result
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.error(f"Error in {func_name} after {execution_time}s: {str(e)}")
-            logger.error(f"Error in {func_name} with args={args}, kwargs={kwargs}: {e}")
-            logger.debug(f"Traceback: {traceback.format_exc()}")
+            _log_failure(func_name, time.perf_counter() - start_time, args, kwargs, e)
             raise
+        if logger.isEnabledFor(logging.INFO):
+            record(time.perf_counter() - start_time)
+        return result
     return wrapper
 
+
 def log_async_exceptions(func):
     """Decorator to log exceptions for async functions"""
     func.__globals__["logger"] = logger
+    func_name = f"async {func.__name__}"
+    record = _timer_factory(func_name)
+
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        start_time = datetime.now()
-        func_name = func.__name__
-        # langfuse = Langfuse()
+        start_time = time.perf_counter()
         try:
-            logger.info(f"Starting async {func_name}")
             result = await func(*args, **kwargs)
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.info(f"Completed async {func_name} in {execution_time}s")
-            return result
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.error(f"Error in async {func_name} after {execution_time}s: {str(e)}")
-            # logger.error(f"Langfuse trace URL: {langfuse.get_trace_url()} | Trace ID: {langfuse.get_current_trace_id()}")
-            logger.debug(f"Traceback: {traceback.format_exc()}")
-            raise e
+            _log_failure(func_name, time.perf_counter() - start_time, args, kwargs, e)
+            raise
+        if logger.isEnabledFor(logging.INFO):
+            record(time.perf_counter() - start_time)
+        return result
     return wrapper
-
@@ -0,0 +1,125 @@
+import bisect
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"
+
+# 1us .. ~8s, doubling; fixed at import so an observation never allocates
+LATENCY_BUCKETS: Tuple[float, ...] = tuple(1e-6 * 2 ** i for i in range(24))
+
+_registry: List["_Metric"] = []
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        _registry.append(self)
+
+    def lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Optional[Dict[str, str]] = None):
+        super().__init__(name, help, labels)
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+    def lines(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labels)} {self.value}"]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect and two additions."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Optional[Dict[str, str]] = None,
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def observe_since(self, start: float, now: Optional[float] = None):
+        self.observe((now if now is not None else time.perf_counter()) - start)
+
+    def lines(self) -> List[str]:
+        out = []
+        total = 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            out.append(f"{self.name}_bucket{_labels({**self.labels, 'le': repr(bound)})} {total}")
+        total += self.counts[-1]
+        out.append(f"{self.name}_bucket{_labels({**self.labels, 'le': '+Inf'})} {total}")
+        out.append(f"{self.name}_sum{_labels(self.labels)} {self.sum}")
+        out.append(f"{self.name}_count{_labels(self.labels)} {total}")
+        return out
+
+
+@asynccontextmanager
+async def timed_lock(lock, histogram: Histogram):
+    """async with lock, recording how long acquiring it took."""
+    start = time.perf_counter()
+    async with lock:
+        if METRICS_ENABLED:
+            histogram.observe_since(start)
+        yield
+
+
+def render(families: Iterable[Tuple[str, str, str, Iterable[Sample]]] = ()) -> str:
+    """Prometheus text format for every registered metric plus scrape-time families.
+
+    families are (name, type, help, samples) computed by the caller at scrape
+    time, e.g. gauges read off live objects.
+    """
+    out: List[str] = []
+    seen = set()
+    for metric in _registry:
+        if metric.name not in seen:
+            seen.add(metric.name)
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(metric.lines())
+    for name, kind, help, samples in families:
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(f"{name}{_labels(labels)} {value}" for labels, value in samples)
+    return "\n".join(out) + "\n"
+
+
+# --- pipeline instruments ---
+
+PUBLISH_TO_ENQUEUE = Histogram("mr_enclave_publish_to_enqueue_seconds",
+                               "From publish() entry until the event is queued for every subscriber")
+FANOUT = Histogram("mr_enclave_fanout_seconds", "Duration of one fan-out pass over a topic's subscribers")
+APPEND_TO_SEND = Histogram("mr_enclave_append_to_send_seconds",
+                           "From an event being appended to its topic until a connection wrote it")
+LOCK_WAIT_TOPIC = Histogram("mr_enclave_lock_wait_seconds", "Time spent waiting for a lock", {"lock": "topic"})
+LOCK_WAIT_GLOBAL = Histogram("mr_enclave_lock_wait_seconds", "Time spent waiting for a lock", {"lock": "global"})
+FRAMES_SENT = Counter("mr_enclave_sent_frames_total", "WebSocket frames written to clients")
+BYTES_SENT = Counter("mr_enclave_sent_bytes_total", "Bytes written to clients")
+RELAY_DROPPED = Counter("mr_enclave_relay_dropped_total",
+                        "Publishes never relayed to other workers because the relay buffer overflowed")
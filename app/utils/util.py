@@ -35,8 +35,12 @@
 #     return out
 
 # app/utils/util.py
+import base64
+import json
 import time
-from typing import Optional, Any, Dict
+import uuid
+import msgpack
+from typing import Optional, Any, Dict, List
 
 def now_ts() -> str:
     """Return ISO timestamp (UTC)."""
@@ -50,6 +54,14 @@ def make_ack(request_id: Optional[str], topic: Optional[str], status: str = "ok"
         out["topic"] = topic
     return out
 
+def make_batch_ack(request_id: Optional[str], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Single ack for a publish_batch frame with one status entry per message."""
+    ok = all(r["status"] in ("ok", "duplicate") for r in results)
+    out = {"type": "ack", "status": "ok" if ok else "partial", "results": results, "ts": now_ts()}
+    if request_id:
+        out["request_id"] = request_id
+    return out
+
 def make_error(code: str, message: str, request_id: Optional[str] = None, topic: Optional[str] = None) -> Dict[str, Any]:
     out = {
         "type": "error",
@@ -62,25 +74,105 @@ def make_error(code: str, message: str, request_id: Optional[str] = None, topic:
         out["topic"] = topic
     return out
 
-def make_event(topic: str, message: Any, request_id: Optional[str] = None) -> Dict[str, Any]:
+def make_event(topic: str, message: Any, request_id: Optional[str] = None, ts: Optional[str] = None,
+               seq: Optional[int] = None) -> Dict[str, Any]:
     out = {
         "type": "event",
         "topic": topic,
         "message": message,
-        "ts": now_ts()
+        "ts": ts or now_ts()
     }
+    if seq is not None:
+        out["seq"] = seq
     if request_id:
         out["request_id"] = request_id
     return out
 
+def json_default(obj: Any) -> Any:
+    """JSON fallback for opaque binary payloads from binary-subprotocol clients: base64 text."""
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def encode_frame(out: Dict[str, Any]) -> str:
+    """Serialize an outbound frame to compact JSON text."""
+    return json.dumps(out, separators=(",", ":"), default=json_default)
+
+def make_events_frame(topic: str, frames: List[str]) -> str:
+    """Wrap already-encoded event frames in one "events" frame without re-encoding them."""
+    return '{"type":"events","topic":%s,"events":[%s]}' % (json.dumps(topic), ",".join(frames))
+
+# Binary subprotocol: the same frames as msgpack maps, with message ids as raw 16-byte UUIDs
+BINARY_SUBPROTOCOL = "mr-enclave.msgpack"
+
+def _ids_to_bytes(message: Any) -> Any:
+    if isinstance(message, dict) and isinstance(message.get("id"), str):
+        try:
+            return {**message, "id": uuid.UUID(message["id"]).bytes}
+        except ValueError:
+            pass
+    return message
+
+def _ids_to_str(message: Any) -> Any:
+    if isinstance(message, dict) and isinstance(message.get("id"), bytes) and len(message["id"]) == 16:
+        message["id"] = str(uuid.UUID(bytes=message["id"]))
+    return message
+
+def encode_binary(out: Dict[str, Any]) -> bytes:
+    """Serialize an outbound frame for the binary subprotocol."""
+    if "message" in out:
+        out = {**out, "message": _ids_to_bytes(out["message"])}
+    return msgpack.packb(out, use_bin_type=True)
+
+def decode_binary(raw: bytes) -> Dict[str, Any]:
+    """Parse an inbound binary frame into the same dict shape as a JSON frame."""
+    data = msgpack.unpackb(raw, raw=False)
+    if not isinstance(data, dict):
+        raise ValueError("frame must be a map")
+    if "message" in data:
+        _ids_to_str(data["message"])
+    for item in data.get("messages") or ():
+        if isinstance(item, dict):
+            _ids_to_str(item.get("message"))
+    return data
+
+def _array_header(n: int) -> bytes:
+    if n < 16:
+        return bytes((0x90 | n,))
+    if n < 0x10000:
+        return b"\xdc" + n.to_bytes(2, "big")
+    return b"\xdd" + n.to_bytes(4, "big")
+
+def make_binary_events_frame(topic: str, frames: List[bytes]) -> bytes:
+    """Binary counterpart of make_events_frame: splices pre-encoded event frames into one array."""
+    head = msgpack.packb({"type": "events", "topic": topic, "events": []}, use_bin_type=True)
+    # the empty array is the last byte; replace it with the real header and the frames
+    return head[:-1] + _array_header(len(frames)) + b"".join(frames)
+
+def make_zdict(dict_id: int, zdict: bytes) -> Dict[str, Any]:
+    """Preset dictionary for compressed frames carrying dict_id (bytes are base64 in JSON)."""
+    return {"type": "zdict", "id": dict_id, "dict": zdict}
+
 def make_pong(request_id: Optional[str] = None) -> Dict[str, Any]:
     out = {"type": "pong", "ts": now_ts()}
     if request_id:
         out["request_id"] = request_id
     return out
 
-def make_info(msg: str, topic: Optional[str] = None) -> Dict[str, Any]:
+def make_info(msg: str, topic: Optional[str] = None, **fields: Any) -> Dict[str, Any]:
     out = {"type": "info", "msg": msg, "ts": now_ts()}
     if topic:
         out["topic"] = topic
+    out.update((k, v) for k, v in fields.items() if v is not None)
+    return out
+
+def make_session(request_id: Optional[str], token: str, resumed: Optional[List[str]] = None,
+                 lost: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Reply to a session frame; resumed/lost list client_ids when a parked session was taken back."""
+    out = {"type": "session", "token": token, "ts": now_ts()}
+    if resumed is not None:
+        out["resumed"] = resumed
+        out["lost"] = lost or []
+    if request_id:
+        out["request_id"] = request_id
     return out
\ No newline at end of file
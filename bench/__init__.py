@@ -0,0 +1,6 @@
+"""Load generator and regression benchmarks for the WebSocket pub/sub API.
+
+    python -m bench run --publishers 4 --subscribers 64 --topics 1,16 --save bench/baseline.json
+    python -m bench run --compare bench/baseline.json
+    python -m bench compare old.json new.json
+"""
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import itertools
+import sys
+from dataclasses import asdict, fields
+from typing import List
+
+from . import report
+from .harness import Scenario, Server, run_scenario
+
+# scenario fields that accept comma-separated lists and expand into a matrix
+_MATRIX = ("publishers", "subscribers", "topics", "payload_bytes", "last_n", "batch")
+
+
+def _ints(value: str) -> List[int]:
+    try:
+        return [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated integers, got {value!r}")
+
+
+def _env(value: str):
+    key, sep, val = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {value!r}")
+    return key, val
+
+
+def _parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="python -m bench",
+                                description="Load generator and regression benchmarks for MR-Enclave.")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run scenarios against a server")
+    defaults = Scenario()
+    for f in fields(Scenario):
+        flag = "--" + f.name.replace("_", "-")
+        if f.name in _MATRIX:
+            run.add_argument(flag, type=_ints, default=[getattr(defaults, f.name)],
+                             help=f"comma-separated values (default {getattr(defaults, f.name)})")
+        else:
+            run.add_argument(flag, type=f.type, default=getattr(defaults, f.name),
+                             help=f"default {getattr(defaults, f.name)}")
+    target = run.add_mutually_exclusive_group()
+    target.add_argument("--url", help="benchmark an already running server, e.g. http://127.0.0.1:8000")
+    target.add_argument("--inproc", action="store_true", help="run uvicorn in a thread of this process")
+    run.add_argument("--server-pid", type=int, help="with --url: process to measure memory of")
+    run.add_argument("--server-env", type=_env, action="append", default=[], metavar="KEY=VALUE",
+                     help="environment for a spawned/in-process server, e.g. RING_SIZE=1000")
+    run.add_argument("--repeat", type=int, default=1, help="run each scenario N times and keep medians")
+    run.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each phase")
+    run.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    run.add_argument("--compare", metavar="BASELINE", help="compare results against a saved baseline")
+    run.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression (default 0.10)")
+
+    cmp = sub.add_parser("compare", help="compare two saved result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression (default 0.10)")
+    return p
+
+
+def _scenarios(args) -> List[Scenario]:
+    fixed = {f.name: getattr(args, f.name) for f in fields(Scenario) if f.name not in _MATRIX}
+    out = []
+    for values in itertools.product(*(getattr(args, name) for name in _MATRIX)):
+        out.append(Scenario(**fixed, **dict(zip(_MATRIX, values))))
+    return out
+
+
+async def _run_all(server: Server, scenarios: List[Scenario], repeat: int, timeout: float):
+    runs = []
+    for s in scenarios:
+        samples = []
+        for i in range(repeat):
+            print(f"{s.name} [{i + 1}/{repeat}]", file=sys.stderr)
+            samples.append(await run_scenario(server, s, timeout))
+        runs.append({"name": s.name, "params": asdict(s), "metrics": report.merge_repeats(samples)})
+    return runs
+
+
+def _finish(regressions) -> int:
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond tolerance", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    args = _parser().parse_args(argv)
+    if args.command == "compare":
+        return _finish(report.compare(report.load(args.baseline), report.load(args.current), args.tolerance))
+
+    baseline = report.load(args.compare) if args.compare else None
+    mode = "url" if args.url else "inproc" if args.inproc else "spawn"
+    server = Server(mode, url=args.url, env=dict(args.server_env), pid=args.server_pid)
+    server.start()
+    try:
+        runs = asyncio.run(_run_all(server, _scenarios(args), max(1, args.repeat), args.timeout))
+    finally:
+        server.stop()
+
+    result = report.make_report(runs, mode)
+    report.print_runs(runs)
+    if args.save:
+        report.save(result, args.save)
+        print(f"\nsaved {args.save}", file=sys.stderr)
+    if baseline is not None:
+        return _finish(report.compare(baseline, result, args.tolerance))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,396 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from websockets.asyncio.client import connect
+
+from .report import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Scenario:
+    publishers: int = 4
+    subscribers: int = 16
+    topics: int = 4
+    payload_bytes: int = 256
+    messages: int = 2000  # per publisher, measured
+    warmup: int = 100     # per publisher, before measuring
+    batch: int = 1        # >1 publishes with publish_batch frames of this size
+    window: int = 64      # unacknowledged frames each publisher may have in flight
+    last_n: int = 0       # prefill each topic and replay this many on subscribe
+    sub_batch: int = 0    # batch_max for subscriptions (0 = single events)
+    policy: str = "block"
+
+    @property
+    def name(self) -> str:
+        name = (f"p{self.publishers}-s{self.subscribers}-t{self.topics}-b{self.payload_bytes}"
+                f"-m{self.messages}")
+        if self.batch > 1:
+            name += f"-pb{self.batch}"
+        if self.last_n:
+            name += f"-r{self.last_n}"
+        if self.sub_batch:
+            name += f"-sb{self.sub_batch}"
+        if self.policy != "block":
+            name += f"-{self.policy}"
+        return name
+
+
+# --- server under test ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_kb(pid: int) -> Optional[int]:
+    """Resident set size from /proc; None where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Server:
+    """The app under test: a local uvicorn process, uvicorn in a thread, or an existing URL."""
+
+    def __init__(self, mode: str = "spawn", url: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+                 pid: Optional[int] = None):
+        self.mode = mode
+        self.url = url
+        self.env = env or {}
+        self.pid = pid  # process whose memory is measured
+        self._proc: Optional[subprocess.Popen] = None
+        self._uvicorn = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def http(self) -> str:
+        return self.url.rstrip("/")
+
+    @property
+    def ws(self) -> str:
+        return "ws" + self.http[len("http"):] + "/ws"
+
+    def start(self):
+        if self.mode == "url":
+            self._wait_ready()
+            return
+        port = _free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        if self.mode == "spawn":
+            env = {**os.environ, "LOG_LEVEL": "WARNING",
+                   "LOG_FILE": os.path.join(tempfile.gettempdir(), "mr-enclave-bench.log"), **self.env}
+            self._proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+                 "--log-level", "warning", "--no-access-log", "--ws-per-message-deflate", "false"],
+                cwd=REPO_ROOT, env=env)
+            self.pid = self._proc.pid
+        else:
+            # same process: config is read at import, so the env has to be in place first
+            os.environ.update(self.env)
+            import uvicorn
+            from app.main import app
+            self._uvicorn = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                                          log_level="warning", access_log=False,
+                                                          ws_per_message_deflate=False))
+            self._thread = threading.Thread(target=self._uvicorn.run, name="bench-server", daemon=True)
+            self._thread.start()
+            self.pid = os.getpid()
+        self._wait_ready()
+
+    def _wait_ready(self, timeout: float = 20.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(self.http + "/health", timeout=1) as r:
+                    if r.status == 200:
+                        return
+            except (OSError, urllib.error.URLError):
+                pass
+            if self._proc is not None and self._proc.poll() is not None:
+                raise RuntimeError(f"server exited with status {self._proc.returncode}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"server at {self.http} did not become ready")
+            time.sleep(0.1)
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        if self._uvicorn is not None:
+            self._uvicorn.should_exit = True
+            self._thread.join(10)
+
+    def rss_kb(self) -> Optional[int]:
+        return _rss_kb(self.pid) if self.pid else None
+
+    def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> int:
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.http + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=10) as r:
+                return r.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# --- workload ---
+
+def _message(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": str(uuid.uuid4()), "payload": payload}
+
+
+class _Publisher:
+    def __init__(self, index: int, scenario: Scenario, topics: List[str], url: str):
+        self.index = index
+        self.scenario = scenario
+        self.topics = topics
+        self.url = url
+        self.window = asyncio.Semaphore(scenario.window)
+        self.errors = 0
+
+    def _topic(self, i: int) -> str:
+        return self.topics[(self.index + i) % len(self.topics)]
+
+    def plan(self, start: int, count: int) -> Dict[str, int]:
+        """Events this publisher puts on each topic for messages start..start+count."""
+        counts = {t: 0 for t in self.topics}
+        for i in range(start, start + count):
+            counts[self._topic(i)] += 1
+        return counts
+
+    async def _read_acks(self, ws):
+        async for raw in ws:
+            frame = json.loads(raw)
+            if frame.get("type") == "error" or frame.get("status") not in (None, "ok"):
+                self.errors += 1
+            self.window.release()
+
+    async def _send(self, ws, count: int, pad: str, warmup: bool, offset: int):
+        s = self.scenario
+        step = max(1, s.batch)
+        for start in range(0, count, step):
+            n = min(step, count - start)
+            await self.window.acquire()
+            items = []
+            for i in range(start, start + n):
+                topic = self._topic(offset + i)
+                payload = {"t": time.perf_counter_ns(), "pad": pad}
+                if warmup:
+                    payload["w"] = 1
+                items.append((topic, _message(payload)))
+            if s.batch > 1:
+                await ws.send(json.dumps({"type": "publish_batch",
+                                          "messages": [{"topic": t, "message": m} for t, m in items]}))
+            else:
+                topic, message = items[0]
+                await ws.send(json.dumps({"type": "publish", "topic": topic, "message": message}))
+
+    async def run(self, ready: asyncio.Event, go: asyncio.Event, connected: asyncio.Event):
+        pad = "x" * self.scenario.payload_bytes
+        async with connect(self.url, max_size=None, compression=None) as ws:
+            connected.set()
+            reader = asyncio.create_task(self._read_acks(ws))
+            try:
+                await self._send(ws, self.scenario.warmup, pad, True, 0)
+                for _ in range(self.scenario.window):  # every warmup frame acknowledged
+                    await self.window.acquire()
+                for _ in range(self.scenario.window):
+                    self.window.release()
+                ready.set()
+                await go.wait()
+                await self._send(ws, self.scenario.messages, pad, False, self.scenario.warmup)
+                for _ in range(self.scenario.window):
+                    await self.window.acquire()
+            finally:
+                reader.cancel()
+
+
+class _Subscriber:
+    def __init__(self, client_id: str, topic: str, scenario: Scenario, url: str):
+        self.client_id = client_id
+        self.topic = topic
+        self.scenario = scenario
+        self.url = url
+        self.expected = 0
+        self.received = 0
+        self.latencies: List[int] = []  # ns, measured events only
+        self.last_at = 0
+        self.replay_ns: Optional[int] = None
+        self.replayed = 0
+        self.done = asyncio.Event()
+        self.ws = None
+
+    async def connect(self, replay_until: Optional[int] = None):
+        """Subscribe; with replay_until, also read the replay up to that seq and time it.
+
+        The ring may hold fewer than last_n events (RING_SIZE, RING_MAX_BYTES),
+        so the replay is over once the newest prefilled seq arrives.
+        """
+        s = self.scenario
+        self.ws = await connect(self.url, max_size=None, compression=None)
+        sub = {"type": "subscribe", "topic": self.topic, "client_id": self.client_id, "policy": s.policy,
+               "last_n": s.last_n}
+        if s.sub_batch:
+            sub["batch_max"] = s.sub_batch
+        started = time.perf_counter_ns()
+        await self.ws.send(json.dumps(sub))
+        while True:
+            frame = json.loads(await self.ws.recv())
+            if frame.get("type") == "error":
+                raise RuntimeError(f"subscribe {self.topic} failed: {frame['error']}")
+            if frame.get("type") == "ack":
+                break
+        if replay_until is None:
+            return
+        while True:
+            frame = json.loads(await self.ws.recv())
+            events = frame["events"] if frame.get("type") == "events" else [frame]
+            self.replayed += len(events)
+            if events[-1].get("seq") == replay_until:
+                break
+        self.replay_ns = time.perf_counter_ns() - started
+
+    def _on_event(self, event: Dict[str, Any], now: int):
+        payload = event["message"]["payload"]
+        self.received += 1
+        if "w" not in payload:
+            self.latencies.append(now - payload["t"])
+            self.last_at = now
+
+    async def run(self):
+        async for raw in self.ws:
+            now = time.perf_counter_ns()
+            frame = json.loads(raw)
+            kind = frame.get("type")
+            if kind == "event":
+                self._on_event(frame, now)
+            elif kind == "events":
+                for event in frame["events"]:
+                    self._on_event(event, now)
+            elif kind == "error":
+                break
+            if self.received >= self.expected:
+                break
+        self.done.set()
+
+
+async def _prefill(server: Server, topics: List[str], count: int, pad: str) -> Dict[str, int]:
+    """Publish count events to each topic; returns the last seq per topic."""
+    last: Dict[str, int] = {}
+    async with connect(server.ws, max_size=None, compression=None) as ws:
+        for topic in topics:
+            for start in range(0, count, 500):
+                n = min(500, count - start)
+                await ws.send(json.dumps({"type": "publish_batch", "topic": topic,
+                                          "messages": [{"message": _message({"t": 0, "pad": pad, "w": 1})}
+                                                       for _ in range(n)]}))
+                last[topic] = json.loads(await ws.recv())["results"][-1]["seq"]
+    return last
+
+
+async def run_scenario(server: Server, s: Scenario, timeout: float = 60.0) -> Dict[str, Any]:
+    """Run one scenario against a started server and return its metrics."""
+    run_id = uuid.uuid4().hex[:8]
+    topics = [f"bench.{run_id}.{i}" for i in range(s.topics)]
+    for topic in topics:
+        status = server.request("POST", "/topics", {"name": topic})
+        if status != 200:
+            raise RuntimeError(f"could not create topic {topic}: HTTP {status}")
+    subs: List[_Subscriber] = []
+    try:
+        replay_until: Dict[str, int] = {}
+        if s.last_n:
+            replay_until = await _prefill(server, topics, s.last_n, "x" * s.payload_bytes)
+
+        rss_before = server.rss_kb()
+        subs = [_Subscriber(f"bench-{run_id}-{i}", topics[i % len(topics)], s, server.ws)
+                for i in range(s.subscribers)]
+        await asyncio.wait_for(asyncio.gather(*(sub.connect(replay_until.get(sub.topic)) for sub in subs)),
+                               timeout)
+
+        pubs = [_Publisher(i, s, topics, server.ws) for i in range(s.publishers)]
+        measured = {t: 0 for t in topics}
+        total = {t: 0 for t in topics}
+        for pub in pubs:
+            for topic, n in pub.plan(s.warmup, s.messages).items():
+                measured[topic] += n
+            for topic, n in pub.plan(0, s.warmup + s.messages).items():
+                total[topic] += n
+        for sub in subs:
+            sub.expected = total[sub.topic]
+        sub_tasks = [asyncio.create_task(sub.run()) for sub in subs]
+
+        go = asyncio.Event()
+        ready = [asyncio.Event() for _ in pubs]
+        connected = [asyncio.Event() for _ in pubs]
+        pub_tasks = [asyncio.create_task(p.run(r, go, c)) for p, r, c in zip(pubs, ready, connected)]
+        await asyncio.wait_for(asyncio.gather(*(c.wait() for c in connected)), timeout)
+        rss_after = server.rss_kb()
+        await asyncio.wait_for(asyncio.gather(*(r.wait() for r in ready)), timeout)
+
+        started = time.perf_counter_ns()
+        go.set()
+        await asyncio.wait_for(asyncio.gather(*pub_tasks), timeout)
+        published_at = time.perf_counter_ns()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(sub.done.wait() for sub in subs)), timeout)
+        except asyncio.TimeoutError:
+            pass  # reported through delivered_ratio
+        for task in sub_tasks:
+            task.cancel()
+    finally:
+        for sub in subs:
+            if sub.ws is not None:
+                await sub.ws.close()
+        for topic in topics:
+            server.request("DELETE", f"/topics/{topic}")
+
+    latencies = sorted(lat for sub in subs for lat in sub.latencies)
+    replays = sorted(sub.replay_ns for sub in subs if sub.replay_ns is not None)
+    measured_expected = sum(measured[sub.topic] for sub in subs)
+    delivered = len(latencies)
+    last = max((sub.last_at for sub in subs), default=started)
+    connections = s.publishers + s.subscribers
+    ms = lambda ns: ns / 1e6 if ns is not None else None
+    return {
+        "published": s.publishers * s.messages,
+        "publish_rate": s.publishers * s.messages / ((published_at - started) / 1e9),
+        "delivered": delivered,
+        "delivered_ratio": delivered / measured_expected if measured_expected else 1.0,
+        "delivery_rate": delivered / ((last - started) / 1e9) if last > started else 0.0,
+        "latency_p50_ms": ms(percentile(latencies, 50)),
+        "latency_p99_ms": ms(percentile(latencies, 99)),
+        "latency_p999_ms": ms(percentile(latencies, 99.9)),
+        "latency_max_ms": ms(latencies[-1]) if latencies else None,
+        "replay_p50_ms": ms(percentile(replays, 50)),
+        "replay_p99_ms": ms(percentile(replays, 99)),
+        "replayed_min": min((sub.replayed for sub in subs), default=0) if s.last_n else None,
+        "memory_per_conn_kb": ((rss_after - rss_before) / connections
+                               if rss_before is not None and rss_after is not None else None),
+        "publish_errors": sum(p.errors for p in pubs),
+    }
+
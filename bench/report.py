@@ -0,0 +1,142 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from statistics import median
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+FORMAT_VERSION = 1
+
+# metric -> True if bigger is better; only these take part in comparisons
+DIRECTIONS: Dict[str, bool] = {
+    "publish_rate": True,
+    "delivery_rate": True,
+    "delivered_ratio": True,
+    "latency_p50_ms": False,
+    "latency_p99_ms": False,
+    "latency_p999_ms": False,
+    "replay_p50_ms": False,
+    "replay_p99_ms": False,
+    "memory_per_conn_kb": False,
+}
+
+# absolute differences below these are noise, whatever the relative change
+NOISE_FLOOR: Dict[str, float] = {
+    "latency_p50_ms": 0.1,
+    "latency_p99_ms": 0.1,
+    "latency_p999_ms": 0.1,
+    "replay_p50_ms": 0.1,
+    "replay_p99_ms": 0.1,
+    "memory_per_conn_kb": 16.0,  # RSS moves in pages and allocator arenas
+}
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted sequence (q in 0..100)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))  # ceil without floats drifting
+    return sorted_values[min(len(sorted_values), int(rank)) - 1]
+
+
+def merge_repeats(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of each metric over repeated runs of one scenario."""
+    out: Dict[str, Any] = {}
+    for key in samples[0]:
+        values = [s[key] for s in samples if s.get(key) is not None]
+        if values and all(isinstance(v, (int, float)) for v in values):
+            out[key] = median(values)
+        else:
+            out[key] = samples[0][key]
+    return out
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def make_report(runs: List[Dict[str, Any]], server: str) -> Dict[str, Any]:
+    return {
+        "version": FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "server": server,
+        "runs": runs,
+    }
+
+
+def save(report: Dict[str, Any], path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        report = json.load(f)
+    if report.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported baseline version {report.get('version')!r}")
+    return report
+
+
+def _fmt(value: Any) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}" if abs(value) < 100 else f"{value:.0f}"
+    return str(value)
+
+
+def print_runs(runs: List[Dict[str, Any]], out=sys.stdout):
+    for run in runs:
+        print(f"\n{run['name']}", file=out)
+        for key, value in run["metrics"].items():
+            print(f"  {key:<22} {_fmt(value)}", file=out)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float,
+            out=sys.stdout) -> List[Tuple[str, str, float]]:
+    """Print a metric-by-metric comparison; return (run, metric, change) for every regression.
+
+    A change is relative to the baseline and signed so that positive means
+    worse. Runs present in only one report are listed and otherwise ignored.
+    """
+    regressions: List[Tuple[str, str, float]] = []
+    base_runs = {r["name"]: r for r in baseline["runs"]}
+    cur_runs = {r["name"]: r for r in current["runs"]}
+    print(f"\nbaseline {baseline.get('commit') or '?'} ({baseline.get('created', '?')})"
+          f"  vs  current {current.get('commit') or '?'} ({current.get('created', '?')})", file=out)
+    for name, cur in cur_runs.items():
+        base = base_runs.get(name)
+        if base is None:
+            print(f"\n{name}: not in baseline", file=out)
+            continue
+        print(f"\n{name}", file=out)
+        print(f"  {'metric':<22} {'baseline':>12} {'current':>12} {'change':>9}", file=out)
+        for key, higher_better in DIRECTIONS.items():
+            old, new = base["metrics"].get(key), cur["metrics"].get(key)
+            if old is None or new is None:
+                continue
+            if old == 0:
+                worse = 0.0 if new == old else (1.0 if (new < old) == higher_better else -1.0)
+            else:
+                worse = (old - new) / old if higher_better else (new - old) / old
+            noise = abs(new - old) <= NOISE_FLOOR.get(key, 0.0)
+            flag = "  REGRESSION" if worse > tolerance and not noise else ""
+            if flag:
+                regressions.append((name, key, worse))
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"  {key:<22} {_fmt(old):>12} {_fmt(new):>12} {change:>+8.1f}%{flag}", file=out)
+    for name in base_runs.keys() - cur_runs.keys():
+        print(f"\n{name}: missing from current run", file=out)
+    return regressions
@@ -0,0 +1,4 @@
+import os
+
+# the app logs to a file opened at import; keep test runs from leaving one in the working tree
+os.environ.setdefault("LOG_FILE", os.devnull)
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.pubsub_engine.conflate import ConflatingQueue
+from app.pubsub_engine.pubsub import PubSubManager
+from app.utils import config
+
+
+def msg(key: str, value: int):
+    return {"id": f"{key}-{value}", "payload": {"sym": key, "px": value}}
+
+
+def test_last_values_survive_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PERSIST_DIR", str(tmp_path))
+
+    async def run():
+        before = PubSubManager()
+        await before.create_topic("prices", compact_key="sym")
+        for key, value in (("a", 1), ("b", 1), ("a", 2), ("c", 1), ("b", 2)):
+            await before.publish("prices", msg(key, value))
+        expected = [(ev.seq, ev.key, ev.message) for ev in before.snapshot("prices")]
+        before.close_logs()
+
+        after = PubSubManager()
+        assert await after.load_persisted() == 1
+        assert after.get_topic("prices").compact_key == "sym"
+        assert [(ev.seq, ev.key, ev.message) for ev in after.snapshot("prices")] == expected
+        assert [ev.key for ev in after.snapshot("prices")] == ["a", "c", "b"]
+        after.close_logs()
+
+    asyncio.run(run())
+
+
+class Keyed:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+
+def test_conflating_queue_replaces_in_place():
+    conflated = []
+    q = ConflatingQueue(3, lambda: conflated.append(1))
+    q.put_nowait(Keyed("a", 1))
+    q.put_nowait(Keyed("b", 1))
+    q.put_nowait(Keyed("a", 2))  # replaces a1, keeps a's place ahead of b
+    assert q.qsize() == 2 and len(conflated) == 1
+    assert [(i.key, i.value) for i in (q.get_nowait(), q.get_nowait())] == [("a", 2), ("b", 1)]
+    assert q.empty()
+
+
+def test_conflating_queue_bounds_keys_not_updates():
+    q = ConflatingQueue(2)
+    q.put_nowait(Keyed("a", 1))
+    q.put_nowait(Keyed("b", 1))
+    assert q.full()
+    q.put_nowait(Keyed("b", 2))  # an update to a waiting key always fits
+    with pytest.raises(asyncio.QueueFull):
+        q.put_nowait(Keyed("c", 1))
+    with pytest.raises(asyncio.QueueEmpty):
+        ConflatingQueue(1).get_nowait()
+
+
+def test_conflating_queue_keyless_items_take_their_own_slot():
+    q = ConflatingQueue(0)
+    q.put_nowait(Keyed(None, 1))
+    q.put_nowait(Keyed(None, 2))
+    q.put_nowait(None)  # close sentinel
+    assert q.qsize() == 3
+    assert q.get_nowait().value == 1 and q.get_nowait().value == 2 and q.get_nowait() is None
+
+
+def test_conflating_queue_put_waits_for_room():
+    async def run():
+        q = ConflatingQueue(1)
+        q.put_nowait(Keyed("a", 1))
+        waiter = asyncio.ensure_future(q.put(Keyed("b", 1)))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await q.put(Keyed("a", 2))  # same key: no wait
+        assert q.get_nowait().value == 2
+        await asyncio.wait_for(waiter, 1)
+        assert q.get_nowait().key == "b"
+
+    asyncio.run(run())
+
+
+def test_spilled_events_still_conflate(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SPILL_DIR", str(tmp_path))
+
+    async def run():
+        manager = PubSubManager()
+        await manager.create_topic("prices", compact_key="sym")
+        sub = await manager.subscribe("prices", "s1", None, queue_maxsize=2, policy="spill")
+        for key, value in (("a", 1), ("b", 1), ("c", 1), ("b", 2), ("b", 3), ("a", 2)):
+            await manager.publish("prices", msg(key, value))
+        assert sub.spill.pending == 4  # c1 overflowed, and the rest stay behind it on disk
+
+        got = []
+        while not sub.queue.empty():
+            ev = sub.queue.get_nowait()
+            got.append((ev.key, ev.message["payload"]["px"]))
+            sub.refill()
+        # b3 came back from disk with its key and replaced b2, which was still queued
+        assert got == [("a", 1), ("b", 1), ("c", 1), ("b", 3), ("a", 2)]
+        assert manager.get_topic("prices").conflated == 1
+        await manager.unsubscribe("prices", "s1")
+
+    asyncio.run(run())
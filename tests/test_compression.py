@@ -0,0 +1,120 @@
+import asyncio
+import base64
+import json
+import zlib
+
+from app.pubsub_engine.compression import HEADER, MARKER, TopicCodec, dict_id_of
+from app.pubsub_engine.connection import Connection
+from app.pubsub_engine.pubsub import Event, Subscriber
+from app.utils.util import encode_frame, make_event
+
+
+def decompress(frame: bytes, zdict: bytes = b"") -> bytes:
+    marker, dict_id = HEADER.unpack_from(frame)
+    assert marker == MARKER
+    d = zlib.decompressobj(zdict=zdict) if dict_id else zlib.decompressobj()
+    return d.decompress(frame[HEADER.size:]) + d.flush()
+
+
+def large_event(codec: TopicCodec, seq: int) -> Event:
+    frame = encode_frame(make_event("t", {"id": str(seq), "payload": {"text": "x" * 2000, "n": seq}},
+                                     ts="2024-01-01T00:00:00Z", seq=seq))
+    codec.observe(frame)
+    return Event("t", json.loads(frame)["message"], "2024-01-01T00:00:00Z", seq, frame, codec)
+
+
+def test_codec_without_dictionary_round_trips():
+    codec = TopicCodec(min_bytes=100)
+    assert codec.wants(100) and not codec.wants(99)
+    data = b"hello " * 100
+    frame = codec.compress(data)
+    assert frame[:1] == MARKER and dict_id_of(frame) == 0
+    assert len(frame) < len(data)
+    assert decompress(frame) == data
+
+
+def test_codec_builds_dictionary_after_samples():
+    codec = TopicCodec(min_bytes=100, dict_samples=2)
+    codec.observe("a" * 200)
+    assert codec.dict_id == 0 and codec.zdict == b""
+    codec.observe("b" * 200)
+    assert codec.dict_id and codec.zdict.endswith(b"b" * 200)
+    dict_id, zdict = codec.dict_id, codec.zdict
+    codec.observe("c" * 200)  # dictionary is fixed once built
+    assert (codec.dict_id, codec.zdict) == (dict_id, zdict)
+
+    data = b"ab" * 300
+    frame = codec.compress(data)
+    assert dict_id_of(frame) == dict_id
+    assert decompress(frame, zdict) == data
+
+
+def test_dictionary_ids_are_unique_per_process():
+    a, b = TopicCodec(1, dict_samples=1), TopicCodec(1, dict_samples=1)
+    a.observe("x")
+    b.observe("y")
+    assert a.dict_id != b.dict_id
+
+
+def drain(conn: Connection):
+    return conn._collect()
+
+
+def test_connection_sends_zdict_once_then_compressed_frames():
+    async def run():
+        codec = TopicCodec(min_bytes=100, dict_samples=1)
+        conn = Connection(None)
+        sub = Subscriber("c1", asyncio.Queue(), None, conn=conn, topic="t", compress=True)
+        events = [large_event(codec, seq) for seq in (1, 2)]
+        for ev in events:
+            sub.queue.put_nowait(ev)
+        conn.notify(sub)
+        frames = drain(conn)
+
+        zdict_frame, first, second = frames
+        zd = json.loads(zdict_frame)
+        assert zd["type"] == "zdict" and zd["id"] == codec.dict_id
+        zdict = base64.b64decode(zd["dict"])
+        assert zdict == codec.zdict
+        for frame, ev in ((first, events[0]), (second, events[1])):
+            assert isinstance(frame, bytes) and dict_id_of(frame) == codec.dict_id
+            assert decompress(frame, zdict).decode() == ev.frame
+
+        # a later event on the same connection reuses the dictionary it already has
+        sub.queue.put_nowait(large_event(codec, 3))
+        conn.notify(sub)
+        (third,) = drain(conn)
+        assert json.loads(decompress(third, zdict))["seq"] == 3
+
+    asyncio.run(run())
+
+
+def test_compressed_frame_is_shared_across_connections():
+    async def run():
+        codec = TopicCodec(min_bytes=100)
+        ev = large_event(codec, 1)
+        out = []
+        for client in ("c1", "c2"):
+            conn = Connection(None)
+            sub = Subscriber(client, asyncio.Queue(), None, conn=conn, topic="t", compress=True)
+            sub.queue.put_nowait(ev)
+            conn.notify(sub)
+            out.append(drain(conn))
+        (a,), (b,) = out
+        assert a is b  # compressed once, the same bytes go to both
+        assert decompress(a).decode() == ev.frame
+
+    asyncio.run(run())
+
+
+def test_uncompressing_subscriber_gets_text_frame():
+    async def run():
+        codec = TopicCodec(min_bytes=100)
+        ev = large_event(codec, 1)
+        conn = Connection(None)
+        sub = Subscriber("c1", asyncio.Queue(), None, conn=conn, topic="t")
+        sub.queue.put_nowait(ev)
+        conn.notify(sub)
+        assert drain(conn) == [ev.frame]
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app import main
+from app.pubsub_engine import dedup
+from app.pubsub_engine.dedup import DUPLICATE, DedupIndex, Duplicate, id_key
+from app.pubsub_engine.pubsub import PubSubManager
+from app.utils import config
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", c)
+    return c
+
+
+def test_ids_expire_after_the_window(clock):
+    index = DedupIndex(max_ids=100, window_ms=5000)
+    index.add("a", 1)
+    clock.now += 3
+    index.add("b", 2)
+    assert index.seen("a") == 1
+    clock.now += 2  # a is now exactly window_ms old
+    assert index.seen("a") is None
+    assert index.seen("b") == 2 and len(index) == 1
+    clock.now += 3
+    assert index.seen("b") is None and len(index) == 0
+
+
+def test_ids_evicted_by_count_oldest_first(clock):
+    index = DedupIndex(max_ids=2, window_ms=5000)
+    for seq, key in enumerate("abc", 1):
+        index.add(key, seq)
+    assert index.seen("a") is None
+    assert (index.seen("b"), index.seen("c")) == (2, 3)
+    clock.now += 5  # expiry still lines up with the count-evicted order
+    assert index.seen("c") is None and len(index) == 0
+
+
+def test_without_a_window_only_count_limits(clock):
+    index = DedupIndex(max_ids=10)
+    index.add("a", 1)
+    index.add("a", 9)  # the first seq wins
+    clock.now += 10 ** 6
+    assert index.seen("a") == 1
+
+
+def test_id_key_normalises_uuids():
+    mid = uuid.uuid4()
+    assert id_key({"id": str(mid)}) == mid.bytes
+    assert id_key({"id": str(mid).upper()}) == mid.bytes
+    assert id_key({"id": "custom"}) == "custom"
+    assert id_key({"payload": 1}) is None and id_key("x") is None
+
+
+def msg(mid: str, payload=None):
+    return {"id": mid, "payload": payload}
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(config, "DEDUP_MAX_IDS", 100)
+    monkeypatch.setattr(config, "DEDUP_WINDOW_MS", 60000)
+    return PubSubManager()
+
+
+def test_publish_many_reports_duplicates(manager):
+    async def run():
+        await manager.create_topic("t")
+        sub = await manager.subscribe("t", "s1", None)
+        a, b = str(uuid.uuid4()), str(uuid.uuid4())
+        assert await manager.publish("t", msg(a)) is True
+        seqs = await manager.publish_many([("t", msg(b)), ("t", msg(a)), ("t", msg(b)), ("missing", msg(a))])
+        assert seqs == [2, 1, 2, None]
+        assert [type(s) for s in seqs[:3]] == [int, Duplicate, Duplicate]
+        assert await manager.publish("t", msg(b)) == DUPLICATE
+        assert sub.queue.qsize() == 2  # each id delivered once
+        assert manager.get_topic("t").duplicates == 3
+
+    asyncio.run(run())
+
+
+def test_publish_batch_frame_gets_duplicate_status(monkeypatch, manager):
+    monkeypatch.setattr(main, "manager", manager)
+
+    async def run():
+        await manager.create_topic("t")
+        a = str(uuid.uuid4())
+        results = await main.publish_batch("t", [{"message": msg(a, 1)}, {"message": msg(a, 2)}])
+        assert results == [
+            {"index": 0, "status": "ok", "topic": "t", "seq": 1},
+            {"index": 1, "status": DUPLICATE, "topic": "t", "seq": 1},
+        ]
+
+    asyncio.run(run())
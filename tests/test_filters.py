@@ -0,0 +1,87 @@
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.pubsub_engine.filters import FilterError, compile_filter, path_getter
+
+
+@pytest.mark.parametrize("expr, payload, expected", [
+    ({"status": "created"}, {"status": "created"}, True),
+    ({"status": "created"}, {"status": "paid"}, False),
+    ({"amount": {"$gte": 10, "$lt": 100}}, {"amount": 10}, True),
+    ({"amount": {"$gte": 10, "$lt": 100}}, {"amount": 100}, False),
+    ({"amount": {"$gt": 10}}, {"amount": "lots"}, False),  # incomparable types do not match
+    ({"amount": {"$ne": 1}}, {"amount": 2}, True),
+    ({"amount": {"$ne": 1}}, {}, False),  # missing fields never satisfy a comparison, not even $ne
+    ({"region": {"$in": ["eu", "us"]}}, {"region": "eu"}, True),
+    ({"region": {"$nin": ["eu", "us"]}}, {"region": "eu"}, False),
+    ({"tags": {"$in": [["a"], ["b"]]}}, {"tags": ["b"]}, True),  # unhashable values still work
+    ({"customer.tier": "gold"}, {"customer": {"tier": "gold"}}, True),
+    ({"customer.tier": "gold"}, {"customer": "gold"}, False),
+    ({"x.y": {"$exists": False}}, {"x": {}}, True),
+    ({"x.y": {"$exists": True}}, {"x": {"y": None}}, True),
+    ({"$or": [{"region": "eu"}, {"vip": True}]}, {"region": "ap", "vip": True}, True),
+    ({"$and": [{"a": 1}, {"b": 2}]}, {"a": 1, "b": 3}, False),
+    ({"$not": {"a": 1}}, {"a": 2}, True),
+    ({"status": "created"}, "not an object", False),
+    ({}, {"anything": 1}, True),
+])
+def test_filter_semantics(expr, payload, expected):
+    assert compile_filter(expr)(payload) is expected
+
+
+def test_equal_filters_compile_to_one_predicate():
+    assert compile_filter({"a": 1, "b": {"$gt": 2}}) is compile_filter({"b": {"$gt": 2}, "a": 1})
+    assert compile_filter({"a": 1}) is not compile_filter({"a": 2})
+
+
+@pytest.mark.parametrize("expr, message", [
+    ([], "filter must be an object"),
+    ({"$foo": 1}, "unknown operator: $foo"),
+    ({"a": {"$regex": "x"}}, "unknown operator: $regex"),
+    ({"a": {"$in": 3}}, "$in expects a list"),
+    ({"$or": []}, "$or expects a non-empty list"),
+    ({"$and": {"a": 1}}, "$and expects a non-empty list"),
+    ({"$or": [1]}, "filter must be an object"),
+    ({"a": {1, 2}}, "Object of type set is not JSON serializable"),
+])
+def test_filter_errors(expr, message):
+    with pytest.raises(FilterError) as e:
+        compile_filter(expr)
+    assert str(e.value) == message
+
+
+def test_path_getter():
+    get = path_getter("a.b")
+    assert get({"a": {"b": 3}}) == 3
+    assert get({"a": 1}) is None and get(None) is None
+
+
+def test_subscribe_with_invalid_filter_is_rejected():
+    topic = f"filters-{uuid.uuid4().hex}"
+    with TestClient(app) as client:
+        assert client.post("/topics", json={"name": topic}).status_code == 200
+        with client.websocket_connect("/ws") as ws:
+            ws.send_text(json.dumps({"type": "subscribe", "topic": topic, "client_id": "a", "request_id": "r1",
+                                     "filter": {"n": {"$bogus": 1}}}))
+            out = ws.receive_json()
+            assert out["type"] == "error" and out["request_id"] == "r1"
+            assert out["error"] == {"code": "BAD_REQUEST", "message": "invalid filter: unknown operator: $bogus"}
+
+            # a valid filter on the same socket still works and only passes matching events
+            ws.send_text(json.dumps({"type": "subscribe", "topic": topic, "client_id": "b",
+                                     "filter": {"n": {"$gte": 2}}}))
+            assert ws.receive_json()["type"] == "ack"
+            for n in range(4):
+                ws.send_text(json.dumps({"type": "publish", "topic": topic,
+                                         "message": {"id": str(uuid.uuid4()), "payload": {"n": n}}}))
+            got = []
+            while len(got) < 2:
+                out = ws.receive_json()
+                if out["type"] == "event":
+                    got.append(out["message"]["payload"]["n"])
+            assert got == [2, 3]
+        client.delete(f"/topics/{topic}")
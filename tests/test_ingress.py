@@ -0,0 +1,98 @@
+import uuid
+
+import pytest
+from pydantic import ValidationError
+
+from app.models import ingress
+from app.models.ingress import parse_batch_item, parse_publish, parse_publish_batch
+from app.models.model import BatchItem, PublishBatchMsg, PublishMsg
+
+MID = str(uuid.uuid4())
+
+
+def via_model(data):
+    msg = PublishMsg(**data)
+    return msg.topic, {"id": str(msg.message.id), "payload": msg.message.payload}
+
+
+def outcome(parse, data):
+    try:
+        return "ok", parse(data)
+    except ValidationError as e:
+        return "error", str(e)
+
+
+PUBLISHES = [
+    {"type": "publish", "topic": "t", "message": {"id": MID, "payload": {"a": 1}}},
+    {"type": "publish", "topic": "t", "message": {"id": MID, "payload": None}, "request_id": "r1"},
+    {"type": "publish", "topic": "t", "message": {"id": MID.upper(), "payload": 1}},  # normalised by the model
+    {"type": "publish", "topic": "t", "message": {"id": MID.replace("-", ""), "payload": 1}},
+    {"type": "publish", "topic": "t", "message": {"id": "not-a-uuid", "payload": 1}},
+    {"type": "publish", "topic": "t", "message": {"id": MID}},
+    {"type": "publish", "topic": "t", "message": {"payload": 1}},
+    {"type": "publish", "topic": "t", "message": "text"},
+    {"type": "publish", "topic": 5, "message": {"id": MID, "payload": 1}},
+    {"type": "publish", "message": {"id": MID, "payload": 1}},
+    {"type": "publish", "topic": "t"},
+    {"type": "publish", "topic": "t", "message": {"id": MID, "payload": 1}, "request_id": 7},
+    {"type": "publish", "topic": "t", "message": {"id": 12, "payload": 1}},
+]
+
+
+@pytest.mark.parametrize("data", PUBLISHES)
+def test_parse_publish_matches_the_model(data):
+    assert outcome(parse_publish, data) == outcome(via_model, data)
+
+
+def test_parse_publish_error_text_is_pydantics():
+    data = {"type": "publish", "topic": "t", "message": {"id": "nope", "payload": 1}}
+    with pytest.raises(ValidationError) as fast:
+        parse_publish(data)
+    with pytest.raises(ValidationError) as model:
+        PublishMsg(**data)
+    assert str(fast.value) == str(model.value)
+    assert fast.value.errors() == model.value.errors()
+
+
+def test_well_formed_publish_skips_the_model(monkeypatch):
+    def fail(**_):
+        raise AssertionError("model built on the fast path")
+    monkeypatch.setattr(ingress, "PublishMsg", fail)
+    data = {"type": "publish", "topic": "t", "message": {"id": MID, "payload": [1, 2]}}
+    assert parse_publish(data) == ("t", {"id": MID, "payload": [1, 2]})
+
+
+def item_via_model(raw):
+    item = BatchItem.model_validate(raw)
+    return item.topic, {"id": str(item.message.id), "payload": item.message.payload}
+
+
+@pytest.mark.parametrize("raw", [
+    {"message": {"id": MID, "payload": 1}},
+    {"topic": "t", "message": {"id": MID, "payload": 1}},
+    {"topic": 3, "message": {"id": MID, "payload": 1}},
+    {"message": {"id": "x", "payload": 1}},
+    {"message": {"id": MID.upper(), "payload": 1}},
+    {"topic": "t"},
+    "not an object",
+    None,
+])
+def test_parse_batch_item_matches_the_model(raw):
+    assert outcome(parse_batch_item, raw) == outcome(item_via_model, raw)
+
+
+def batch_via_model(data):
+    msg = PublishBatchMsg(**data)
+    return msg.topic, msg.messages
+
+
+@pytest.mark.parametrize("data", [
+    {"type": "publish_batch", "topic": "t", "messages": []},
+    {"type": "publish_batch", "messages": [1, 2]},
+    {"type": "publish_batch", "topic": 1, "messages": []},
+    {"type": "publish_batch", "topic": "t", "messages": "x"},
+    {"type": "publish_batch", "topic": "t"},
+    {"type": "publish_batch", "messages": [], "request_id": ["r"]},
+])
+def test_parse_publish_batch_matches_the_model(data):
+    assert outcome(parse_publish_batch, data) == outcome(batch_via_model, data)
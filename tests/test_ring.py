@@ -0,0 +1,14 @@
+from app.pubsub_engine.ring import RingBuffer
+
+
+def test_oversize_item_clears_ring_and_keeps_seqs_contiguous():
+    ring = RingBuffer(10, max_bytes=100)
+    for seq in range(1, 5):
+        assert ring.append(seq, 10) == seq
+    assert ring.append(5, 1000) == 5  # larger than max_bytes: not retained
+    assert len(ring) == 0 and ring.bytes == 0
+    assert ring.first_seq == 6
+    assert ring.append(6, 10) == 6
+    assert ring.first_seq == 6
+    assert ring.since(4) == [6]  # seq 5 is missing, and the caller can tell from first_seq
+    assert ring.last(10) == [6]
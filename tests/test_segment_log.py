@@ -0,0 +1,115 @@
+import os
+
+from app.pubsub_engine.segment_log import SegmentLog
+
+
+def frame(seq: int) -> str:
+    return '{"type":"event","topic":"t","seq":%d,"message":{"payload":"%s"}}' % (seq, "x" * 40)
+
+
+def fill(log: SegmentLog, first: int, last: int):
+    for seq in range(first, last + 1):
+        log.append(seq, frame(seq))
+
+
+def seqs(log: SegmentLog, after: int = 0, upto=None):
+    return [seq for seq, _ in log.read(after, upto)]
+
+
+def test_reopen_continues_the_sequence(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    fill(log, 1, 10)
+    log.close()
+    log = SegmentLog(str(tmp_path))
+    assert log.next_seq == 11
+    assert list(log.read(8)) == [(9, frame(9)), (10, frame(10))]
+    log.close()
+
+
+def test_recovery_drops_a_truncated_tail(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    fill(log, 1, 10)
+    log.close()
+    path = log.segments[-1].path
+    os.truncate(path, os.path.getsize(path) - 5)  # crash in the middle of writing record 10
+
+    log = SegmentLog(str(tmp_path))
+    assert log.next_seq == 10
+    assert seqs(log) == list(range(1, 10))
+    log.append(10, frame(10))  # the torn bytes were cut off, so the new record is readable
+    assert seqs(log, 8) == [9, 10]
+    log.close()
+
+
+def test_recovery_drops_a_record_with_a_bad_crc(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    fill(log, 1, 10)
+    log.close()
+    path = log.segments[-1].path
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.seek(size - 3)
+        f.write(b"?")
+
+    log = SegmentLog(str(tmp_path))
+    assert log.next_seq == 10
+    assert os.path.getsize(path) < size
+    assert seqs(log) == list(range(1, 10))
+    log.close()
+
+
+def test_sparse_index_reads_from_the_middle(tmp_path):
+    log = SegmentLog(str(tmp_path), index_interval_bytes=256)
+    fill(log, 1, 100)
+    seg = log.segments[0]
+    assert 1 < len(seg.index_seqs) < 100  # sparse: one entry per ~256 bytes
+    assert seg.index_seqs[0] == 1 and seg.index_offsets[0] == 0
+
+    assert seqs(log, 50, 55) == [51, 52, 53, 54, 55]
+    for after in (0, seg.index_seqs[3] - 1, seg.index_seqs[3], 99):
+        assert seqs(log, after) == list(range(after + 1, 101))
+    assert seg.start_offset(seg.index_seqs[3] - 1) == seg.index_offsets[3]
+    log.close()
+
+    # the index survives a restart
+    reopened = SegmentLog(str(tmp_path), index_interval_bytes=256)
+    assert reopened.segments[0].index_seqs == seg.index_seqs
+    assert seqs(reopened, 50, 55) == [51, 52, 53, 54, 55]
+    reopened.close()
+
+
+def test_reads_span_segments(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=1024, index_interval_bytes=256)
+    fill(log, 1, 100)
+    assert len(log.segments) > 2
+    assert seqs(log) == list(range(1, 101))
+    boundary = log.segments[1].base_seq
+    assert seqs(log, boundary - 2, boundary + 1) == [boundary - 1, boundary, boundary + 1]
+    log.close()
+
+
+def test_retention_by_size_keeps_the_active_segment(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=1024, retention_bytes=3000)
+    fill(log, 1, 200)
+    assert log.size_bytes <= 3000 + 1024
+    assert log.first_seq > 1
+    assert seqs(log) == list(range(log.first_seq, 201))
+    assert sorted(n for n in os.listdir(tmp_path) if n.endswith(".log")) == \
+        ["%020d.log" % s.base_seq for s in log.segments]
+    log.close()
+
+
+def test_retention_by_age(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=1024, retention_ms=60000)
+    fill(log, 1, 100)
+    segments = len(log.segments)
+    log.enforce_retention()
+    assert len(log.segments) == segments  # nothing is old yet
+
+    old = os.path.getmtime(log.segments[0].path) - 3600
+    for seg in log.segments[:-1]:
+        os.utime(seg.path, (old, old))
+    log.enforce_retention()
+    assert len(log.segments) == 1
+    assert seqs(log) == list(range(log.segments[0].base_seq, 101))
+    log.close()
@@ -0,0 +1,101 @@
+import json
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.utils import config
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, "QUEUE_SIZE", 5)
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def topic(client):
+    name = f"sessions-{uuid.uuid4().hex}"
+    client.post("/topics", json={"name": name})
+    yield name
+    client.delete(f"/topics/{name}")
+
+
+def publish(client, topic, n):
+    lines = (json.dumps({"id": str(uuid.uuid4()), "payload": i}) for i in range(n))
+    assert client.post(f"/topics/{topic}/messages", content="\n".join(lines)).status_code == 200
+
+
+def open_session(client, topic, client_id):
+    """Socket with a session and one subscription that has received seqs 1..3; returns (token, socket cm)."""
+    cm = client.websocket_connect("/ws")
+    ws = cm.__enter__()
+    ws.send_text(json.dumps({"type": "session"}))
+    token = ws.receive_json()["token"]
+    ws.send_text(json.dumps({"type": "subscribe", "topic": topic, "client_id": client_id}))
+    assert ws.receive_json()["type"] == "ack"
+    publish(client, topic, 3)
+    assert [ws.receive_json()["seq"] for _ in range(3)] == [1, 2, 3]
+    return token, cm
+
+
+def resume(ws, token, client_id, position):
+    ws.send_text(json.dumps({"type": "session", "token": token, "positions": {client_id: position}}))
+    return ws.receive_json()
+
+
+def events_until_info(ws):
+    seqs = []
+    while True:
+        out = ws.receive_json()
+        if out["type"] == "info":
+            return seqs, out
+        assert out["type"] == "event"
+        seqs.append(out["seq"])
+
+
+def test_resume_inside_grace_replays_the_gap(client, topic):
+    token, cm = open_session(client, topic, "c1")
+    cm.__exit__(None, None, None)  # socket drops; the subscription is parked
+    time.sleep(0.1)
+    publish(client, topic, 10)  # seqs 4..13; only the newest 5 fit the parked queue
+
+    with client.websocket_connect("/ws") as ws:
+        reply = resume(ws, token, "c1", 3)
+        assert reply["type"] == "session" and reply["resumed"] == ["c1"] and reply["lost"] == []
+        seqs, info = events_until_info(ws)
+        assert seqs == list(range(4, 9))  # pushed out of the queue while parked, replayed from the ring
+        assert info["msg"] == "resumed" and info["client_id"] == "c1" and info["missed"] == 0
+        assert [ws.receive_json()["seq"] for _ in range(5)] == list(range(9, 14))  # still queued
+
+        publish(client, topic, 1)
+        assert ws.receive_json()["seq"] == 14
+
+
+def test_gap_info_counts_events_no_longer_retained(client, topic):
+    token, cm = open_session(client, topic, "c1")
+    cm.__exit__(None, None, None)
+    time.sleep(0.1)
+    publish(client, topic, config.RING_SIZE + 10)  # the ring keeps the last RING_SIZE of seqs 4..113
+
+    with client.websocket_connect("/ws") as ws:
+        resume(ws, token, "c1", 3)
+        seqs, info = events_until_info(ws)
+        assert info["missed"] == 10  # seqs 4..13 are gone
+        assert seqs == list(range(14, config.RING_SIZE + 9))
+
+
+def test_resume_after_grace_fails_and_unsubscribes(client, topic, monkeypatch):
+    monkeypatch.setattr(main.sessions, "grace", 0.2)
+    token, cm = open_session(client, topic, "c1")
+    assert main.manager.get_subscriber(topic, "c1") is not None
+    cm.__exit__(None, None, None)
+    time.sleep(0.6)
+    assert main.manager.get_subscriber(topic, "c1") is None
+
+    with client.websocket_connect("/ws") as ws:
+        reply = resume(ws, token, "c1", 3)
+        assert reply["type"] == "error" and reply["error"]["code"] == "SESSION_NOT_FOUND"
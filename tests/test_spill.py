@@ -0,0 +1,48 @@
+import asyncio
+
+from app.pubsub_engine.pubsub import PubSubManager
+from app.pubsub_engine.spill import SpillQueue
+from app.utils import config
+
+
+def test_spill_queue_keeps_order_and_keys(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.push('{"seq":1}', "a", 1.5)
+    spill.push('{"seq":2}')
+    spill.push('{"seq":3}', 7, 3.5)
+    assert spill.pending == 3
+    assert spill.pop() == ('{"seq":1}', "a", 1.5)
+    assert spill.pop() == ('{"seq":2}', None, 0.0)
+    spill.push('{"seq":4}', "b", 4.5)  # written behind what is still unread
+    assert spill.pop() == ('{"seq":3}', 7, 3.5)
+    assert spill.pop() == ('{"seq":4}', "b", 4.5)
+    assert spill.pop() is None and spill.size_bytes == 0
+    spill.close()
+
+
+def test_spilled_events_are_compressed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "COMPRESS_MIN_BYTES", 500)
+
+    async def run():
+        manager = PubSubManager()
+        await manager.create_topic("t")
+        sub = await manager.subscribe("t", "s1", None, queue_maxsize=1, policy="spill", compress=True)
+        await manager.publish("t", {"id": "1", "payload": "x" * 1000})
+        await manager.publish("t", {"id": "2", "payload": "y" * 1000})
+        await manager.publish("t", {"id": "3", "payload": "small"})
+        assert sub.spill.pending == 2
+
+        codec = manager.get_topic("t").codec
+        first = sub.queue.get_nowait()
+        sub.refill()
+        second = sub.queue.get_nowait()
+        sub.refill()
+        third = sub.queue.get_nowait()
+        assert first.codec is codec and second.codec is codec
+        assert first.created < second.created < third.created  # append times survive the spill
+        assert second.zframe[:1] == b"Z"
+        assert third.codec is None  # below COMPRESS_MIN_BYTES before spilling, too
+        await manager.unsubscribe("t", "s1")
+
+    asyncio.run(run())
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from app.pubsub_engine.pubsub import PubSubManager
+from app.pubsub_engine.trie import TopicTrie, is_pattern, validate_pattern
+
+
+@pytest.fixture
+def trie():
+    t = TopicTrie()
+    for pattern in ("orders.*", "orders.#", "orders.*.created", "#", "*.eu", "payments.refunds"):
+        t.add(pattern, "s", pattern)
+    return t
+
+
+@pytest.mark.parametrize("topic, expected", [
+    ("orders", {"orders.#", "#"}),  # '#' matches zero segments, '*' needs exactly one
+    ("orders.42", {"orders.*", "orders.#", "#"}),
+    ("orders.42.created", {"orders.#", "orders.*.created", "#"}),
+    ("orders.42.shipped", {"orders.#", "#"}),
+    ("orders.eu", {"orders.*", "orders.#", "*.eu", "#"}),
+    ("ordersx.1", {"#"}),
+    ("payments.refunds", {"payments.refunds", "#"}),
+    ("payments.refunds.x", {"#"}),
+])
+def test_match(trie, topic, expected):
+    found = trie.match(topic)
+    assert len(found) == len(expected)
+    assert set(found) == expected
+
+
+def test_match_returns_every_subscriber_of_a_pattern():
+    t = TopicTrie()
+    t.add("a.#", "s1", 1)
+    t.add("a.#", "s2", 2)
+    t.add("a.b", "s3", 3)
+    assert sorted(t.match("a.b")) == [1, 2, 3]
+    assert t.count == 3
+
+
+def test_add_and_remove_track_count_and_generation():
+    t = TopicTrie()
+    gen = t.generation
+    t.add("a.*.c", "s1", 1)
+    t.add("a.*.c", "s1", 1)  # re-adding the same key replaces, not counts twice
+    assert t.count == 1 and t.generation > gen
+    assert t.get("a.*.c", "s1") == 1
+    assert t.remove("a.*.c", "missing") is None
+    gen = t.generation
+    assert t.remove("a.*.c", "s1") == 1
+    assert t.count == 0 and t.generation > gen
+    assert t.root.children == {}  # empty branches are pruned
+    assert t.match("a.b.c") == []
+
+
+@pytest.mark.parametrize("pattern, problem", [
+    ("orders.*", None),
+    ("orders.#", None),
+    ("#", None),
+    ("orders..x", "empty topic segment"),
+    ("orders.a*", "wildcard must be a whole segment: 'a*'"),
+    ("orders.#.x", "'#' is only allowed as the last segment"),
+])
+def test_validate_pattern(pattern, problem):
+    assert validate_pattern(pattern) == problem
+
+
+def test_is_pattern():
+    assert is_pattern("a.*") and is_pattern("a.#")
+    assert not is_pattern("a.b")
+
+
+def test_pattern_subscriber_gets_matching_topics():
+    async def run():
+        manager = PubSubManager()
+        for name in ("orders", "orders.eu", "payments"):
+            await manager.create_topic(name)
+        sub = await manager.subscribe("orders.#", "s1", None)
+        for name in ("orders", "orders.eu", "payments"):
+            await manager.publish(name, {"id": name, "payload": name})
+        got = []
+        while not sub.queue.empty():
+            got.append(sub.queue.get_nowait().topic)
+        assert got == ["orders", "orders.eu"]
+
+    asyncio.run(run())